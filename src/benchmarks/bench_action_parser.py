@@ -0,0 +1,60 @@
+"""
+Per call time of ActionParser.get_valid_actions (array version) against the per unit loop it replaced, and of the
+sparse per entity valid actions with their size against the dense ones, on game states of random games at a few points
+of the game. --init-metal gives the factories more metal to start with, for the crowded
+boards of later training games.
+
+    python -m benchmarks.bench_action_parser --seeds 2 --steps 100 300 600 --repeat 50 --init-metal 1000
+"""
+import argparse
+
+import tree
+
+from benchmarks.bench_feature_parser import per_call_ms
+from benchmarks.utils import early_game, random_actions
+from kit.kit import obs_to_game_state
+from luxai_s2 import LuxAI_S2
+from parsers import ActionParser
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seeds", type=int, default=2)
+    parser.add_argument("--steps", type=int, nargs="+", default=[100, 300, 600])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--init-metal", type=int, default=None)
+    parser.add_argument("--build-prob", type=float, default=0.3)
+    parser.add_argument("--max-entity-number", type=int, default=500)
+    args = parser.parse_args()
+
+    for seed in range(args.seeds):
+        kwargs = dict(verbose=0, validate_action_space=False, FACTORY_WATER_CONSUMPTION=0)
+        if args.init_metal is not None:
+            kwargs["INIT_WATER_METAL_PER_FACTORY"] = args.init_metal
+        env = LuxAI_S2(**kwargs)
+        obs, rng = early_game(env, seed)
+        for step in range(max(args.steps) + 1):
+            if step in args.steps:
+                game_state = obs_to_game_state(env.env_steps, env.env_cfg, obs["player_0"])
+                loop = per_call_ms(lambda: ActionParser.get_valid_actions_loop(game_state, 0), args.repeat)
+                array = per_call_ms(lambda: ActionParser.get_valid_actions(game_state, 0), args.repeat)
+                sparse = per_call_ms(
+                    lambda: ActionParser.get_sparse_valid_actions(game_state, 0, args.max_entity_number), args.repeat
+                )
+                dense_bytes = sum(x.nbytes for x in tree.flatten(ActionParser.get_valid_actions(game_state, 0)))
+                sparse_bytes = sum(
+                    x.nbytes for x in tree.flatten(ActionParser.get_sparse_valid_actions(game_state, 0, args.max_entity_number))
+                )
+                n_units = len(game_state.units["player_0"])
+                print(
+                    f"seed {seed} step {step:4d} ({n_units:3d} own units): "
+                    f"loop {loop:.3f}ms, array {array:.3f}ms ({loop / array:.2f}x), "
+                    f"sparse {sparse:.3f}ms, {dense_bytes // 1024}KiB dense, {sparse_bytes // 1024}KiB sparse"
+                )
+            obs, _, terminations, _, _ = env.step(random_actions(obs, env.agents, rng, args.build_prob))
+            if terminations["player_0"] or terminations["player_1"]:
+                break
+
+
+if __name__ == "__main__":
+    main()
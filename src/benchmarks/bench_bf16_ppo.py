@@ -0,0 +1,69 @@
+"""
+Fixed seed PPO runs of train.py in float32 and under --bf16, reporting the losses, returns and SPS of both. The first
+update of both runs trains on the same rollout, so its losses show the precision loss of bf16 alone. Later updates
+sample different actions and the runs drift apart like runs of two seeds, compare them over several --seeds.
+
+    python -m benchmarks.bench_bf16_ppo --seeds 0 1 2 --updates 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from tensorboard.backend.event_processing.event_accumulator import EventAccumulator
+
+TAGS = ["losses/policy_loss_total", "losses/value_loss_total", "losses/entropy_total", "losses/approx_kl_total",
+        "charts/episodic_total_return", "charts/SPS"]
+
+
+def run(save_dir: str, seed: int, updates: int, num_envs: int, num_steps: int, bf16: bool) -> dict:
+    """
+    the logged (step, value) pairs of TAGS of a train.py run
+    """
+    subprocess.run(
+        [sys.executable, "train.py", "--cuda", "False", "--seed", str(seed), "--num-envs", str(num_envs),
+         "--num-steps", str(num_steps), "--total-timesteps", str(updates * num_envs * num_steps),
+         "--train-num-collect", str(num_envs * num_steps), "--num-minibatches", "2", "--update-epochs", "2",
+         "--save-interval", "0", "--evaluate-interval", "0", "--save-dir", save_dir, "--bf16", str(bf16)],
+        check=True, capture_output=True,
+    )
+    events = EventAccumulator(save_dir)
+    events.Reload()
+    return {tag: [(event.step, event.value) for event in events.Scalars(tag)] for tag in TAGS}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--updates", type=int, default=10)
+    parser.add_argument("--num-envs", type=int, default=2)
+    parser.add_argument("--num-steps", type=int, default=32)
+    args = parser.parse_args()
+
+    results = {"fp32": [], "bf16": []}
+    with tempfile.TemporaryDirectory() as directory:
+        for seed in args.seeds:
+            for name in results:
+                save_dir = os.path.join(directory, f"{name}_{seed}")
+                results[name].append(run(save_dir, seed, args.updates, args.num_envs, args.num_steps, name == "bf16"))
+
+    print("first update, same rollout (mean over seeds of the update's minibatches)")
+    for tag in TAGS[:4]:
+        first = {
+            name: np.mean([np.mean([value for step, value in r[tag] if step == r[tag][0][0]]) for r in runs])
+            for name, runs in results.items()
+        }
+        print(f"  {tag:32s} fp32 {first['fp32']:12.6g}  bf16 {first['bf16']:12.6g}")
+    print(f"all {args.updates} updates (mean over seeds and updates, +- std over seeds)")
+    for tag in TAGS:
+        line = []
+        for name, runs in results.items():
+            means = [np.mean([value for _, value in r[tag]]) for r in runs]
+            line.append(f"{name} {np.mean(means):12.6g} +- {np.std(means):10.4g}")
+        print(f"  {tag:32s} " + "  ".join(line))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+SimpleNet eager against SimpleNet.compile_forward (torch.compile, entity counts padded to buckets) on observations of a
+game played by the policy. Reports the latency of rollout inference (eval mode, sampling actions for --num-envs
+observations at a time), of the training mode forward of rollouts (train.py samples in training mode for the values),
+and of training steps (forward, backward and Adam step over --minibatch-size observations), and how long the first
+calls take to compile.
+
+    python -m benchmarks.bench_compile --num-envs 16 --minibatch-size 32
+"""
+import argparse
+import copy
+import time
+
+import torch
+
+from benchmarks.bench_mixed_precision import batch, play
+from policy.simple_net import SimpleNet
+
+
+def milliseconds(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-envs", type=int, default=16)
+    parser.add_argument("--minibatch-size", type=int, default=32)
+    parser.add_argument("--max-entity-number", type=int, default=500)
+    parser.add_argument("--start-step", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--learning-rate", type=float, default=2e-4)
+    parser.add_argument("--mode", default="default", help="torch.compile mode")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = SimpleNet(args.max_entity_number, seed=0)
+    features, va = play(max(args.num_envs, args.minibatch_size), args.max_entity_number, net, args.start_step)
+    rollout_features, rollout_va = batch(features, va, args.num_envs)
+    train_features, train_va = batch(features, va, args.minibatch_size)
+    with torch.no_grad():
+        logp, _, target_action, _ = copy.deepcopy(net).train()(*train_features, train_va)
+    valid = logp != 0
+    target_value = torch.randn(logp.shape) * valid
+
+    nets = {"eager": copy.deepcopy(net), "compiled": copy.deepcopy(net).compile_forward(mode=args.mode)}
+    for name, model in nets.items():
+        def rollout():
+            with torch.no_grad():
+                model(*rollout_features, rollout_va)
+
+        optimizer = torch.optim.Adam(model.parameters(), lr=args.learning_rate, eps=1e-5)
+
+        def train_step():
+            logp, value, _, _ = model(*train_features, train_va, target_action)
+            loss = -logp[valid].mean() + 0.5 * ((value - target_value)[valid] ** 2).mean()
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+
+        times = {}
+        for phase, mode, fn in [("eval rollout", "eval", rollout), ("train rollout", "train", rollout), ("train step", "train", train_step)]:
+            getattr(model, mode)()
+            # the first call compiles
+            first = milliseconds(fn, 1)
+            times[phase] = (first, milliseconds(fn, args.repeat))
+        print(f"{name:>8}: " + ", ".join(f"{phase} {ms:7.1f} ms (first call {first / 1000:5.1f} s)" for phase, (first, ms) in times.items()))
+
+
+if __name__ == "__main__":
+    main()
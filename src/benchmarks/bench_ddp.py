@@ -0,0 +1,96 @@
+"""
+Data parallel training steps of SimpleNet (train.py --num-ranks) with 1, 2 and 4 gloo ranks on localhost. Every rank
+trains a DistributedDataParallel SimpleNet on --minibatch-size observations of a game played by the policy, so the
+global batch grows with the ranks. Reports the samples per second of all ranks together, the scaling efficiency against
+one rank and the time of the all-reduce of the gradients alone. The ranks share the cores of the machine, a rank gets
+cores // ranks threads.
+
+    python -m benchmarks.bench_ddp --ranks 1 2 4 --minibatch-size 32 --train-steps 5
+"""
+import argparse
+import copy
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+from benchmarks.bench_mixed_precision import batch, play
+from policy.simple_net import SimpleNet
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_rank(rank: int, world_size: int, port: int, args, results):
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size)
+    try:
+        torch.manual_seed(rank)
+        net = SimpleNet(args.max_entity_number, seed=0)
+        features, va = play(args.minibatch_size, args.max_entity_number, net, args.start_step, seed=rank)
+        features, va = batch(features, va, args.minibatch_size)
+        with torch.no_grad():
+            logp, _, action, _ = copy.deepcopy(net).train()(*features, va)
+        valid = logp != 0
+        target_value = torch.randn(logp.shape) * valid
+
+        model = DistributedDataParallel(net.train(), find_unused_parameters=True)
+        optimizer = torch.optim.Adam(model.parameters(), lr=2e-4, eps=1e-5)
+
+        def train_step():
+            logp, value, _, _ = model(*features, va, action)
+            loss = -logp[valid].mean() + 0.5 * ((value - target_value)[valid] ** 2).mean()
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+
+        grads = torch.zeros(sum(p.numel() for p in net.parameters()))
+
+        def all_reduce():
+            dist.all_reduce(grads)
+
+        for name, fn, repeat in [("train", train_step, args.train_steps), ("all_reduce", all_reduce, args.train_steps * 4)]:
+            fn()
+            dist.barrier()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            # the slowest rank sets the pace of all of them
+            seconds = torch.tensor((time.perf_counter() - start) / repeat)
+            dist.all_reduce(seconds, op=dist.ReduceOp.MAX)
+            if rank == 0:
+                results[name] = seconds.item()
+    finally:
+        dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ranks", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--minibatch-size", type=int, default=32)
+    parser.add_argument("--max-entity-number", type=int, default=500)
+    parser.add_argument("--start-step", type=int, default=20)
+    parser.add_argument("--train-steps", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores")
+    print("ranks  samples/s  efficiency  step ms  all-reduce ms")
+    base = None
+    for world_size in args.ranks:
+        results = mp.Manager().dict()
+        mp.spawn(run_rank, args=(world_size, free_port(), args, results), nprocs=world_size)
+        sps = world_size * args.minibatch_size / results["train"]
+        base = base or sps / world_size
+        print(f"{world_size:5d} {sps:10.1f} {sps / (world_size * base):11.2f} {results['train'] * 1000:8.1f} "
+              f"{results['all_reduce'] * 1000:14.2f}")
+
+
+if __name__ == "__main__":
+    main()
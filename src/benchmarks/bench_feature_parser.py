@@ -0,0 +1,57 @@
+"""
+Per call time of FeatureParser._get_feature (array version with cached terrain planes) against the per entity loop
+it replaced, on game states of random games at a few points of the game.
+
+    python -m benchmarks.bench_feature_parser --seeds 2 --steps 100 300 600 --repeat 50
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.utils import early_game, random_actions
+from kit.kit import obs_to_game_state
+from luxai_s2 import LuxAI_S2
+from parsers import FeatureParser
+
+
+def per_call_ms(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seeds", type=int, default=2)
+    parser.add_argument("--steps", type=int, nargs="+", default=[100, 300, 600])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    feature_parser = FeatureParser()
+    for seed in range(args.seeds):
+        env = LuxAI_S2(verbose=0, validate_action_space=False, FACTORY_WATER_CONSUMPTION=0)
+        obs, rng = early_game(env, seed)
+        for step in range(max(args.steps) + 1):
+            if step in args.steps:
+                game_state = obs_to_game_state(env.env_steps, env.env_cfg, obs["player_0"])
+                static_planes = feature_parser._static_planes(game_state)
+                loop = per_call_ms(lambda: feature_parser._get_feature_loop(game_state, "player_0"), args.repeat)
+                array = per_call_ms(
+                    lambda: feature_parser._get_feature(game_state, "player_0", static_planes=static_planes),
+                    args.repeat,
+                )
+                n_units = sum(len(units) for units in game_state.units.values())
+                n_factories = sum(len(factories) for factories in game_state.factories.values())
+                print(
+                    f"seed {seed} step {step:4d} ({n_units:3d} units, {n_factories:2d} factories): "
+                    f"loop {loop:.3f}ms, array {array:.3f}ms ({loop / array:.2f}x)"
+                )
+            obs, _, terminations, _, _ = env.step(random_actions(obs, env.agents, rng))
+            if terminations["player_0"] or terminations["player_1"]:
+                break
+
+
+if __name__ == "__main__":
+    main()
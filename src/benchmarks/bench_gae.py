@@ -0,0 +1,47 @@
+"""
+Time of the GAE advantages of one player's rollout, [num_steps, num_envs, max_entity_number] like train.py stores them,
+with the per step loop against the scan over all steps.
+
+    python -m benchmarks.bench_gae --num-steps 256 1024 --num-envs 16 --device cpu
+"""
+import argparse
+import time
+
+import torch
+
+from rollout import gae_loop, gae_scan
+
+
+def per_call_ms(fn, repeat: int, device: str) -> float:
+    fn()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-steps", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--num-envs", type=int, default=16)
+    parser.add_argument("--max-entity-number", type=int, default=500)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for num_steps in args.num_steps:
+        shape = (num_steps, args.num_envs, args.max_entity_number)
+        rewards = torch.randn(shape, device=args.device)
+        values = torch.randn(shape, device=args.device)
+        dones = (torch.rand(shape, device=args.device) < 0.01).float()
+        loop = per_call_ms(lambda: gae_loop(rewards, values, dones, 0.99, 0.95), args.repeat, args.device)
+        scan = per_call_ms(lambda: gae_scan(rewards, values, dones, 0.99, 0.95), args.repeat, args.device)
+        print(f"num_steps {num_steps:5d} on {args.device}: loop {loop:8.2f}ms, scan {scan:8.2f}ms ({loop / scan:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compares the incremental lichen growth cache of Factory.cache_water_info against recomputing the BFS every step.
+
+Two envs play the same random games in lockstep, one of them has its factory caches dropped before every step so
+it always runs the full search. Both must end up with the same lichen growth information.
+
+    python -m benchmarks.bench_lichen --seeds 4 --steps 500
+"""
+import argparse
+import time
+
+from benchmarks.utils import early_game, random_actions
+from luxai_s2 import LuxAI_S2
+
+
+def make_env():
+    # no water consumption so factories survive and keep watering lichen
+    return LuxAI_S2(
+        collect_stats=True,
+        verbose=0,
+        validate_action_space=False,
+        FACTORY_WATER_CONSUMPTION=0,
+    )
+
+
+def factories(env):
+    return [f for agent in env.agents for f in env.state.factories[agent].values()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seeds", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=500)
+    args = parser.parse_args()
+
+    cached_time, full_time, total_steps = 0.0, 0.0, 0
+    searches, calls = 0, 0
+    for seed in range(args.seeds):
+        cached_env, full_env = make_env(), make_env()
+        obs, rng = early_game(cached_env, seed)
+        early_game(full_env, seed)
+        for _ in range(args.steps):
+            actions = random_actions(obs, cached_env.agents, rng)
+
+            before = {f.unit_id: f._water_info_cache for f in factories(cached_env)}
+            start = time.perf_counter()
+            obs, _, terminations, _, _ = cached_env.step(actions)
+            cached_time += time.perf_counter() - start
+            for f in factories(cached_env):
+                if f.unit_id in before:
+                    calls += 1
+                    searches += f._water_info_cache is not before[f.unit_id]
+
+            for f in factories(full_env):
+                f._water_info_cache = None
+            start = time.perf_counter()
+            full_env.step(actions)
+            full_time += time.perf_counter() - start
+            total_steps += 1
+
+            for a, b in zip(factories(cached_env), factories(full_env)):
+                assert a.grow_lichen_positions == b.grow_lichen_positions
+                assert a.connected_lichen_positions == b.connected_lichen_positions
+            if terminations["player_0"] or terminations["player_1"]:
+                break
+
+    print(f"full search every step: {full_time / total_steps * 1000:.2f}ms/step")
+    print(
+        f"incremental cache:      {cached_time / total_steps * 1000:.2f}ms/step "
+        f"({full_time / cached_time:.2f}x, search ran for {searches / max(calls, 1):.0%} of factory updates)"
+    )
+
+
+if __name__ == "__main__":
+    main()
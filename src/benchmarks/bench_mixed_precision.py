@@ -0,0 +1,129 @@
+"""
+SimpleNet in float32 against bf16 autocast (SimpleNet(bf16=True)) on observations of a game played by the policy.
+Reports samples per second of rollout inference (eval mode, sampling actions for --num-envs observations at a time) and
+of training steps (forward, backward and Adam step in training mode over --minibatch-size observations), and the loss
+of both over --train-steps steps of fitting the same batch: the log probs of fixed sampled actions and the values of
+fixed target returns, a stand-in for the PPO loss with the same forward and backward.
+
+    python -m benchmarks.bench_mixed_precision --num-envs 16 --minibatch-size 32 --train-steps 30
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import torch
+import tree
+
+from luxenv import LuxEnv, valid_actions_to_torch
+from policy.simple_net import SimpleNet
+
+FEATURE_NAMES = ["global_feature", "map_feature", "factory_feature", "unit_feature", "location_feature"]
+
+
+def play(num_samples: int, max_entity_number: int, net: SimpleNet, start_step: int, seed: int = 0) -> tuple[list, dict]:
+    """
+    features and valid actions of both players along a game the net plays from start_step on, batched
+    """
+    np2torch = lambda x, dtype: torch.tensor(np.array(x)[None], dtype=dtype)
+    env = LuxEnv(max_entity_number=max_entity_number)
+    env.current_seed = seed
+    obs, _ = env.reset()
+    samples = []
+    net.eval()
+    step = 0
+    while len(samples) < num_samples:
+        actions = {}
+        for player_id in range(2):
+            features = [
+                np2torch(obs[f"player_{player_id}"][name], torch.int32 if name == "location_feature" else torch.float32)
+                for name in FEATURE_NAMES
+            ]
+            va = valid_actions_to_torch(env.action_parser.get_valid_actions(env.game_state[player_id], player_id), np2torch)
+            with torch.no_grad():
+                _, _, action, _ = net(*features, va)
+            if step >= start_step:
+                samples.append((features, va))
+            actions[player_id] = tree.map_structure(lambda x: x[0].numpy().astype(np.int32), action)
+        obs, _, _, _, _ = env.step(actions)
+        step += 1
+    features = [torch.cat([sample[0][i] for sample in samples[:num_samples]]) for i in range(len(FEATURE_NAMES))]
+    va = tree.map_structure(lambda *xs: torch.cat(xs), *[sample[1] for sample in samples[:num_samples]])
+    return features, va
+
+
+def batch(features: list, va: dict, size: int) -> tuple[list, dict]:
+    """
+    the first size samples, repeated if there are fewer
+    """
+    index = torch.arange(size) % features[0].shape[0]
+    return [x[index] for x in features], tree.map_structure(lambda x: x[index], va)
+
+
+def samples_per_second(fn, samples: int, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return samples * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-envs", type=int, default=16)
+    parser.add_argument("--minibatch-size", type=int, default=32)
+    parser.add_argument("--max-entity-number", type=int, default=500)
+    parser.add_argument("--start-step", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--train-steps", type=int, default=30)
+    parser.add_argument("--learning-rate", type=float, default=2e-4)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = SimpleNet(args.max_entity_number, seed=0)
+    features, va = play(max(args.num_envs, args.minibatch_size), args.max_entity_number, net, args.start_step)
+
+    rollout_features, rollout_va = batch(features, va, args.num_envs)
+    train_features, train_va = batch(features, va, args.minibatch_size)
+    # targets to fit: actions sampled from the policy and random returns of the entities with a log prob. Sampled in
+    # training mode, the batch norm running stats of the untrained net saturate the eval mode log probs
+    with torch.no_grad():
+        logp, _, target_action, _ = copy.deepcopy(net).train()(*train_features, train_va)
+    valid = logp != 0
+    target_value = torch.randn(logp.shape) * valid
+
+    nets = {"fp32": copy.deepcopy(net), "bf16": copy.deepcopy(net)}
+    nets["bf16"].bf16 = True
+    curves = {}
+    for name, model in nets.items():
+        def rollout():
+            with torch.no_grad():
+                model(*rollout_features, rollout_va)
+
+        optimizer = torch.optim.Adam(model.parameters(), lr=args.learning_rate, eps=1e-5)
+
+        def train_step() -> float:
+            logp, value, _, _ = model(*train_features, train_va, target_action)
+            loss = -logp[valid].mean() + 0.5 * ((value - target_value)[valid] ** 2).mean()
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+            return loss.item()
+
+        model.eval()
+        rollout_sps = samples_per_second(rollout, args.num_envs, args.repeat)
+        # the curve starts from the same weights for both
+        model.load_state_dict(net.state_dict())
+        model.train()
+        curves[name] = [train_step() for _ in range(args.train_steps)]
+        train_sps = samples_per_second(train_step, args.minibatch_size, args.repeat)
+        print(f"{name}: rollout {rollout_sps:7.1f} samples/s, train {train_sps:7.1f} samples/s")
+
+    print("step   fp32 loss   bf16 loss")
+    for step in range(0, args.train_steps, max(args.train_steps // 10, 1)):
+        print(f"{step:4d} {curves['fp32'][step]:11.5f} {curves['bf16'][step]:11.5f}")
+    print(f"{args.train_steps - 1:4d} {curves['fp32'][-1]:11.5f} {curves['bf16'][-1]:11.5f}")
+
+
+if __name__ == "__main__":
+    main()
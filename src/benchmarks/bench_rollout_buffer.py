@@ -0,0 +1,171 @@
+"""
+Per step bookkeeping of train.py's lockstep rollout: turning the arrays of a vector env step into tensors and storing
+them with the observations, valid actions, actions, log probs and values of the step. Before is the recursive
+put_into_store / reset_store of nested dicts fed by np2torch copies, after is RolloutBuffer. The data is random but
+shaped like the data of LuxSyncVectorEnv with dense valid actions, so no game is played.
+
+    python -m benchmarks.bench_rollout_buffer --num-envs 16 --num-steps 256
+"""
+import argparse
+import gc
+import time
+
+import numpy as np
+import torch
+
+from rollout import RolloutBuffer
+
+PLAYERS = ["player_0", "player_1"]
+MAP_SIZE = 48
+OBS_CHANNELS = dict(map_feature=6, factory_feature=6, unit_feature=4, location_feature=2)
+VALID_ACTION_SHAPES = dict(
+    factory_act=(4,), move=(5, 2), transfer=(5, 5, 2), pickup=(5, 2), dig=(2,), self_destruct=(2,), recharge=(2,),
+    do_nothing=(),
+)
+
+
+def np2torch(x, dtype):
+    return torch.tensor(x, device="cpu", dtype=dtype)
+
+
+# the stores of train.py before RolloutBuffer
+def put_into_store(data: dict, ind: int, store: dict, max_train_step: int, num_envs: int, device):
+    for key, value in data.items():
+        if isinstance(value, dict):
+            if key not in store:
+                store[key] = {}
+            put_into_store(value, ind, store[key], max_train_step, num_envs, device)
+        else:
+            if key not in store:
+                store[key] = torch.zeros((max_train_step, num_envs) + value.shape[1:], device=device, dtype=value.dtype)
+            store[key][ind] = value
+
+
+def reset_store(store: dict):
+    for key, value in store.items():
+        if isinstance(value, dict):
+            reset_store(store[key])
+        else:
+            if store[key].dtype in {torch.float32, torch.float64, torch.int32, torch.int64}:
+                store[key][:] = 0
+            elif store[key].dtype in {torch.bool}:
+                store[key][:] = False
+            else:
+                raise NotImplementedError(f"store[key].dtype={store[key].dtype}")
+
+
+def make_step(num_envs: int, max_entity_number: int, rng: np.random.Generator) -> dict:
+    """
+    the arrays of one env step and the tensors the policy returns for it
+    """
+    def obs():
+        player_obs = {"global_feature": rng.random((num_envs, 2))}
+        for key, channels in OBS_CHANNELS.items():
+            player_obs[key] = rng.random((num_envs, channels, MAP_SIZE, MAP_SIZE))
+        return player_obs
+
+    def valid_action():
+        return {
+            key: torch.from_numpy(rng.random((num_envs,) + shape + (MAP_SIZE, MAP_SIZE)) < 0.5)
+            for key, shape in VALID_ACTION_SHAPES.items()
+        }
+
+    return dict(
+        obs={player: obs() for player in PLAYERS},
+        valid_action={player: valid_action() for player in PLAYERS},
+        action={player: {
+            "factory_act": torch.from_numpy(rng.integers(0, 4, (num_envs, MAP_SIZE, MAP_SIZE))),
+            "unit_act": torch.from_numpy(rng.integers(0, 9, (num_envs, 6, MAP_SIZE, MAP_SIZE))),
+        } for player in PLAYERS},
+        logprob={player: torch.randn(num_envs, max_entity_number) for player in PLAYERS},
+        value={player: torch.randn(num_envs, max_entity_number) for player in PLAYERS},
+        reward=rng.random((num_envs, 2, max_entity_number), dtype=np.float32),
+        done=rng.random((num_envs, 2, max_entity_number)) < 0.01,
+    )
+
+
+def run_stores(step_data: dict, num_steps: int, num_envs: int, max_entity_number: int) -> tuple[float, float]:
+    obs, actions, valid_actions = {}, {}, {}
+    logprobs, rewards, dones, values = (
+        {player: torch.zeros((num_steps, num_envs, max_entity_number)) for player in PLAYERS} for _ in range(4)
+    )
+    next_done = torch.zeros((num_envs, 2, max_entity_number), dtype=torch.bool)
+    next_obs = {player: {key: np2torch(x, torch.float32) for key, x in value.items()} for player, value in step_data["obs"].items()}
+    step_times = []
+    # the first rollout allocates the stores
+    for _ in range(2):
+        start = time.perf_counter()
+        for train_step in range(num_steps):
+            for player_id, player in enumerate(PLAYERS):
+                for env_id in range(0, num_envs):
+                    dones[player][train_step, env_id] = next_done[env_id, player_id]
+            put_into_store(next_obs, train_step, obs, num_steps, num_envs, "cpu")
+            put_into_store(step_data["action"], train_step, actions, num_steps, num_envs, "cpu")
+            put_into_store(step_data["valid_action"], train_step, valid_actions, num_steps, num_envs, "cpu")
+            for player in PLAYERS:
+                logprobs[player][train_step] = step_data["logprob"][player]
+                values[player][train_step] = step_data["value"][player]
+            next_obs = {player: {key: np2torch(x, torch.float32) for key, x in value.items()} for player, value in step_data["obs"].items()}
+            reward = np2torch(step_data["reward"], torch.float32)
+            next_done = np2torch(step_data["done"], torch.bool)
+            for player_id, player in enumerate(PLAYERS):
+                rewards[player][train_step] = reward[:, player_id]
+        step_times.append((time.perf_counter() - start) / num_steps)
+        start = time.perf_counter()
+        reset_store(obs)
+        reset_store(actions)
+        reset_store(valid_actions)
+        for player in PLAYERS:
+            logprobs[player][:] = 0
+            rewards[player][:] = 0
+            dones[player][:] = 0
+            values[player][:] = 0
+        reset_time = time.perf_counter() - start
+    return step_times[-1], reset_time
+
+
+def per_player(x):
+    return dict(player_0=x[:, 0], player_1=x[:, 1])
+
+
+def run_buffer(step_data: dict, num_steps: int, num_envs: int, pin_memory: bool) -> tuple[float, float]:
+    buffer = RolloutBuffer(num_steps, num_envs, pin_memory=pin_memory)
+    next_done = np.zeros_like(step_data["done"])
+    buffer.insert(0, {"obs": step_data["obs"], "dones": per_player(next_done)}, dtype=torch.float32)
+    step_times = []
+    for _ in range(2):
+        start = time.perf_counter()
+        for train_step in range(num_steps):
+            buffer.row(train_step, "obs")
+            buffer.insert(train_step, {
+                "actions": step_data["action"], "valid_actions": step_data["valid_action"],
+                "logprobs": step_data["logprob"], "values": step_data["value"],
+            })
+            buffer.insert(train_step, {"rewards": per_player(step_data["reward"])}, dtype=torch.float32)
+            buffer.insert(train_step + 1, {"obs": step_data["obs"], "dones": per_player(step_data["done"])}, dtype=torch.float32)
+        step_times.append((time.perf_counter() - start) / num_steps)
+        start = time.perf_counter()
+        buffer.reset()
+        reset_time = time.perf_counter() - start
+    return step_times[-1], reset_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-envs", type=int, default=16)
+    parser.add_argument("--num-steps", type=int, default=256)
+    parser.add_argument("--max-entity-number", type=int, default=500)
+    parser.add_argument("--pin-memory", action="store_true")
+    args = parser.parse_args()
+
+    step_data = make_step(args.num_envs, args.max_entity_number, np.random.default_rng(0))
+    before_step, before_reset = run_stores(step_data, args.num_steps, args.num_envs, args.max_entity_number)
+    gc.collect()
+    after_step, after_reset = run_buffer(step_data, args.num_steps, args.num_envs, args.pin_memory)
+    print(f"{args.num_envs} envs x {args.num_steps} steps: per step stores {before_step * 1000:.2f} ms, "
+          f"buffer {after_step * 1000:.2f} ms ({before_step / after_step:.2f}x); per rollout reset stores "
+          f"{before_reset * 1000:.1f} ms, buffer {after_reset * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+SimpleNet.unit_actor (the act type head and the param heads of all types fused into one projection, one sampling pass
+per param) against unit_actor_per_type (a pass of the param heads per act type over the units of that type) on random
+unit embeddings and valid actions. Reports the time of sampling actions and of the forward and backward of the log
+probs of given actions, and the number of aten ops of a forward, per number of units.
+
+    python -m benchmarks.bench_unit_heads --units 16 64 256
+"""
+import argparse
+import time
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from policy.simple_net import SimpleNet
+
+VA_SHAPES = dict(move=(5, 2), transfer=(5, 5, 2), pickup=(5, 2), dig=(2,), self_destruct=(2,), recharge=(2,), do_nothing=())
+
+
+def random_units(n_units: int, dims: int) -> tuple[torch.Tensor, dict]:
+    x = torch.randn(n_units, dims)
+    va = {name: torch.rand((n_units,) + shape) < 0.6 for name, shape in VA_SHAPES.items()}
+    va['act_type'] = torch.stack([va[name].flatten(1).any(1) if va[name].dim() > 1 else va[name] for name in VA_SHAPES], dim=1)
+    none_valid = ~va['act_type'].any(1)
+    va['do_nothing'][none_valid] = True
+    va['act_type'][none_valid, -1] = True
+    return x, va
+
+
+def milliseconds(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def aten_ops(fn) -> int:
+    with profile(activities=[ProfilerActivity.CPU]) as prof:
+        fn()
+    return sum(event.count for event in prof.key_averages() if event.key.startswith("aten::"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--units", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = SimpleNet(500, seed=0)
+    actors = {
+        "per type": lambda x, va, action=None: net.unit_actor_per_type(x, x, va, action),
+        "fused": lambda x, va, action=None: net.unit_actor(x, va, action),
+    }
+    for n_units in args.units:
+        x, va = random_units(n_units, net.actor_dim)
+        with torch.no_grad():
+            _, action, _ = net.unit_actor(x, va)
+        action = action.long()
+        x.requires_grad_(True)
+        for name, actor in actors.items():
+            def sample():
+                with torch.no_grad():
+                    actor(x, va)
+
+            def train():
+                logp, _, entropy = actor(x, va, action)
+                (logp.sum() + entropy.sum()).backward()
+
+            print(f"{n_units:4d} units {name:>8}: sample {milliseconds(sample, args.repeat):6.2f} ms, "
+                  f"forward and backward {milliseconds(train, args.repeat):6.2f} ms, {aten_ops(sample):4d} aten ops")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Throughput of LuxSyncVectorEnv with results pickled through the worker pipes against results written to shared
+memory. Every step fetches the valid actions of both players and steps with random actions, like a training step.
+With --async-envs k the envs are also stepped with step_async_envs / step_wait_any, acting for whichever k or more
+envs are done stepping, and --policy-ms adds a stand-in for the policy forward the envs can overlap with.
+
+    python -m benchmarks.bench_vector_env --num-envs 8 16 32 --steps 100 --envs-per-worker 4 --async-envs 4
+"""
+import argparse
+import time
+
+import numpy as np
+import tree
+
+from luxenv import LuxSyncVectorEnv
+from utils import make_env
+
+
+def run(num_envs: int, steps: int, shared_memory: bool, envs_per_worker: int = 1, policy_ms: float = 0.0) -> float:
+    envs = LuxSyncVectorEnv(
+        [make_env(i, i, None, max_entity_number=500) for i in range(num_envs)],
+        shared_memory=shared_memory,
+        envs_per_worker=envs_per_worker,
+    )
+    envs.reset(seed=0)
+    envs.action_space.seed(0)
+    actions = [tree.map_structure(lambda x: x.astype(np.int32), envs.action_space.sample()) for _ in range(steps)]
+    start = time.perf_counter()
+    for action in actions:
+        envs.get_valid_actions(0)
+        envs.get_valid_actions(1)
+        time.sleep(policy_ms / 1000)
+        envs.step(action)
+    elapsed = time.perf_counter() - start
+    envs.close()
+    return num_envs * steps / elapsed
+
+
+def run_async(num_envs: int, steps: int, shared_memory: bool, envs_per_worker: int, min_envs: int, policy_ms: float) -> float:
+    envs = LuxSyncVectorEnv(
+        [make_env(i, i, None, max_entity_number=500) for i in range(num_envs)],
+        shared_memory=shared_memory,
+        envs_per_worker=envs_per_worker,
+    )
+    envs.reset(seed=0)
+    envs.action_space.seed(0)
+    actions = [tree.map_structure(lambda x: x.astype(np.int32), envs.action_space.sample()) for _ in range(steps)]
+    env_steps = np.zeros(num_envs, dtype=np.int64)
+    start = time.perf_counter()
+    env_ids = np.arange(num_envs)
+    while True:
+        if len(env_ids):
+            envs.get_valid_actions(0, env_ids)
+            envs.get_valid_actions(1, env_ids)
+            time.sleep(policy_ms / 1000)
+            envs.step_async_envs(tree.map_structure(lambda x: x[env_ids], actions[env_steps[env_ids].min()]), env_ids)
+            env_steps[env_ids] += 1
+        if not envs.pending_workers:
+            break
+        env_ids = envs.step_wait_any(min_envs)[0]
+        env_ids = env_ids[env_steps[env_ids] < steps]
+    elapsed = time.perf_counter() - start
+    envs.close()
+    return num_envs * steps / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-envs", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--envs-per-worker", type=int, default=1)
+    parser.add_argument("--async-envs", type=int, default=0)
+    parser.add_argument("--policy-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    for num_envs in args.num_envs:
+        pipes = run(num_envs, args.steps, shared_memory=False, envs_per_worker=args.envs_per_worker)
+        shared = run(num_envs, args.steps, shared_memory=True, envs_per_worker=args.envs_per_worker)
+        print(f"{num_envs:3d} envs: pipes {pipes:7.1f} env steps/s, shared memory {shared:7.1f} env steps/s ({shared / pipes:.2f}x)")
+        if args.async_envs:
+            lockstep = run(num_envs, args.steps, True, args.envs_per_worker, args.policy_ms)
+            partial = run_async(num_envs, args.steps, True, args.envs_per_worker, args.async_envs, args.policy_ms)
+            print(f"{num_envs:3d} envs, {args.policy_ms} ms policy: lockstep {lockstep:7.1f} env steps/s, any {args.async_envs} ready {partial:7.1f} env steps/s ({partial / lockstep:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Shared helpers for the benchmark scripts. Run the benchmarks from the src folder, e.g.
+
+    python -m benchmarks.bench_feature_parser
+"""
+from typing import Dict
+
+import numpy as np
+
+from luxai_s2 import LuxAI_S2
+
+
+def early_game(env: LuxAI_S2, seed: int):
+    """
+    resets the env and plays the bidding and factory placement phase with random spawns
+    """
+    obs, _ = env.reset(seed=seed)
+    rng = np.random.RandomState(seed)
+    obs, _, _, _, _ = env.step({agent: dict(faction="AlphaStrike", bid=0) for agent in env.agents})
+    while env.state.real_env_steps < 0:
+        actions = dict()
+        for agent in env.agents:
+            spawns = np.argwhere(obs[agent]["board"]["valid_spawns_mask"])
+            team = env.state.teams[agent]
+            # split the starting resources evenly over the factories
+            share = max(team.factories_to_place, 1)
+            actions[agent] = dict(
+                spawn=spawns[rng.randint(len(spawns))],
+                metal=team.init_metal // share,
+                water=team.init_water // share,
+            )
+        obs, _, _, _, _ = env.step(actions)
+    return obs, rng
+
+
+def random_actions(obs, agents, rng: np.random.RandomState, build_prob=0.3) -> Dict[str, Dict]:
+    """
+    random but legal looking actions for every unit and factory. Factories build often so boards get crowded.
+    """
+    actions = dict()
+    for agent in agents:
+        a = dict()
+        for unit_id in obs[agent]["units"][agent]:
+            r = rng.rand()
+            if r < 0.5:
+                continue
+            if r < 0.65:
+                a[unit_id] = [np.array([0, rng.randint(1, 5), 0, 0, 1, 1])]
+            elif r < 0.9:
+                a[unit_id] = [np.array([3, 0, 0, 0, 1, 1])]
+            else:
+                a[unit_id] = [np.array([1, rng.randint(5), rng.randint(5), rng.randint(50), 0, 1])]
+        for factory_id in obs[agent]["factories"][agent]:
+            r = rng.rand()
+            if r < build_prob:
+                # mostly lights, heavies eat the metal quickly
+                a[factory_id] = int(rng.rand() < 0.1)
+            elif r < build_prob + 0.2:
+                a[factory_id] = 2
+        actions[agent] = a
+    return actions
+
@@ -0,0 +1,135 @@
+"""
+Checkpoints of train.py, written by a thread of their own so training does not wait for the disk. save() snapshots the
+state to cpu, a copy the training loop can keep changing, and returns; the thread writes it to a temporary file and
+renames it, so a checkpoint is either complete or missing, and removes all but the newest keep checkpoints. A save
+waits for the one before it to be written, so at most one snapshot is held in memory.
+
+A checkpoint is a dict of the state_dicts of the model and the optimizer, the counters of the training loop and the
+states of the random number generators, everything train.py --resume needs to continue as if it never stopped.
+"""
+import os
+import queue
+import re
+import threading
+from typing import Union
+
+import torch
+
+CHECKPOINT_PATTERN = re.compile(r"checkpoint_(\d+)\.pt")
+
+
+def to_cpu(state):
+    """
+    a copy of state with its tensors copied to cpu, nested dicts, lists and tuples copied along
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(to_cpu(value) for value in state)
+    return state
+
+
+def atomic_save(obj, path: str):
+    """
+    torch.save to path through a temporary file, readers see the old file or the new one but never a partial one
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        torch.save(obj, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def list_checkpoints(directory: str) -> list[tuple[int, str]]:
+    """
+    the (step, path) of the checkpoints in directory, oldest first
+    """
+    if not os.path.isdir(directory):
+        return []
+    checkpoints = []
+    for name in os.listdir(directory):
+        match = CHECKPOINT_PATTERN.fullmatch(name)
+        if match:
+            checkpoints.append((int(match.group(1)), os.path.join(directory, name)))
+    return sorted(checkpoints)
+
+
+def latest_checkpoint(directory: str) -> Union[str, None]:
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1][1] if checkpoints else None
+
+
+def load_checkpoint(path: str, map_location: Union[torch.device, str] = "cpu") -> dict:
+    """
+    the checkpoint at path, or the newest one in path if it is a directory
+    """
+    if os.path.isdir(path):
+        directory, path = path, latest_checkpoint(path)
+        if path is None:
+            raise FileNotFoundError(f"no checkpoint in {directory}")
+    # the generator states are not only tensors
+    return torch.load(path, map_location=map_location, weights_only=False)
+
+
+class CheckpointWriter:
+    """
+    writes the checkpoints of save(step, state) to directory/checkpoint_{step}.pt in a background thread and keeps the
+    newest keep of them. Errors of the thread are raised by the next save or close
+    """
+    def __init__(self, directory: str, keep: int = 3):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        # one snapshot waiting while one is written
+        self.jobs = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="CheckpointWriter", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while (job := self.jobs.get()) is not None:
+            step, state, model_path = job
+            try:
+                atomic_save(state, os.path.join(self.directory, f"checkpoint_{step}.pt"))
+                if model_path is not None:
+                    atomic_save(state["model"], model_path)
+                self._rotate()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+    def _rotate(self):
+        if self.keep is None or self.keep <= 0:
+            return
+        for _, path in list_checkpoints(self.directory)[:-self.keep]:
+            os.remove(path)
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("writing a checkpoint failed") from error
+
+    def save(self, step: int, state: dict, model_path: Union[str, None] = None):
+        """
+        snapshots state and queues it to be written. model_path also gets state["model"] alone, the file
+        --load-model-path takes
+        """
+        self._raise_error()
+        self.jobs.put((step, to_cpu(state), model_path))
+
+    def wait(self):
+        """
+        blocks until the queued checkpoints are written
+        """
+        self.jobs.join()
+        self._raise_error()
+
+    def close(self):
+        self.jobs.join()
+        self.jobs.put(None)
+        self.thread.join()
+        self._raise_error()
@@ -134,6 +134,8 @@ class EnvParam:
     MAX_FACTORIES: int = 5
     num_turn_per_cycle: int = 50
     init_from_replay_ratio: float = 1
+    # directory of pre-generated maps written by `python -m luxai_s2.map_generator.pool`, None generates every map
+    map_pool: str = None
 
     act_dims: ActDims = ActDims()
     act_dims_mapping: FullAct = FullAct()
@@ -0,0 +1,242 @@
+"""
+Rollout collection in a process of its own, the actor side of train.py --inference-server. The server process owns the
+env workers (LuxSyncVectorEnv) and a copy of the policy. It batches the envs that are done stepping, waiting for at
+most max_wait seconds for min_envs of them, samples the actions of both players in one forward and sends the envs their
+next step. Full rollouts go to the learner through a queue, so the envs and the network keep working while the learner
+trains.
+
+The learner publishes its weights after every update and the server loads them before its next forward. The learner
+hands out the env seeds of the rollouts one at a time and the server runs at most one rollout ahead, so every step is
+sampled by a policy at most one update behind the one it is trained with. The version of the policy of every step is
+stored with the rollout to report the lag.
+
+Experimental: the overlap needs spare cores for the server and the env workers next to the learner. On one cpu, the only
+setup measured so far, the server is slower than lockstep rollouts (4 envs: about 3.3 against 5.2 SPS).
+"""
+import copy
+import traceback
+from typing import Union
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import tree
+from gymnasium.vector.utils import CloudpickleWrapper
+
+import seeding
+from luxenv import LuxSyncVectorEnv, valid_actions_to_torch
+from rollout import PerEnvRollout
+
+PLAYERS = ['player_0', 'player_1']
+
+
+def np2torch(x, dtype):
+    return torch.tensor(x, dtype=dtype)
+
+
+def sample_actions(policy: torch.nn.Module, obs: dict, valid_action: dict, device: Union[torch.device, str]) -> tuple[dict, dict, dict]:
+    """
+    actions, log probs and values of both players in one forward over the observations and valid actions of the
+    players concatenated on the batch
+    """
+    features = tree.map_structure(lambda *xs: torch.cat(xs).to(device), *[obs[player] for player in PLAYERS])
+    va = tree.map_structure(lambda *xs: torch.cat(xs).to(device), *[valid_action[player] for player in PLAYERS])
+    with torch.no_grad():
+        logprob, value, action, _ = policy(
+            features['global_feature'],
+            features['map_feature'],
+            features['factory_feature'],
+            features['unit_feature'],
+            features['location_feature'],
+            va,
+        )
+    per_player = lambda x: {player: tree.map_structure(lambda y: y.cpu().chunk(2)[player_id], x) for player_id, player in enumerate(PLAYERS)}
+    return per_player(action), per_player(logprob), per_player(value)
+
+
+class PolicyCopy:
+    """
+    the server's copy of the policy the learner publishes, reloaded when the learner published a newer version
+    """
+    def __init__(self, published: torch.nn.Module, version, lock, device: Union[torch.device, str]):
+        self.published = published
+        self.version = version
+        self.lock = lock
+        self.policy = copy.deepcopy(published).to(device).train()
+        self.policy_version = 0
+
+    def refresh(self):
+        if self.version.value == self.policy_version:
+            return
+        with self.lock:
+            self.policy.load_state_dict(self.published.state_dict())
+            self.policy_version = self.version.value
+
+
+def collect_rollout(envs: LuxSyncVectorEnv, policy: PolicyCopy, rollout: PerEnvRollout, next_obs: dict,
+                    min_envs: int, max_wait: Union[float, None], max_entity_number: int, info_keys: list[str],
+                    device: Union[torch.device, str]) -> dict:
+    """
+    train.py's collect_rollout_async with one forward for both players, a latency cap on waiting for min_envs envs and
+    the policy version of every step. Returns the stats of the first episode of every env with the rollout
+    """
+    num_envs = rollout.num_envs
+    episode_return = np.zeros(num_envs)
+    episode_return_list = []
+    step_counts = np.zeros(num_envs)
+    episode_lengths = []
+    global_info_save = {}
+    first_episode = np.ones(num_envs, dtype=bool)
+    batch_sizes = []
+
+    ready_ids = np.arange(num_envs)
+    ready_obs = next_obs
+    ready_done = torch.zeros((num_envs, 2, max_entity_number), dtype=torch.bool)
+    while True:
+        if len(ready_ids):
+            policy.refresh()
+            valid_action = {
+                player: valid_actions_to_torch(envs.get_valid_actions(player_id, ready_ids), np2torch)
+                for player_id, player in enumerate(PLAYERS)
+            }
+            action, logprob, value = sample_actions(policy.policy, ready_obs, valid_action, device)
+            batch_sizes.append(len(ready_ids))
+            rollout.insert(ready_ids, {
+                "obs": ready_obs,
+                "actions": action,
+                "valid_actions": valid_action,
+                "logprobs": logprob,
+                "values": value,
+                "dones": {player: ready_done[:, player_id].float() for player_id, player in enumerate(PLAYERS)},
+                "policy_versions": torch.full((len(ready_ids),), policy.policy_version, dtype=torch.int64),
+            })
+            rollout.advance(ready_ids)
+            _action = {player_id: action[player] for player_id, player in enumerate(PLAYERS)}
+            envs.step_async_envs(tree.map_structure(lambda x: x.numpy().astype(np.int32), _action), ready_ids)
+        if not envs.pending_workers:
+            break
+
+        env_ids, obs, reward, terminated, truncation, info = envs.step_wait_any(min_envs, max_wait=max_wait)
+        obs = tree.map_structure(lambda x: np2torch(x, torch.float32), obs)
+        done = terminated | truncation
+        _done = done.all(axis=-1).any(-1)
+        _done[rollout.steps[env_ids] == rollout.num_steps] = True
+        done = np2torch(done, torch.bool)
+
+        rewards = np2torch(reward, torch.float32)
+        rollout.insert(env_ids, {"rewards": {player: rewards[:, player_id] for player_id, player in enumerate(PLAYERS)}}, step_offset=-1)
+
+        episode_return[env_ids] += np.mean(np.sum(reward, axis=-1), axis=-1)
+        step_counts[env_ids] += 1
+
+        for key in info_keys:
+            for env_id in env_ids:
+                if not first_episode[env_id]:
+                    continue
+                for player in PLAYERS:
+                    for group in [player, "total"]:
+                        global_info_save.setdefault(group, {}).setdefault(key, 0)
+                        global_info_save[group][key] += info[player][env_id][key]
+
+        for env_id in env_ids[_done]:
+            if first_episode[env_id]:
+                episode_return_list.append(episode_return[env_id])
+                episode_lengths.append(step_counts[env_id])
+            episode_return[env_id] = 0
+            step_counts[env_id] = 0
+            first_episode[env_id] = False
+
+        unfinished = rollout.steps[env_ids] < rollout.num_steps
+        ready_ids = env_ids[unfinished]
+        _unfinished = torch.from_numpy(unfinished)
+        ready_obs = tree.map_structure(lambda x: x[_unfinished], obs)
+        ready_done = done[_unfinished]
+
+    return {
+        "data": rollout.step_major(),
+        "episode_returns": episode_return_list,
+        "episode_lengths": episode_lengths,
+        "global_info": global_info_save,
+        "mean_batch_size": float(np.mean(batch_sizes)),
+    }
+
+
+def serve(env_fns: CloudpickleWrapper, envs_per_worker: int, published: torch.nn.Module, version, lock, seeds, rollouts,
+          num_steps: int, min_envs: int, max_wait: Union[float, None], max_entity_number: int, info_keys: list[str],
+          device: Union[torch.device, str], shared_memory: bool = False):
+    """
+    the server process: collects a rollout for every seed it gets until it gets None. Errors are sent to the learner
+    as their traceback
+    """
+    envs = None
+    try:
+        envs = LuxSyncVectorEnv(env_fns.fn, device=device, envs_per_worker=envs_per_worker, shared_memory=shared_memory)
+        policy = PolicyCopy(published, version, lock, device)
+        rollout = PerEnvRollout(envs.num_envs, num_steps)
+        while (seed := seeds.get()) is not None:
+            seeding.set_seed(seed)
+            next_obs, _ = envs.reset(seed=seed)
+            next_obs = tree.map_structure(lambda x: np2torch(x, torch.float32), next_obs)
+            rollout.reset()
+            rollouts.put(collect_rollout(envs, policy, rollout, next_obs, min_envs, max_wait, max_entity_number, info_keys, device))
+    except Exception:
+        rollouts.put(traceback.format_exc())
+    finally:
+        if envs is not None:
+            envs.close()
+
+
+class InferenceServer:
+    """
+    starts the server process with env_fns and a copy of agent. request(seed) asks for the rollout of an env seed,
+    collect() waits for the next requested rollout, publish(agent) hands the server the learner's weights
+    """
+    def __init__(self, env_fns, agent: torch.nn.Module, num_steps: int, min_envs: int, max_wait: Union[float, None],
+                 max_entity_number: int, info_keys: list[str], envs_per_worker: int = 1,
+                 device: Union[torch.device, str] = "cpu", shared_memory: bool = False):
+        ctx = mp.get_context("spawn")
+        self.published = copy.deepcopy(agent).share_memory()
+        self.version = ctx.Value("q", 0)
+        self.lock = ctx.Lock()
+        self.seeds = ctx.Queue()
+        self.rollouts = ctx.Queue()
+        # not a daemon, the server starts the env worker processes
+        self.process = ctx.Process(
+            target=serve,
+            args=(CloudpickleWrapper(env_fns), envs_per_worker, self.published, self.version, self.lock, self.seeds,
+                  self.rollouts, num_steps, min_envs, max_wait, max_entity_number, info_keys, device, shared_memory),
+            name="InferenceServer",
+        )
+        self.process.start()
+
+    def request(self, seed: int):
+        self.seeds.put(seed)
+
+    def collect(self) -> dict:
+        """
+        the next rollout: "data", the [step, env] tensors train.py stores with the "policy_versions" of the steps, and
+        the "episode_returns", "episode_lengths", "global_info" and "mean_batch_size" of its collection
+        """
+        result = self.rollouts.get()
+        if isinstance(result, str):
+            raise RuntimeError(f"the inference server failed:\n{result}")
+        return result
+
+    def publish(self, agent: torch.nn.Module) -> int:
+        """
+        copies the weights of agent to the server, returns their version
+        """
+        with self.lock:
+            self.published.load_state_dict(agent.state_dict())
+            self.version.value += 1
+            return self.version.value
+
+    def policy_lag(self, policy_versions: torch.Tensor) -> torch.Tensor:
+        """
+        the updates between the policies that sampled steps and the latest published one
+        """
+        return self.version.value - policy_versions
+
+    def close(self):
+        self.seeds.put(None)
+        self.process.join()
@@ -221,18 +221,8 @@ class Board(NamedTuple):
         factory_pos = factory_pos.at[:n_factory, :].set(jnp.array([xs, ys], pos_dtype).T)
 
         # put unit_id to map
-        xs = []
-        ys = []
-        unit_id = []
-        for k, v in lux_board.units_map.items():
-            x, y = eval(k)
-            if len(v) == 0:
-                continue
-            assert len(v) == 1
-            v = int(v[0].unit_id[len('unit_'):])  # factory_0
-            xs.append(x)
-            ys.append(y)
-            unit_id.append(v)
+        xs, ys = (lux_board.units_map != -1).nonzero()
+        unit_id = lux_board.units_map[xs, ys]
         units_map = jnp.full((height, width),
                              fill_value=imax(Board.__annotations__['units_map']))  # default value is INT16_MAX
         unit_id = jnp.array(unit_id, dtype=units_map.dtype)
@@ -276,9 +266,10 @@ class Board(NamedTuple):
         unit_id = self.units_map[xs, ys]
         xs, ys, unit_id = np.array(xs), np.array(ys), np.array(unit_id)
         lux_units = {**lux_units['player_0'], **lux_units['player_1']}
-        lux_board.units_map = {}
-        for x, y, uid in zip(xs, ys, unit_id):
-            lux_board.units_map.setdefault(f'({x}, {y})', []).append(lux_units[f"unit_{int(uid)}"])
+        lux_board.units_map = np.full((height, width), fill_value=-1, dtype=np.int32)
+        lux_board.units_list = []
+        for uid in unit_id:
+            lux_board.add_unit(lux_units[f"unit_{int(uid)}"])
 
         xs, ys = (self.factory_map != imax(self.factory_map.dtype)).nonzero()
         factory_id = self.factory_map[xs, ys]
@@ -49,7 +49,12 @@ def process_obs(player, game_state, step, obs):
                 if "valid_spawns_mask" in obs[k]:
                     game_state["board"]["valid_spawns_mask"] = obs[k]["valid_spawns_mask"]
         for item in ["rubble", "lichen", "lichen_strains"]:
-            for k, v in obs["board"][item].items():
+            delta = obs["board"][item]
+            if "index" in delta:
+                # compact delta format, parallel arrays of flat indices and new values
+                np.put(game_state["board"][item], np.asarray(delta["index"], dtype=np.int64), delta["value"])
+                continue
+            for k, v in delta.items():
                 k = k.split(",")
                 x, y = int(k[0]), int(k[1])
                 game_state["board"][item][x, y] = v
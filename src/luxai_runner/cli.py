@@ -43,6 +43,13 @@ def main():
         default=True,
     )
 
+    parser.add_argument(
+        "--replay.compact_deltas",
+        help="Send board changes to agents (and save them in compressed replays) as parallel arrays of flat indices and values instead of dicts keyed by \"x,y\" strings. Agents need a kit that understands this format.",
+        action="store_true",
+        default=False,
+    )
+
     # episode configs
     parser.add_argument(
         "-v",
@@ -117,6 +124,7 @@ def main():
         replay_options=ReplayConfig(
             save_format=save_format,
             compressed_obs=getattr(args, "replay.compressed_obs"),
+            compact_deltas=getattr(args, "replay.compact_deltas"),
         ),
         render=args.render,
     )
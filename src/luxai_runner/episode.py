@@ -17,6 +17,8 @@ from luxai_runner.utils import to_json
 class ReplayConfig:
     save_format: str = "json"
     compressed_obs: bool = False
+    # send (and save) board changes as parallel index/value arrays instead of "x,y" keyed dicts
+    compact_deltas: bool = False
 
 
 @dataclass
@@ -169,7 +171,9 @@ window.episode = {json.dumps(replay)};
             dones = dict()
             for k in terminations:
                 dones[k] = terminations[k] | truncations[k]
-            change_obs = self.env.state.get_change_obs(state_obs)
+            change_obs = self.env.state.get_change_obs(
+                state_obs, compact=self.cfg.replay_options.compact_deltas
+            )
             state_obs = new_state_obs["player_0"]
             obs = to_json(change_obs)
             if save_replay:
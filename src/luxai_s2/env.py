@@ -25,9 +25,10 @@ from luxai_s2.actions import (
     validate_actions,
 )
 from luxai_s2.config import EnvConfig
-from luxai_s2.factory import Factory
+from luxai_s2.factory import Factory, lichen_growth_forbidden
 from luxai_s2.map.board import Board
 from luxai_s2.map.position import Position
+from luxai_s2.map_generator.pool import MapPool
 from luxai_s2.pyvisual.visualizer import Visualizer
 from luxai_s2.spaces.act_space import (
     get_act_space,
@@ -39,12 +40,12 @@ from luxai_s2.spaces.obs_space import get_obs_space
 from luxai_s2.state import (
     ObservationStateDict,
     State,
-    StatsStateDict,
-    create_empty_stats,
+    TeamStats,
 )
 from luxai_s2.team import FactionTypes, Team
 from luxai_s2.unit import Unit, UnitType
-from luxai_s2.utils.utils import get_top_two_power_units, is_day
+from luxai_s2.utils.collision import resolve_collisions
+from luxai_s2.utils.utils import is_day
 
 import sys
 
@@ -73,8 +74,21 @@ def env():
 class LuxAI_S2(ParallelEnv):
     metadata = {"render_modes": ["human", "html", "rgb_array"], "name": "luxai_s2_v0"}
 
-    def __init__(self, collect_stats: bool = False, render_mode="rgb_array", **kwargs):
+    def __init__(
+        self,
+        collect_stats: bool = False,
+        render_mode="rgb_array",
+        copy_obs: bool = True,
+        map_pool: Union[str, MapPool] = None,
+        **kwargs,
+    ):
         self.collect_stats = collect_stats  # note: added here instead of in configs since it would break existing bots
+        # if False, the board arrays in observations are read-only views that are only valid until the next step or
+        # reset. obs_generation counts steps and resets so consumers can check that views they hold are still current
+        self.copy_obs = copy_obs
+        self.obs_generation = 0
+        # pre-generated maps (see luxai_s2.map_generator.pool) that resets load instead of generating them
+        self.map_pool = MapPool(map_pool) if isinstance(map_pool, str) else map_pool
         default_config = EnvConfig(**kwargs)
         self.render_mode = render_mode
         self.env_cfg = default_config
@@ -195,7 +209,9 @@ class LuxAI_S2(ParallelEnv):
         else:
             self.seed_val = np.random.randint(0, 2**32 - 1, dtype=np.int64)
             self.seed_rng = np.random.RandomState(seed=self.seed_val)
-        board = Board(seed=self.seed_rng.randint(0, 2**32 - 1, dtype=np.int64), env_cfg=self.env_cfg)
+        board = Board(
+            seed=self.seed_rng.randint(0, 2**32 - 1, dtype=np.int64), env_cfg=self.env_cfg, map_pool=self.map_pool
+        )
         self.state: State = State(
             seed_rng=self.seed_rng,
             seed=self.seed_val,
@@ -208,8 +224,9 @@ class LuxAI_S2(ParallelEnv):
             self.state.units[agent] = OrderedDict()
             self.state.factories[agent] = OrderedDict()
             if self.collect_stats:
-                self.state.stats[agent] = create_empty_stats()
-        obs = self.state.get_obs()
+                self.state.stats[agent] = TeamStats()
+        self.obs_generation += 1
+        obs = self.state.get_obs(copy=self.copy_obs)
         observations = {agent: obs for agent in self.agents}
         return observations, {}
     
@@ -440,9 +457,9 @@ class LuxAI_S2(ParallelEnv):
                     transfer_action.resource, transfer_amount
                 )
                 if self.collect_stats:
-                    self.state.stats[unit.team.agent]["transfer"][
-                        resource_to_name[transfer_action.resource]
-                    ] += actually_transferred
+                    self.state.stats[unit.team.agent].add(
+                        actually_transferred, "transfer", resource_to_name[transfer_action.resource]
+                    )
             elif units_there is not None:
                 assert len(units_there) == 1, "Fatal error here, this is a bug"
                 target_unit = units_there[0]
@@ -451,9 +468,9 @@ class LuxAI_S2(ParallelEnv):
                     transfer_action.resource, transfer_amount
                 )
                 if self.collect_stats:
-                    self.state.stats[unit.team.agent]["transfer"][
-                        resource_to_name[transfer_action.resource]
-                    ] += actually_transferred
+                    self.state.stats[unit.team.agent].add(
+                        actually_transferred, "transfer", resource_to_name[transfer_action.resource]
+                    )
             unit.repeat_action(transfer_action)
 
     def _handle_pickup_actions(self, actions_by_type: ActionsByType):
@@ -467,9 +484,9 @@ class LuxAI_S2(ParallelEnv):
             actually_pickedup = unit.add_resource(pickup_action.resource, pickup_amount)
             unit.repeat_action(pickup_action)
             if self.collect_stats:
-                self.state.stats[unit.team.agent]["pickup"][
-                    resource_to_name[pickup_action.resource]
-                ] += actually_pickedup
+                self.state.stats[unit.team.agent].add(
+                    actually_pickedup, "pickup", resource_to_name[pickup_action.resource]
+                )
 
     def _handle_dig_actions(self, actions_by_type: ActionsByType):
         for unit, dig_action in actions_by_type["dig"]:
@@ -483,10 +500,11 @@ class LuxAI_S2(ParallelEnv):
                     0,
                 )
                 if self.collect_stats:
-                    self.state.stats[unit.team.agent]["destroyed"]["rubble"][
-                        unit.unit_type.name
-                    ] -= (
-                        self.state.board.rubble[unit.pos.x, unit.pos.y] - rubble_before
+                    self.state.stats[unit.team.agent].add(
+                        rubble_before - self.state.board.rubble[unit.pos.x, unit.pos.y],
+                        "destroyed",
+                        "rubble",
+                        unit.unit_type.name,
                     )
             elif self.state.board.lichen[unit.pos.x, unit.pos.y] > 0:
                 if self.collect_stats:
@@ -502,23 +520,20 @@ class LuxAI_S2(ParallelEnv):
                         unit.pos.x, unit.pos.y
                     ] = self.state.env_cfg.ROBOTS[unit.unit_type.name].DIG_RESOURCE_GAIN
                 if self.collect_stats:
-                    self.state.stats[unit.team.agent]["destroyed"]["lichen"][
-                        unit.unit_type.name
-                    ] -= (
-                        self.state.board.lichen[unit.pos.x, unit.pos.y] - lichen_before
+                    self.state.stats[unit.team.agent].add(
+                        lichen_before - self.state.board.lichen[unit.pos.x, unit.pos.y],
+                        "destroyed",
+                        "lichen",
+                        unit.unit_type.name,
                     )
             elif self.state.board.ice[unit.pos.x, unit.pos.y] > 0:
                 gained = unit.add_resource(0, unit.unit_cfg.DIG_RESOURCE_GAIN)
                 if self.collect_stats:
-                    self.state.stats[unit.team.agent]["generation"]["ice"][
-                        unit.unit_type.name
-                    ] += gained
+                    self.state.stats[unit.team.agent].add(gained, "generation", "ice", unit.unit_type.name)
             elif self.state.board.ore[unit.pos.x, unit.pos.y] > 0:
                 gained = unit.add_resource(1, unit.unit_cfg.DIG_RESOURCE_GAIN)
                 if self.collect_stats:
-                    self.state.stats[unit.team.agent]["generation"]["ore"][
-                        unit.unit_type.name
-                    ] += gained
+                    self.state.stats[unit.team.agent].add(gained, "generation", "ore", unit.unit_type.name)
             unit.power -= self.state.env_cfg.ROBOTS[unit.unit_type.name].DIG_COST
             unit.repeat_action(dig_action)
 
@@ -526,11 +541,9 @@ class LuxAI_S2(ParallelEnv):
         for unit, self_destruct_action in actions_by_type["self_destruct"]:
             unit: Unit
             self_destruct_action: SelfDestructAction
-            pos_hash = self.state.board.pos_hash(unit.pos)
-            del self.state.board.units_map[pos_hash]
             self.destroy_unit(unit)
             if self.collect_stats:
-                self.state.stats[unit.team.agent]["destroyed"][unit.unit_type.name] += 1
+                self.state.stats[unit.team.agent].add(1, "destroyed", unit.unit_type.name)
 
     def _handle_factory_build_actions(self, actions_by_type: ActionsByType):
         for factory, factory_build_action in actions_by_type["factory_build"]:
@@ -578,156 +591,65 @@ class LuxAI_S2(ParallelEnv):
                 pos=factory.pos.pos,
             )
             if self.collect_stats:
-                self.state.stats[factory.team.agent]["generation"]["built"][
-                    factory_build_action.unit_type.name
-                ] += 1
-                self.state.stats[factory.team.agent]["consumption"][
-                    "metal"
-                ] += spent_metal
-                self.state.stats[factory.team.agent]["consumption"]["power"][
-                    "FACTORY"
-                ] += spent_power
+                stats = self.state.stats[factory.team.agent]
+                stats.add(1, "generation", "built", factory_build_action.unit_type.name)
+                stats.add(spent_metal, "consumption", "metal")
+                stats.add(spent_power, "consumption", "power", "FACTORY")
 
     def _handle_movement_actions(self, actions_by_type: ActionsByType):
-        new_units_map: Dict[str, List[Unit]] = defaultdict(list)
-        heavy_entered_pos: Dict[str, List[Unit]] = defaultdict(list)
-        light_entered_pos: Dict[str, List[Unit]] = defaultdict(list)
-
+        board = self.state.board
+        moved_units: List[Unit] = []
         for unit, move_action in actions_by_type["move"]:
             move_action: MoveAction
             # skip move center
             if move_action.move_dir != 0:
-                old_pos_hash = self.state.board.pos_hash(unit.pos)
-                target_pos = (
-                    unit.pos + move_action.dist * move_deltas[move_action.move_dir]
-                )
-                power_required = move_action.power_cost
-                unit.pos = target_pos
-                new_pos_hash = self.state.board.pos_hash(unit.pos)
-
-                # remove unit from map temporarily
-                if len(self.state.board.units_map[old_pos_hash]) == 1:
-                    del self.state.board.units_map[old_pos_hash]
-                else:
-                    self.state.board.units_map[old_pos_hash].remove(unit)
-
-                new_units_map[new_pos_hash].append(unit)
-                unit.power -= power_required
-
-                if unit.unit_type == UnitType.HEAVY:
-                    heavy_entered_pos[new_pos_hash].append(unit)
-                else:
-                    light_entered_pos[new_pos_hash].append(unit)
-
+                # vacate the old tile, unless a freshly built unit already took it over
+                board.remove_unit(unit)
+                unit.pos = unit.pos + move_action.dist * move_deltas[move_action.move_dir]
+                unit.power -= move_action.power_cost
+                moved_units.append(unit)
             unit.repeat_action(move_action)
 
-        for pos_hash, units in self.state.board.units_map.items():
-            # add in all the stationary units
-            new_units_map[pos_hash] += units
-
-        all_destroyed_units: Set[Unit] = set()
-        new_units_map_after_collision: Dict[str, List[Unit]] = defaultdict(list)
-        for pos_hash, units in new_units_map.items():
-            destroyed_units: Set[Unit] = set()
-            if len(units) <= 1:
-                new_units_map_after_collision[pos_hash] += units
-                continue
-            if len(heavy_entered_pos[pos_hash]) > 1:
-                # all units collide, find the top 2 units by power
-                (most_power_unit, next_most_power_unit) = get_top_two_power_units(units, UnitType.HEAVY)
-                if most_power_unit.power == next_most_power_unit.power:
-                    # tie, all units break
-                    for u in units:
-                        destroyed_units.add(u)
-                    self.log_info(
-                        f"{len(destroyed_units)} Units: ({', '.join([u.unit_id for u in destroyed_units])}) collided at {pos_hash}"
-                    )
-                else:
-                    most_power_unit_power_loss = math.ceil(
-                        next_most_power_unit.power * self.env_cfg.POWER_LOSS_FACTOR
-                    )
-                    most_power_unit.power -= most_power_unit_power_loss
-                    surviving_unit = most_power_unit
-                    for u in units:
-                        if u.unit_id != surviving_unit.unit_id:
-                            destroyed_units.add(u)
-                    self.log_info(
-                        f"{len(destroyed_units)} Units: ({', '.join([u.unit_id for u in destroyed_units])}) collided at {pos_hash} with {surviving_unit} surviving with {surviving_unit.power} power"
-                    )
-                    new_units_map_after_collision[pos_hash].append(surviving_unit)
-                all_destroyed_units.update(destroyed_units)
-            elif len(heavy_entered_pos[pos_hash]) > 0:
-                # all other units collide and break
-                surviving_unit = heavy_entered_pos[pos_hash][0]
-                for u in units:
-                    if u.unit_id != surviving_unit.unit_id:
-                        destroyed_units.add(u)
-                self.log_info(
-                    f"{len(destroyed_units)} Units: ({', '.join([u.unit_id for u in destroyed_units])}) collided at {pos_hash} with {surviving_unit} surviving with {surviving_unit.power} power"
-                )
-                new_units_map_after_collision[pos_hash].append(surviving_unit)
-                all_destroyed_units.update(destroyed_units)
-            else:
-                # check for stationary heavy unit there
-                surviving_unit = None
-                heavy_stationary_unit = None
-                for u in units:
-                    if u.unit_type == UnitType.HEAVY:
-                        if heavy_stationary_unit is not None:
-                            heavy_stationary_unit = None
-                            # we found >= 2 heavies stationary in a tile where no heavies are entering.
-                            # should only happen when spawning units
-                            self.log_info(
-                                f"At {pos_hash}, >= 2 heavies crashed as they were all stationary"
-                            )
-                            break
-                        heavy_stationary_unit = u
-
-                if heavy_stationary_unit is not None:
-                    surviving_unit = heavy_stationary_unit
-                else:
-                    if len(light_entered_pos[pos_hash]) > 1:
-                        # all units collide, get top 2 units by power
-                        (
-                            most_power_unit,
-                            next_most_power_unit,
-                        ) = get_top_two_power_units(units, UnitType.LIGHT)
-                        if most_power_unit.power == next_most_power_unit.power:
-                            # tie, all units break
-                            for u in units:
-                                destroyed_units.add(u)
-                        else:
-                            most_power_unit_power_loss = math.ceil(
-                                next_most_power_unit.power
-                                * self.env_cfg.POWER_LOSS_FACTOR
-                            )
-                            most_power_unit.power -= most_power_unit_power_loss
-                            surviving_unit = most_power_unit
-                    elif len(light_entered_pos[pos_hash]) > 0:
-                        # light crashes into stationary light unit
-                        surviving_unit = light_entered_pos[pos_hash][0]
-                if surviving_unit is None:
-                    for u in units:
-                        destroyed_units.add(u)
-                    self.log_info(
-                        f"{len(destroyed_units)} Units: ({', '.join([u.unit_id for u in destroyed_units])}) collided at {pos_hash}"
-                    )
-                    all_destroyed_units.update(destroyed_units)
-                else:
-                    for u in units:
-                        if u.unit_id != surviving_unit.unit_id:
-                            destroyed_units.add(u)
-                    self.log_info(
-                        f"{len(destroyed_units)} Units: ({', '.join([u.unit_id for u in destroyed_units])}) collided at {pos_hash} with {surviving_unit} surviving with {surviving_unit.power} power"
-                    )
-                    new_units_map_after_collision[pos_hash].append(surviving_unit)
-                    all_destroyed_units.update(destroyed_units)
-        self.state.board.units_map = new_units_map_after_collision
-
-        for u in all_destroyed_units:
+        # the order the collision rules see units on a tile: movers in action order, then stationary units
+        moved_set = set(moved_units)
+        units = moved_units + [
+            u for agent in self.state.units for u in self.state.units[agent].values() if u not in moved_set
+        ]
+        if len(units) == 0:
+            return
+        pos_index = np.fromiter((board.flat_index(u.pos) for u in units), dtype=np.int64, count=len(units))
+        shared = np.bincount(pos_index)[pos_index] > 1
+        # a mover alone on its tile just claims it
+        for i in np.flatnonzero(~shared[: len(moved_units)]).tolist():
+            board.add_unit(units[i])
+        shared_index = np.flatnonzero(shared)
+        if len(shared_index) == 0:
+            return
+
+        # only the units on shared tiles need resolving, each tile is resolved on its own
+        colliding = [units[i] for i in shared_index.tolist()]
+        power = np.fromiter((u.power for u in colliding), dtype=np.int64, count=len(colliding))
+        survive, power_left, _ = resolve_collisions(
+            pos_index[shared_index],
+            power,
+            np.fromiter((u.unit_type == UnitType.HEAVY for u in colliding), dtype=bool, count=len(colliding)),
+            shared_index < len(moved_units),
+            self.env_cfg.POWER_LOSS_FACTOR,
+        )
+        for i in np.flatnonzero(power_left != power).tolist():
+            colliding[i].power = int(power_left[i])
+        # the winner of a tile claims it, a stationary winner may share it with a freshly built unit
+        for i in np.flatnonzero(survive).tolist():
+            board.add_unit(colliding[i])
+        destroyed = [colliding[i] for i in np.flatnonzero(~survive).tolist()]
+        if self.env_cfg.verbose > 2 and len(destroyed) > 0:
+            self.log_info(
+                f"{len(destroyed)} Units: ({', '.join([u.unit_id for u in destroyed])}) destroyed in collisions"
+            )
+        for u in destroyed:
             self.destroy_unit(u)
             if self.collect_stats:
-                self.state.stats[u.team.agent]["destroyed"][u.unit_type.name] += 1
+                self.state.stats[u.team.agent].add(1, "destroyed", u.unit_type.name)
 
     def _handle_recharge_actions(self, actions_by_type: ActionsByType):
         # for recharging actions, check if unit has enough power. If not, add action back to the queue
@@ -756,9 +678,65 @@ class LuxAI_S2(ParallelEnv):
             self.state.board.lichen[indexable_positions] += 2
             self.state.board.lichen_strains[indexable_positions] = factory.num_id
             if self.collect_stats:
-                self.state.stats[factory.team.agent]["consumption"][
-                    "water"
-                ] += water_cost
+                self.state.stats[factory.team.agent].add(water_cost, "consumption", "water")
+
+    def _handle_refine_step(self):
+        for agent in self.agents:
+            factories_to_destroy: Set[Factory] = set()
+            water_gained, metal_gained = 0, 0
+            for factory in self.state.factories[agent].values():
+                if self.collect_stats:
+                    water_before = factory.cargo.water
+                    metal_before = factory.cargo.metal
+                factory.refine_step(self.env_cfg)
+                if self.collect_stats:
+                    metal_gained += factory.cargo.metal - metal_before
+                    water_gained += factory.cargo.water - water_before
+                factory.cargo.water -= self.env_cfg.FACTORY_WATER_CONSUMPTION
+                if factory.cargo.water < 0:
+                    factories_to_destroy.add(factory)
+            if self.collect_stats:
+                self.state.stats[agent].add(metal_gained, "generation", "metal")
+                self.state.stats[agent].add(water_gained, "generation", "water")
+            for factory in factories_to_destroy:
+                # destroy factories that ran out of water
+                self.destroy_factory(factory)
+                if self.collect_stats:
+                    self.state.stats[factory.team.agent].add(1, "destroyed", "FACTORY")
+
+    def _handle_unit_power_gain(self):
+        if is_day(self.env_cfg, self.state.real_env_steps):
+            for agent in self.agents:
+                power_gained = dict(LIGHT=0, HEAVY=0)
+                for u in self.state.units[agent].values():
+                    if self.collect_stats:
+                        power_before = u.power
+                    u.power = u.power + self.env_cfg.ROBOTS[u.unit_type.name].CHARGE
+                    u.power = min(u.power, u.unit_cfg.BATTERY_CAPACITY)
+                    if self.collect_stats:
+                        power_gained[u.unit_type.name] += u.power - power_before
+                if self.collect_stats:
+                    for unit_type, gained in power_gained.items():
+                        self.state.stats[agent].add(gained, "generation", "power", unit_type)
+
+    def _handle_factory_power_gain(self):
+        for agent in self.agents:
+            power_gained = 0
+            for f in self.state.factories[agent].values():
+                if self.collect_stats:
+                    power_before = f.power
+                # natural nuclear energy generation
+                f.power = f.power + self.env_cfg.FACTORY_CHARGE
+                # lichen/plant power
+                f.power = (
+                    f.power
+                    + len(f.connected_lichen_positions)
+                    * self.env_cfg.POWER_PER_CONNECTED_LICHEN_TILE
+                )
+                if self.collect_stats:
+                    power_gained += f.power - power_before
+            if self.collect_stats:
+                self.state.stats[agent].add(power_gained, "generation", "power", "FACTORY")
 
     def step(
         self, actions
@@ -822,9 +800,7 @@ class LuxAI_S2(ParallelEnv):
                                 unit.unit_type.name
                             ].ACTION_QUEUE_POWER_COST
                             if self.collect_stats:
-                                self.state.stats[agent][
-                                    "action_queue_updates_total"
-                                ] += 1
+                                self.state.stats[agent].add(1, "action_queue_updates_total")
                             if unit.power < update_power_req:
                                 self.log_info(
                                     f"{agent} Tried to update action queue for {unit} requiring {update_power_req} power but only had {unit.power} power"
@@ -848,9 +824,7 @@ class LuxAI_S2(ParallelEnv):
                                 continue
                             unit.power -= update_power_req
                             if self.collect_stats:
-                                self.state.stats[agent][
-                                    "action_queue_updates_success"
-                                ] += 1
+                                self.state.stats[agent].add(1, "action_queue_updates_success")
                             self.state.units[agent][
                                 unit_id
                             ].action_queue = formatted_actions
@@ -889,10 +863,11 @@ class LuxAI_S2(ParallelEnv):
             self._handle_movement_actions(actions_by_type)
             self._handle_recharge_actions(actions_by_type)
 
+            forbidden = lichen_growth_forbidden(self.state.board)
             for agent in self.agents:
                 for factory in self.state.factories[agent].values():
                     # update information for lichen growing and cache it
-                    factory.cache_water_info(self.state.board, self.env_cfg)
+                    factory.cache_water_info(self.state.board, self.env_cfg, forbidden)
 
             self._handle_factory_water_actions(actions_by_type)
             self._handle_transfer_actions(actions_by_type)
@@ -915,61 +890,13 @@ class LuxAI_S2(ParallelEnv):
                             start_of_step_lichen_tiles < 0
                         ].sum()
                         lichen_gained = start_of_step_lichen_tiles.sum() - lichen_lost
-                        self.state.stats[agent]["generation"]["lichen"] += lichen_gained
+                        self.state.stats[agent].add(lichen_gained, "generation", "lichen")
 
             # resources refining
-            for agent in self.agents:
-                factories_to_destroy: Set[Factory] = set()
-                for factory in self.state.factories[agent].values():
-                    if self.collect_stats:
-                        water_before = factory.cargo.water
-                        metal_before = factory.cargo.metal
-                    factory.refine_step(self.env_cfg)
-                    if self.collect_stats:
-                        self.state.stats[agent]["generation"]["metal"] += (
-                            factory.cargo.metal - metal_before
-                        )
-                        self.state.stats[agent]["generation"]["water"] += (
-                            factory.cargo.water - water_before
-                        )
-                    factory.cargo.water -= self.env_cfg.FACTORY_WATER_CONSUMPTION
-                    if factory.cargo.water < 0:
-                        factories_to_destroy.add(factory)
-                for factory in factories_to_destroy:
-                    # destroy factories that ran out of water
-                    self.destroy_factory(factory)
-                    if self.collect_stats:
-                        self.state.stats[factory.team.agent]["destroyed"][
-                            "FACTORY"
-                        ] += 1
+            self._handle_refine_step()
             # power gain
-            if is_day(self.env_cfg, self.state.real_env_steps):
-                for agent in self.agents:
-                    for u in self.state.units[agent].values():
-                        if self.collect_stats:
-                            power_before = u.power
-                        u.power = u.power + self.env_cfg.ROBOTS[u.unit_type.name].CHARGE
-                        u.power = min(u.power, u.unit_cfg.BATTERY_CAPACITY)
-                        if self.collect_stats:
-                            self.state.stats[agent]["generation"]["power"][
-                                u.unit_type.name
-                            ] += (u.power - power_before)
-            for agent in self.agents:
-                for f in self.state.factories[agent].values():
-                    if self.collect_stats:
-                        power_before = f.power
-                    # natural nuclear energy generation
-                    f.power = f.power + self.env_cfg.FACTORY_CHARGE
-                    # lichen/plant power
-                    f.power = (
-                        f.power
-                        + len(f.connected_lichen_positions)
-                        * self.env_cfg.POWER_PER_CONNECTED_LICHEN_TILE
-                    )
-                    if self.collect_stats:
-                        self.state.stats[agent]["generation"]["power"]["FACTORY"] += (
-                            f.power - power_before
-                        )
+            self._handle_unit_power_gain()
+            self._handle_factory_power_gain()
 
         # always set rubble under factories to 0.
         self.state.board.rubble[self.state.board.factory_occupancy_map != -1] = 0
@@ -1004,7 +931,8 @@ class LuxAI_S2(ParallelEnv):
         terminations = {agent: env_done or failed_agents[agent] for agent in self.agents}
         truncations = {agent: False or failed_agents[agent] for agent in self.agents}
         # generate observations
-        obs = self.state.get_obs()
+        self.obs_generation += 1
+        obs = self.state.get_obs(copy=self.copy_obs)
         observations = {}
         for k in self.agents:
             observations[k] = obs
@@ -1028,7 +956,7 @@ class LuxAI_S2(ParallelEnv):
         unit.pos.pos = pos.copy()
         self.state.global_id += 1
         self.state.units[team.agent][unit.unit_id] = unit
-        self.state.board.units_map[self.state.board.pos_hash(unit.pos)].append(unit)
+        self.state.board.add_unit(unit)
         return unit
 
     def add_factory(self, team: Team, pos: np.ndarray):
@@ -1081,8 +1009,9 @@ class LuxAI_S2(ParallelEnv):
 
     def destroy_unit(self, unit: Unit):
         """
-        # NOTE this doesn't remove unit reference from board map
+        # NOTE the unit is only removed from the board's units_map if it still occupies its tile there
         """
+        self.state.board.remove_unit(unit)
         self.state.board.rubble[unit.pos.x, unit.pos.y] = min(
             self.state.board.rubble[unit.pos.x, unit.pos.y]
             + unit.unit_cfg.RUBBLE_AFTER_DESTRUCTION,
@@ -26,6 +26,23 @@ except:
     pass
 
 
+# the 12 tiles next to a factory the lichen BFS starts from, see Factory.cache_water_info
+WATER_INFO_DELTAS = np.array([
+    [0, -2],
+    [-1, -2],
+    [1, -2],
+    [0, 2],
+    [-1, 2],
+    [1, 2],
+    [2, 0],
+    [2, -1],
+    [2, 1],
+    [-2, 0],
+    [-2, -1],
+    [-2, 1],
+])
+
+
 def compute_water_info(
     init: np.ndarray,
     MIN_LICHEN_TO_SPREAD: int,
@@ -35,7 +52,22 @@ def compute_water_info(
     strain_id: int,
     forbidden: np.ndarray,
 ):
-    # TODO - improve the performance here with cached solution
+    grow_lichen_positions, connected_lichen_positions, _ = _water_info_search(
+        init, MIN_LICHEN_TO_SPREAD, lichen, lichen_strains, factory_occupancy_map, strain_id, forbidden
+    )
+    return grow_lichen_positions, connected_lichen_positions
+
+
+def _water_info_search(
+    init: np.ndarray,
+    MIN_LICHEN_TO_SPREAD: int,
+    lichen: np.ndarray,
+    lichen_strains: np.ndarray,
+    factory_occupancy_map: np.ndarray,
+    strain_id: int,
+    forbidden: np.ndarray,
+):
+    # BFS behind compute_water_info, also returns every position the search visited
     frontier = deque(init)
     seen = set(map(tuple, init))
     grow_lichen_positions = set()
@@ -99,7 +131,19 @@ def compute_water_info(
             grow_lichen_positions.add((pos[0], pos[1]))
             if lichen_strains[pos[0], pos[1]] == strain_id:
                 connected_lichen_positions.add((pos[0], pos[1]))
-    return grow_lichen_positions, connected_lichen_positions
+    return grow_lichen_positions, connected_lichen_positions, seen
+
+
+def lichen_growth_forbidden(board: Board) -> np.ndarray:
+    """
+    tiles lichen can never grow on. Shared by every factory, compute it once per step
+    """
+    return (
+        (board.rubble > 0)
+        | (board.factory_occupancy_map != -1)
+        | (board.ice > 0)
+        | (board.ore > 0)
+    )
 
 
 class FactoryStateDict(TypedDict):
@@ -123,6 +167,8 @@ class Factory:
         self.action_queue = []
         self.grow_lichen_positions = set()
         self.connected_lichen_positions = set()
+        # (region, snapshot of the BFS inputs in that region) of the last cache_water_info search
+        self._water_info_cache = None
 
     @property
     def pos_slice(self):
@@ -235,8 +281,7 @@ class Factory:
         self.cargo.water += produced_water
         self.cargo.metal += produced_metal
 
-    def cache_water_info(self, board: Board, env_cfg: EnvConfig):
-        # TODO this can easily be a fairly slow function, can we make it much faster?
+    def cache_water_info(self, board: Board, env_cfg: EnvConfig, forbidden: np.ndarray = None):
         # Caches information about which tiles lichen can grow on for this factory
 
         # perform a BFS from the factory position and look for non rubble, non factory tiles.
@@ -250,28 +295,19 @@ class Factory:
            x x x
 
         """
-        forbidden = (
-            (board.rubble > 0)
-            | (board.factory_occupancy_map != -1)
-            | (board.ice > 0)
-            | (board.ore > 0)
-        )
-        deltas = [
-            np.array([0, -2]),
-            np.array([-1, -2]),
-            np.array([1, -2]),
-            np.array([0, 2]),
-            np.array([-1, 2]),
-            np.array([1, 2]),
-            np.array([2, 0]),
-            np.array([2, -1]),
-            np.array([2, 1]),
-            np.array([-2, 0]),
-            np.array([-2, -1]),
-            np.array([-2, 1]),
-        ]
-        init_arr = np.stack(deltas) + self.pos.pos
-        self.grow_lichen_positions, self.connected_lichen_positions = compute_water_info(
+        if forbidden is None:
+            forbidden = lichen_growth_forbidden(board)
+        # the search only reads the tiles it visits and their neighbors, so if none of its inputs changed in that
+        # region since the last search the result is the same and the BFS can be skipped
+        if self._water_info_cache is not None:
+            region, snapshot = self._water_info_cache
+            if all(
+                np.array_equal(prev, current)
+                for prev, current in zip(snapshot, self._water_info_inputs(board, env_cfg, forbidden, region))
+            ):
+                return
+        init_arr = WATER_INFO_DELTAS + self.pos.pos
+        self.grow_lichen_positions, self.connected_lichen_positions, seen = _water_info_search(
             init_arr,
             env_cfg.MIN_LICHEN_TO_SPREAD,
             board.lichen,
@@ -280,6 +316,22 @@ class Factory:
             self.num_id,
             forbidden,
         )
+        # bounding box of the visited tiles grown by one for the neighbor checks, clipped to the board
+        seen = np.array(list(seen))
+        lo = np.maximum(seen.min(axis=0) - 1, 0)
+        hi = seen.max(axis=0) + 2
+        region = (slice(lo[0], hi[0]), slice(lo[1], hi[1]))
+        self._water_info_cache = (region, self._water_info_inputs(board, env_cfg, forbidden, region))
+
+    @staticmethod
+    def _water_info_inputs(board: Board, env_cfg: EnvConfig, forbidden: np.ndarray, region):
+        # everything the lichen BFS reads, lichen values only matter through the spread threshold
+        return (
+            forbidden[region].copy(),
+            board.lichen[region] >= env_cfg.MIN_LICHEN_TO_SPREAD,
+            board.lichen_strains[region].copy(),
+            board.factory_occupancy_map[region].copy(),
+        )
 
     def water_cost(self, config: EnvConfig):
         return int(
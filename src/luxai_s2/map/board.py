@@ -1,7 +1,6 @@
 from __future__ import annotations
 
-from collections import defaultdict
-from typing import TYPE_CHECKING, Dict, List
+from typing import TYPE_CHECKING, Dict, List, Optional
 try:
     from typing import TypedDict    
 except:
@@ -18,6 +17,7 @@ if TYPE_CHECKING:
 
 from luxai_s2.map.position import Position
 from luxai_s2.map_generator.generator import GameMap
+from luxai_s2.map_generator.pool import MapPool
 from luxai_s2.unit import Unit
 
 
@@ -31,9 +31,19 @@ class BoardStateDict(TypedDict):
     factories_per_team: int
 
 
+def _readonly_view(arr: np.ndarray) -> np.ndarray:
+    view = arr.view()
+    view.flags.writeable = False
+    return view
+
+
 class Board:
     def __init__(
-        self, seed=None, env_cfg: EnvConfig = None, existing_map: GameMap = None
+        self,
+        seed=None,
+        env_cfg: EnvConfig = None,
+        existing_map: GameMap = None,
+        map_pool: MapPool = None,
     ) -> None:
         self.env_cfg = env_cfg
         self.height = self.env_cfg.map_size
@@ -41,12 +51,12 @@ class Board:
         self.seed = seed
         rng = np.random.RandomState(seed=seed)
         if existing_map is None:
-            self.gen_map(seed, rng, env_cfg)
+            self.gen_map(seed, rng, env_cfg, map_pool=map_pool)
         else:
             self.map = existing_map
         self.post_map_gen(env_cfg, rng)
 
-    def gen_map(self, seed, rng, env_cfg):
+    def gen_map(self, seed, rng, env_cfg, map_pool: MapPool = None):
 
         map_type = rng.choice(["Cave", "Mountain"])
         map_distribution_type = rng.choice(
@@ -58,6 +68,11 @@ class Board:
             ]
         )
         symmetry = rng.choice(["horizontal", "vertical"])
+        # the draws above still happen for pooled maps so the rest of the board comes out the same
+        if map_pool is not None and seed is not None:
+            self.map = map_pool.load(seed, self.height, self.width)
+            if self.map is not None:
+                return
         self.map = GameMap.random_map(
             seed=seed,
             symmetry=symmetry,
@@ -80,9 +95,10 @@ class Board:
         # ownership of lichen by factory id, a simple mask
         # -1 = no ownership
         self.lichen_strains = -np.ones((self.height, self.width), dtype=int)
-        # self.units_map: np.ndarray = np.zeros((self.height, self.width))
-        self.units_map: Dict[str, List[Unit]] = defaultdict(list)
-        # TODO consider unit occupancy map, may speed up computation by storing more info in a form indexable in numpy arrays
+        # != -1 if a unit is on the location. Equals the unit's number id, which indexes units_list
+        self.units_map = -np.ones((self.height, self.width), dtype=np.int32)
+        # flat list of units indexed by unit number id, None for ids that are factories or destroyed units
+        self.units_list: List[Optional[Unit]] = []
 
         # maps center of factory to the factory
         self.factory_map: Dict[str, "Factory"] = dict()
@@ -127,10 +143,28 @@ class Board:
     def pos_hash(self, pos: Position):
         return f"{pos.x},{pos.y}"
 
+    def flat_index(self, pos: Position) -> int:
+        return pos.x * self.width + pos.y
+
+    def add_unit(self, unit: Unit):
+        """
+        registers a unit on the tile at its current position. If another unit is already there (only happens when
+        a factory builds onto a unit) the new unit takes the tile, movement resolves the collision afterwards
+        """
+        if unit.num_id >= len(self.units_list):
+            self.units_list.extend([None] * (unit.num_id + 1 - len(self.units_list)))
+        self.units_list[unit.num_id] = unit
+        self.units_map[unit.pos.x, unit.pos.y] = unit.num_id
+
+    def remove_unit(self, unit: Unit):
+        self.units_list[unit.num_id] = None
+        if self.units_map[unit.pos.x, unit.pos.y] == unit.num_id:
+            self.units_map[unit.pos.x, unit.pos.y] = -1
+
     def get_units_at(self, pos: Position):
-        pos_hash = self.pos_hash(pos)
-        if pos_hash in self.units_map:
-            return self.units_map[pos_hash]
+        unit_num_id = self.units_map[pos.x, pos.y]
+        if unit_num_id != -1:
+            return [self.units_list[unit_num_id]]
         return None
 
     def get_factory_at(self, state: State, pos: Position):
@@ -155,13 +189,18 @@ class Board:
     def ore(self):
         return self.map.ore
 
-    def state_dict(self) -> BoardStateDict:
+    def state_dict(self, copy: bool = True) -> BoardStateDict:
+        """
+        copy=False returns read-only views of the board arrays instead of copies. They change as the game is
+        stepped, so they are only valid until the next step
+        """
+        to_obs = np.copy if copy else _readonly_view
         return dict(
-            rubble=self.rubble.copy(),
-            ore=self.ore.copy(),
-            ice=self.ice.copy(),
-            lichen=self.lichen.copy(),
-            lichen_strains=self.lichen_strains.copy(),
-            valid_spawns_mask=self.valid_spawns_mask.copy(),
+            rubble=to_obs(self.rubble),
+            ore=to_obs(self.ore),
+            ice=to_obs(self.ice),
+            lichen=to_obs(self.lichen),
+            lichen_strains=to_obs(self.lichen_strains),
+            valid_spawns_mask=to_obs(self.valid_spawns_mask),
             factories_per_team=self.factories_per_team,
         )
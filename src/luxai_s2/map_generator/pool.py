@@ -0,0 +1,139 @@
+"""
+Pool of pre-generated maps stored on disk, so that resets can load a map instead of running the map generator.
+
+A pool is a directory of .npy files (npz members can't be memory-mapped) with one entry per board seed:
+
+    seeds.npy     int64 (N,)      board seed the map was generated with, the seed Board gets from LuxAI_S2.reset
+    rubble.npy    int16 (N, H, W)
+    ice.npy       uint8 (N, H, W)
+    ore.npy       uint8 (N, H, W)
+    symmetry.npy  uint8 (N,)      index into SYMMETRIES
+
+Generate one for the env seeds 0..9999 with
+
+    python -m luxai_s2.map_generator.pool maps/ --seeds 0 10000 --workers 8
+
+and use it with LuxAI_S2(map_pool="maps/"). Seeds that are not in the pool (or a pool made for another map size)
+fall back to generating the map, so a pool never changes the maps a seed produces.
+"""
+import argparse
+import os.path as osp
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import numpy as np
+
+from luxai_s2.map_generator.generator import GameMap
+
+SYMMETRIES = ("horizontal", "vertical", "rotational", "/", "\\")
+POOL_DTYPES = dict(rubble=np.int16, ice=np.uint8, ore=np.uint8)
+
+
+def board_seed(seed: int) -> int:
+    """
+    the seed LuxAI_S2.reset(seed=seed) generates its board with
+    """
+    return int(np.random.RandomState(seed=seed).randint(0, 2**32 - 1, dtype=np.int64))
+
+
+class MapPool:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.seeds = np.load(osp.join(path, "seeds.npy"))
+        self.layers = {name: np.load(osp.join(path, f"{name}.npy"), mmap_mode="r") for name in POOL_DTYPES}
+        self.symmetry = np.load(osp.join(path, "symmetry.npy"))
+        self.height, self.width = self.layers["rubble"].shape[1:]
+        self.index: Dict[int, int] = {seed: i for i, seed in enumerate(self.seeds.tolist())}
+
+    def __len__(self) -> int:
+        return len(self.seeds)
+
+    def __contains__(self, seed) -> bool:
+        return int(seed) in self.index
+
+    def load(self, seed, height: int, width: int) -> Optional[GameMap]:
+        """
+        the map generated for the given board seed, or None if the pool does not have it for this map size
+        """
+        i = self.index.get(int(seed))
+        if i is None or (height, width) != (self.height, self.width):
+            return None
+        # copies of the memory-mapped slices, with the same int dtype Board.gen_map gives the generated maps
+        return GameMap(
+            rubble=self.layers["rubble"][i].astype(int),
+            ice=self.layers["ice"][i].astype(int),
+            ore=self.layers["ore"][i].astype(int),
+            symmetry=SYMMETRIES[self.symmetry[i]],
+        )
+
+
+def _generate(args):
+    from luxai_s2.config import EnvConfig
+    from luxai_s2.map.board import Board
+
+    seed, map_size = args
+    board = Board(seed=seed, env_cfg=EnvConfig(map_size=map_size))
+    return board.map
+
+
+def generate_map_pool(path: str, seeds: Iterable[int], map_size: int = 48, workers: int = 1) -> MapPool:
+    """
+    generates the maps LuxAI_S2.reset would generate for the given env seeds and writes them to a pool at `path`
+    """
+    board_seeds = np.array(sorted(set(board_seed(seed) for seed in seeds)), dtype=np.int64)
+    n = len(board_seeds)
+    Path(path).mkdir(parents=True, exist_ok=True)
+    np.save(osp.join(path, "seeds.npy"), board_seeds)
+    layers = {
+        name: np.lib.format.open_memmap(
+            osp.join(path, f"{name}.npy"), mode="w+", dtype=dtype, shape=(n, map_size, map_size)
+        )
+        for name, dtype in POOL_DTYPES.items()
+    }
+    symmetry = np.zeros(n, dtype=np.uint8)
+
+    tasks = [(seed, map_size) for seed in board_seeds.tolist()]
+    if workers > 1:
+        import multiprocessing
+
+        with multiprocessing.Pool(workers) as p:
+            maps = p.imap(_generate, tasks, chunksize=16)
+            _write_maps(layers, symmetry, maps)
+    else:
+        _write_maps(layers, symmetry, map(_generate, tasks))
+    for layer in layers.values():
+        layer.flush()
+    np.save(osp.join(path, "symmetry.npy"), symmetry)
+    return MapPool(path)
+
+
+def _write_maps(layers, symmetry, maps):
+    for i, game_map in enumerate(maps):
+        for name, layer in layers.items():
+            value = getattr(game_map, name)
+            layer[i] = value
+            if not np.array_equal(layer[i], value):
+                raise ValueError(f"{name} values of map {i} do not fit into {layer.dtype}")
+        symmetry[i] = SYMMETRIES.index(game_map.symmetry)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate a pool of Lux AI Season 2 maps for fast resets.")
+    parser.add_argument("path", help="Directory to write the pool to")
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs=2,
+        default=[0, 10000],
+        metavar=("START", "STOP"),
+        help="Range of env seeds (as passed to LuxAI_S2.reset) to generate maps for",
+    )
+    parser.add_argument("--map-size", type=int, default=48)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    pool = generate_map_pool(args.path, range(*args.seeds), map_size=args.map_size, workers=args.workers)
+    print(f"wrote {len(pool)} maps to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,2 @@
 from .state import DeltaObservationStateDict, ObservationStateDict, State
-from .stats import StatsStateDict, create_empty_stats
+from .stats import STATS_INDEX, STATS_KEYS, StatsDictView, StatsStateDict, TeamStats, TeamStatsView, create_empty_stats
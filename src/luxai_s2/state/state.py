@@ -1,7 +1,7 @@
 import copy
 from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Dict, List
+from typing import Dict, List, Union
 
 try:
     from typing import TypedDict    
@@ -16,16 +16,22 @@ from luxai_s2.config import EnvConfig
 from luxai_s2.factory import Factory, FactoryStateDict
 from luxai_s2.map.board import Board, BoardStateDict
 from luxai_s2.map_generator.generator import GameMap
-from luxai_s2.state.stats import StatsStateDict
+from luxai_s2.state.stats import TeamStats
 from luxai_s2.team import Team, TeamStateDict
 from luxai_s2.unit import (FactionTypes, Unit, UnitCargo, UnitStateDict,
                            UnitType)
 
 
+class CompactBoardDelta(TypedDict):
+    # flat (row major) indices of the changed tiles and their new values
+    index: npt.NDArray[np.int_]
+    value: npt.NDArray[np.int_]
+
+
 class SparseBoardStateDict(TypedDict):
-    rubble: Dict[str, int]
-    lichen: Dict[str, int]
-    lichen_strains: Dict[str, int]
+    rubble: Union[Dict[str, int], CompactBoardDelta]
+    lichen: Union[Dict[str, int], CompactBoardDelta]
+    lichen_strains: Union[Dict[str, int], CompactBoardDelta]
     factories_per_team: int
 
 
@@ -47,6 +53,19 @@ class ObservationStateDict(TypedDict):
     global_id: int
 
 
+def apply_board_delta(board_arr: np.ndarray, delta):
+    """
+    writes one board's changes from a change observation (see State.get_change_obs) into board_arr in place
+    """
+    if "index" in delta:
+        np.put(board_arr, np.asarray(delta["index"], dtype=np.int64), delta["value"])
+        return
+    for k, v in delta.items():
+        k = k.split(",")
+        x, y = int(k[0]), int(k[1])
+        board_arr[x, y] = v
+
+
 @dataclass
 class State:
     seed_rng: np.random.RandomState
@@ -58,7 +77,7 @@ class State:
     factories: Dict[str, Dict[str, Factory]] = field(default_factory=dict)
     teams: Dict[str, Team] = field(default_factory=dict)
     global_id: int = 0
-    stats: Dict[str, StatsStateDict] = field(default_factory=dict)
+    stats: Dict[str, TeamStats] = field(default_factory=dict)
 
     @property
     def real_env_steps(self):
@@ -106,11 +125,15 @@ class State:
                 factories[team][factory.unit_id] = state_dict
         return factories
 
-    def get_obs(self) -> ObservationStateDict:
+    def get_obs(self, copy: bool = True) -> ObservationStateDict:
+        """
+        copy=False gives read-only views of the board arrays instead of copies, see Board.state_dict. Use the
+        default for anything that keeps observations around, e.g. replays
+        """
         units = State.generate_unit_data(self.units)
         teams = State.generate_team_data(self.teams)
         factories = State.generate_factory_data(self.factories)
-        board = self.board.state_dict()
+        board = self.board.state_dict(copy=copy)
         return dict(
             units=units,
             teams=teams,
@@ -133,44 +156,36 @@ class State:
         return data
 
     def get_change_obs(
-        self, prev_state: ObservationStateDict
+        self, prev_state: ObservationStateDict, compact: bool = False
     ) -> DeltaObservationStateDict:
         """
         returns sparse dicts for large matrices of where values change only by comparing against a given previous observation/state
+
+        With compact=True every changed board is given as parallel arrays instead, {"index": flat indices, "value": new values},
+        which avoids building and parsing a "x,y" string key per changed tile
         """
         data = self.get_compressed_obs()
 
-        data["board"]["rubble"] = dict()
-        data["board"]["lichen"] = dict()
-        data["board"]["lichen_strains"] = dict()
-        change_indices = np.argwhere(self.board.rubble != prev_state["board"]["rubble"])
-        for ind in change_indices:
-            x, y = ind[0], ind[1]
-            data["board"]["rubble"][f"{x},{y}"] = self.board.rubble[x, y]
-        change_indices = np.argwhere(self.board.lichen != prev_state["board"]["lichen"])
-        for ind in change_indices:
-            x, y = ind[0], ind[1]
-            data["board"]["lichen"][f"{x},{y}"] = self.board.lichen[x, y]
-        change_indices = np.argwhere(
-            self.board.lichen_strains != prev_state["board"]["lichen_strains"]
-        )
-        for ind in change_indices:
-            x, y = ind[0], ind[1]
-            data["board"]["lichen_strains"][f"{x},{y}"] = self.board.lichen_strains[
-                x, y
-            ]
+        for item in ["rubble", "lichen", "lichen_strains"]:
+            current = getattr(self.board, item)
+            if compact:
+                index = np.flatnonzero(current != prev_state["board"][item])
+                data["board"][item] = dict(index=index, value=np.take(current, index))
+                continue
+            data["board"][item] = dict()
+            change_indices = np.argwhere(current != prev_state["board"][item])
+            for ind in change_indices:
+                x, y = ind[0], ind[1]
+                data["board"][item][f"{x},{y}"] = current[x, y]
         return data
 
     @staticmethod
     def accumulate_board_changes(board: Board, board_change_observations: List):
-        # Accumulates the delta changes to a board from change observations.
+        # Accumulates the delta changes to a board from change observations, in either delta format.
         # Should be used with `from_obs` if the obs given is missing initial observation info
         for obs in board_change_observations:
             for item in ["rubble", "lichen", "lichen_strains"]:
-                for k, v in obs[item].items():
-                    k = k.split(",")
-                    x, y = int(k[0]), int(k[1])
-                    board.__getattribute__(item)[x, y] = v
+                apply_board_delta(board.__getattribute__(item), obs[item])
 
     @classmethod
     def from_obs(cls, obs: ObservationStateDict, env_cfg: EnvConfig):
@@ -222,7 +237,7 @@ class State:
                 ]
 
                 units[agent][unit_id] = unit
-                board.units_map[board.pos_hash(unit.pos)].append(unit)
+                board.add_unit(unit)
 
         factory_occupancy_map = np.ones_like(obs["board"]["rubble"], dtype=int) * -1
         factories = dict()
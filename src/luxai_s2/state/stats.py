@@ -1,7 +1,10 @@
 import copy
 from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
 from dataclasses import dataclass, field
-from typing import Dict, List
+from typing import Dict, List, Tuple
+
+import numpy as np
 
 try:
     from typing import TypedDict    
@@ -128,3 +131,138 @@ def create_empty_stats() -> StatsStateDict:
     stats["pickup"] = create_transfer_pickup_stats()
     stats["transfer"] = create_transfer_pickup_stats()
     return stats
+
+
+def _flatten_stats_keys(stats: dict, prefix: Tuple[str, ...] = ()) -> List[Tuple[str, ...]]:
+    # sorted like tree.flatten_with_path so flattened logs keep their order
+    keys = []
+    for k in sorted(stats):
+        if isinstance(stats[k], dict):
+            keys += _flatten_stats_keys(stats[k], prefix + (k,))
+        else:
+            keys.append(prefix + (k,))
+    return keys
+
+
+# key path of every counter in TeamStats.counters, e.g. ("generation", "ice", "HEAVY")
+STATS_KEYS: Tuple[Tuple[str, ...], ...] = tuple(_flatten_stats_keys(create_empty_stats()))
+STATS_INDEX: Dict[Tuple[str, ...], int] = {path: i for i, path in enumerate(STATS_KEYS)}
+
+
+def _stats_children(keys: Tuple[Tuple[str, ...], ...]) -> Dict[Tuple[str, ...], Tuple[str, ...]]:
+    children: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+    for path in keys:
+        for depth in range(len(path)):
+            keys_below = children.setdefault(path[:depth], ())
+            if path[depth] not in keys_below:
+                children[path[:depth]] = keys_below + (path[depth],)
+    return children
+
+
+# keys below every inner path of the nested StatsStateDict, () being the top level
+STATS_CHILDREN: Dict[Tuple[str, ...], Tuple[str, ...]] = _stats_children(STATS_KEYS)
+
+
+class TeamStats:
+    """
+    Stats of one team kept as a flat int64 counter vector, `counters[STATS_INDEX[path]]` counts the entry at `path`
+    of the nested StatsStateDict. The nested dict is only built when asked for with `to_dict`, item access goes
+    through a write through TeamStatsView, so `stats["destroyed"]["LIGHT"] += 1` counts.
+    """
+
+    __slots__ = ("counters",)
+
+    def __init__(self, counters: np.ndarray = None) -> None:
+        if counters is None:
+            counters = np.zeros(len(STATS_KEYS), dtype=np.int64)
+        self.counters = counters
+
+    def add(self, amount, *path: str):
+        self.counters[STATS_INDEX[path]] += amount
+
+    def to_dict(self) -> StatsStateDict:
+        stats = create_empty_stats()
+        for path, value in zip(STATS_KEYS, self.counters.tolist()):
+            entry = stats
+            for k in path[:-1]:
+                entry = entry[k]
+            entry[path[-1]] = value
+        return stats
+
+    def __getitem__(self, key):
+        return TeamStatsView(self.counters)[key]
+
+    def __setitem__(self, key, value):
+        TeamStatsView(self.counters)[key] = value
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, TeamStats):
+            return np.array_equal(self.counters, other.counters)
+        return self.to_dict() == other
+
+    def __repr__(self) -> str:
+        return f"TeamStats({self.to_dict()})"
+
+
+class TeamStatsView(MutableMapping):
+    """
+    Write through view of the TeamStats counters below a key path, for code written against the nested dict stats:
+    `stats["generation"]["ice"]["HEAVY"] += 1` adds to the counter. Inner entries are views too and leaves are ints.
+    The keys are fixed, counters can be set but entries not added or removed. `to_dict` copies the entries out.
+    """
+
+    __slots__ = ("_counters", "_path")
+
+    def __init__(self, counters: np.ndarray, path: Tuple[str, ...] = ()) -> None:
+        self._counters = counters
+        self._path = path
+
+    def __getitem__(self, key):
+        path = self._path + (key,)
+        if path in STATS_INDEX:
+            return int(self._counters[STATS_INDEX[path]])
+        if path in STATS_CHILDREN:
+            return TeamStatsView(self._counters, path)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        path = self._path + (key,)
+        if path in STATS_CHILDREN:
+            raise TypeError(f"{path} holds several counters, set them one by one")
+        if path not in STATS_INDEX:
+            raise KeyError(key)
+        self._counters[STATS_INDEX[path]] = value
+
+    def __delitem__(self, key):
+        raise TypeError("stats entries can not be removed")
+
+    def __iter__(self):
+        return iter(STATS_CHILDREN[self._path])
+
+    def __len__(self) -> int:
+        return len(STATS_CHILDREN[self._path])
+
+    def to_dict(self) -> dict:
+        return {key: value.to_dict() if isinstance(value, TeamStatsView) else value for key, value in self.items()}
+
+    def __repr__(self) -> str:
+        return f"TeamStatsView({self.to_dict()})"
+
+
+class StatsDictView(Mapping):
+    """
+    Read only mapping from agent to that agent's stats as a nested StatsStateDict, converted on access. For code
+    written against the dict stats, e.g. reward parsers.
+    """
+
+    def __init__(self, stats: Dict[str, TeamStats]) -> None:
+        self._stats = stats
+
+    def __getitem__(self, agent: str) -> StatsStateDict:
+        return self._stats[agent].to_dict()
+
+    def __iter__(self):
+        return iter(self._stats)
+
+    def __len__(self) -> int:
+        return len(self._stats)
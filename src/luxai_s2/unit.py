@@ -76,6 +76,8 @@ class Unit:
         self.team_id = team.team_id
         self.team = team
         self.unit_id = unit_id
+        # number version of unit_id, used to index the board's units_map
+        self.num_id = int(unit_id.split("_")[-1])
         self.pos = Position(np.zeros(2, dtype=int))
 
         self.cargo = UnitCargo()
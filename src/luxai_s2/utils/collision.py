@@ -0,0 +1,181 @@
+from typing import Tuple
+
+import numpy as np
+
+# larger than any unit power, used to keep segmented running maxima from leaking across tiles
+_GROUP_OFFSET = 1 << 40
+
+
+def _segment_starts(group: np.ndarray) -> np.ndarray:
+    starts = np.ones(len(group), dtype=bool)
+    starts[1:] = group[1:] != group[:-1]
+    return starts
+
+
+def _exclusive_segment_cummax(values: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """
+    running maximum of the previous values within each segment of consecutive equal `group` ids, -1 for the first
+    element of a segment. `values` must be >= -1 and `group` must be non-decreasing.
+    """
+    shifted = np.empty_like(values)
+    shifted[0] = -1
+    shifted[1:] = values[:-1]
+    shifted[_segment_starts(group)] = -1
+    # offsetting by group keeps the accumulate from carrying a maximum into the next segment
+    offset = group.astype(np.int64) * _GROUP_OFFSET
+    return np.maximum.accumulate(shifted + offset) - offset
+
+
+def top_two_power(group: np.ndarray, power: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized `luxai_s2.utils.utils.get_top_two_power_units` over many tiles at once.
+
+    `group` holds the tile id (0..n_groups-1, non-decreasing) of every candidate unit and `power` their power, in
+    the order the reference function would iterate over them. Returns the positions (indices into `group`) of the
+    most and next most power units of every tile, -1 where a tile has fewer than two candidates.
+
+    The reference scan only updates the next most power value in its elif branch, so the unit it returns as
+    the runner up is not always the true second highest. This reproduces that scan exactly:
+    - a unit is a new record if its power beats every earlier candidate on the tile, the most power unit is the
+      last record.
+    - a non-record unit is taken as runner up if its power is >= every earlier non-record candidate.
+    - a record after the first one hands the runner up spot to the record before it.
+    The runner up is whichever of these events happened last.
+    """
+    n = len(group)
+    most = -np.ones(n_groups, dtype=np.int64)
+    next_most = -np.ones(n_groups, dtype=np.int64)
+    if n == 0:
+        return most, next_most
+    idx = np.arange(n)
+    starts = _segment_starts(group)
+
+    record = power > _exclusive_segment_cummax(power, group)
+    non_record_power = np.where(record, -1, power)
+    runner_up = ~record & (power >= _exclusive_segment_cummax(non_record_power, group))
+
+    # index of the previous record within the tile, for records that displace an earlier one
+    record_idx = np.where(record, idx, -1)
+    prev_record = np.empty(n, dtype=np.int64)
+    prev_record[0] = -1
+    prev_record[1:] = np.maximum.accumulate(record_idx)[:-1]
+    prev_record[starts] = -1
+    # the accumulate above can carry a record index over from a previous tile
+    first_idx = np.maximum.accumulate(np.where(starts, idx, 0))
+    prev_record[prev_record < first_idx] = -1
+
+    np.maximum.at(most, group[record], idx[record])
+
+    displacing = record & (prev_record >= 0)
+    event = displacing | runner_up
+    last_event = -np.ones(n_groups, dtype=np.int64)
+    np.maximum.at(last_event, group[event], idx[event])
+    has_event = last_event >= 0
+    last = last_event[has_event]
+    next_most[has_event] = np.where(record[last], prev_record[last], last)
+
+    counts = np.bincount(group, minlength=n_groups)
+    most[counts < 2] = -1
+    next_most[counts < 2] = -1
+    return most, next_most
+
+
+def resolve_collisions(
+    pos_index: np.ndarray,
+    power: np.ndarray,
+    is_heavy: np.ndarray,
+    moved: np.ndarray,
+    power_loss_factor: float,
+):
+    """
+    Resolves the collisions of a whole movement phase at once with the rules of `LuxAI_S2._handle_movement_actions`.
+
+    All arrays have one entry per unit, ordered the way the reference implementation sees units on a tile: units
+    that moved this step in action order first, then stationary units in the order they arrived on their tile.
+
+    Args:
+        pos_index: flat index of the tile every unit is on after moving
+        power: power of every unit after paying for its move
+        is_heavy: True for heavy units
+        moved: True for units that entered their tile this step
+        power_loss_factor: the env's POWER_LOSS_FACTOR
+
+    Returns:
+        survive: bool mask of units that are not destroyed
+        power: power of every unit after collisions
+        collided: bool mask of units that shared their tile with another unit
+    """
+    n = len(pos_index)
+    power = power.astype(np.int64).copy()
+    survive = np.ones(n, dtype=bool)
+    if n == 0:
+        return survive, power, np.zeros(0, dtype=bool)
+
+    # stable sort keeps the reference order within each tile
+    order = np.argsort(pos_index, kind="stable")
+    _, group_sorted, counts = np.unique(pos_index[order], return_inverse=True, return_counts=True)
+    group = np.empty(n, dtype=np.int64)
+    group[order] = group_sorted
+    n_groups = len(counts)
+    collided = counts[group] > 1
+
+    heavy_in = np.bincount(group, weights=moved & is_heavy, minlength=n_groups)
+    light_in = np.bincount(group, weights=moved & ~is_heavy, minlength=n_groups)
+    heavy_all = np.bincount(group, weights=is_heavy, minlength=n_groups)
+
+    # surviving unit per tile, -1 if every unit on the tile is destroyed
+    survivor = -np.ones(n_groups, dtype=np.int64)
+    survivor[counts == 1] = order[np.flatnonzero(counts[group_sorted] == 1)]
+
+    def first_of(mask):
+        # first unit (in reference order) per tile that satisfies mask
+        first = np.full(n_groups, n, dtype=np.int64)
+        sel = order[mask[order]]
+        np.minimum.at(first, group[sel], np.flatnonzero(mask[order]))
+        has = first < n
+        first[has] = order[first[has]]
+        first[~has] = -1
+        return first
+
+    def top_two_of(mask):
+        sel = order[mask[order]]
+        most, next_most = top_two_power(group[sel], power[sel], n_groups)
+        has = most >= 0
+        most[has] = sel[most[has]]
+        next_most[has] = sel[next_most[has]]
+        return most, next_most
+
+    def resolve_top_two(tiles, most, next_most):
+        # the strongest unit survives and loses power, ties destroy every unit on the tile
+        m, nm = most[tiles], next_most[tiles]
+        winner = power[m] != power[nm]
+        loss = np.ceil(power[nm[winner]] * power_loss_factor).astype(np.int64)
+        power[m[winner]] -= loss
+        survivor[tiles[winner]] = m[winner]
+
+    multi = counts > 1
+    # several heavies entered: top two heavies by power fight it out
+    heavy_fight = np.flatnonzero(multi & (heavy_in > 1))
+    if len(heavy_fight) > 0:
+        resolve_top_two(heavy_fight, *top_two_of(is_heavy))
+    # a single heavy entered: it survives everything else
+    heavy_wins = np.flatnonzero(multi & (heavy_in == 1))
+    if len(heavy_wins) > 0:
+        survivor[heavy_wins] = first_of(moved & is_heavy)[heavy_wins]
+    # no heavy entered: exactly one stationary heavy survives, two or more stationary heavies crash
+    no_heavy_in = multi & (heavy_in == 0)
+    heavy_stays = np.flatnonzero(no_heavy_in & (heavy_all == 1))
+    if len(heavy_stays) > 0:
+        survivor[heavy_stays] = first_of(is_heavy)[heavy_stays]
+    # otherwise lights that entered decide, with the same top two rule when there are several of them
+    light_rules = no_heavy_in & (heavy_all != 1)
+    light_fight = np.flatnonzero(light_rules & (light_in > 1))
+    if len(light_fight) > 0:
+        resolve_top_two(light_fight, *top_two_of(~is_heavy))
+    light_wins = np.flatnonzero(light_rules & (light_in == 1))
+    if len(light_wins) > 0:
+        survivor[light_wins] = first_of(moved & ~is_heavy)[light_wins]
+
+    survive[:] = False
+    survive[survivor[survivor >= 0]] = True
+    return survive, power, collided
@@ -7,7 +7,9 @@ import gymnasium as gym
 from gymnasium import spaces
 import tree
 from luxai_s2.env import EnvConfig, LuxAI_S2
+from luxai_s2.state import StatsDictView
 from parsers import ActionParser,FeatureParser,DenseRewardParser,Dense2RewardParser,SparseRewardParser,IceRewardParser
+from parsers.action_parser_full_act import SPARSE_POSITION_KEYS
 from kit.kit import obs_to_game_state
 from replay import random_init
 from player import Player
@@ -17,7 +19,15 @@ import seeding
 from torch import Tensor
 import torch
 
-from gymnasium.vector.utils import concatenate, create_empty_array
+from gymnasium.vector.utils import concatenate, create_empty_array, iterate
+from gymnasium.vector.async_vector_env import AsyncState
+from gymnasium.error import AlreadyPendingCallError, NoAsyncCallError
+import multiprocessing as mp
+import multiprocessing.connection
+import time
+import functools
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
 from copy import deepcopy
 
 log_from_global_info = [
@@ -216,17 +226,23 @@ def crop_map(env, pos=(0, 0), size=24):
 
 class LuxEnv(gym.Env):
     
-    def __init__(self, kaggle_replays=None, device="cpu", max_entity_number: int = 1000, **kwargs):
+    def __init__(self, kaggle_replays=None, device="cpu", max_entity_number: int = 1000, sparse_valid_actions: bool = False, **kwargs):
         super().__init__(**kwargs)
 
         self.device = device
 
         self.current_seed = None
         self.max_entity_number = max_entity_number
+        # valid actions as [max_entity_number, ...] masks indexed by entity id instead of masks over the map, see
+        # ActionParser.get_sparse_valid_actions
+        self.sparse_valid_actions = sparse_valid_actions
 
+        # observations are only read within the step that produced them, so board arrays are handed out as views
         self.proxy = LuxAI_S2(
             collect_stats=True,
             verbose=False,
+            copy_obs=False,
+            map_pool=EnvParam.map_pool,
             MAX_FACTORIES=EnvParam.MAX_FACTORIES,
         )
         self.env_cfg = self.proxy.state.env_cfg
@@ -283,13 +299,13 @@ class LuxEnv(gym.Env):
         else:
             self.proxy.load_from_replay = False
             self.proxy.reset(seed=seed, options=options)
-        obs = self.proxy.state.get_obs()
+        obs = self.proxy.state.get_obs(copy=self.proxy.copy_obs)
         obs = {agent: obs for agent in self.proxy.agents}
         self.real_obs = obs
         return obs
 
     def seed(self, seed):
-        self.proxy.seed(seed)
+        # the engine is seeded by reset(seed=...), newer pettingzoo has no ParallelEnv.seed to call
         self.current_seed = seed
         seeding.set_seed(seed)
 
@@ -307,11 +323,11 @@ class LuxEnv(gym.Env):
                 obs, rewards, terminations, truncations, infos = self.proxy.step(actions)
         else:
             dones = {"player_0": False, "player_1": False}
+        game_states = self.obs_to_game_states(obs)
         for player_id, player in enumerate(self.proxy.agents):
-            o = obs[player]
-            self.game_state[player_id] = obs_to_game_state(self.proxy.env_steps, self.env_cfg, o)
-        obs_list, global_info = self.feature_parser.parse(obs, reset=True, env_cfg=self.env_cfg)
-        self.reward_parser.reset(self.game_state, global_info, self.proxy.state.stats)
+            self.game_state[player_id] = game_states[player]
+        obs_list, global_info = self.feature_parser.parse(obs, reset=True, env_cfg=self.env_cfg, game_states=game_states)
+        self.reward_parser.reset(self.game_state, global_info, StatsDictView(self.proxy.state.stats))
 
         return obs_list, global_info
 
@@ -326,10 +342,10 @@ class LuxEnv(gym.Env):
         truncations_final = np.ones((2, self.max_entity_number), dtype=np.bool_)
 
         self.real_obs = obs
+        game_states = self.obs_to_game_states(obs)
         for player_id, player in enumerate(self.proxy.agents):
-            o = obs[player]
-            self.game_state[player_id] = obs_to_game_state(self.proxy.env_steps, self.env_cfg, o)
-        obs_list, global_info = self.feature_parser.parse(obs, reset=False, env_cfg=self.env_cfg)
+            self.game_state[player_id] = game_states[player]
+        obs_list, global_info = self.feature_parser.parse(obs, reset=False, env_cfg=self.env_cfg, game_states=game_states)
 
         for player in range(2):
             unit_info = global_info[f"player_{player}"]["units"]
@@ -358,7 +374,7 @@ class LuxEnv(gym.Env):
         reward, sub_rewards = self.reward_parser.parse(
             dones,
             self.game_state,
-            self.proxy.state.stats,
+            StatsDictView(self.proxy.state.stats),
             global_info,
         )  # reward parser
         env_stats_logs = self.feature_parser.log_env_stats(self.proxy.state.stats)
@@ -376,6 +392,19 @@ class LuxEnv(gym.Env):
         info = info | global_info
         return obs_list, reward, terminations_final, truncations_final, info
     
+    def obs_to_game_states(self, obs):
+        """
+        kit game state of every player's observation. LuxAI_S2 gives both players the same observation object, which
+        is then only converted once
+        """
+        game_states = {}
+        converted = {}
+        for player, o in obs.items():
+            if id(o) not in converted:
+                converted[id(o)] = obs_to_game_state(self.proxy.env_steps, self.env_cfg, o)
+            game_states[player] = converted[id(o)]
+        return game_states
+
     def eval(self, own_policy, enemy_policy):
         np2torch = lambda x, dtype: torch.tensor(np.array(x)).type(dtype).to(self.device)
         own_id = 0
@@ -401,7 +430,7 @@ class LuxEnv(gym.Env):
                         np2torch([obs_list[f'player_{id}']['factory_feature']], torch.float32),
                         np2torch([obs_list[f'player_{id}']['unit_feature']], torch.float32),
                         np2torch([obs_list[f'player_{id}']['location_feature']], torch.int32),
-                        tree.map_structure(lambda x: np2torch([x], torch.bool), valid_action),
+                        valid_actions_to_torch(valid_action, lambda x, dtype: np2torch([x], dtype)),
                         is_deterministic=False
                     )
                 actions[id] = raw_action
@@ -431,9 +460,13 @@ class LuxEnv(gym.Env):
         return episode_length, return_own, return_enemy, info_sum_own, info_sum_enemy
 
     def get_valid_actions(self, player_id):
+        if self.sparse_valid_actions:
+            return self.action_parser.get_sparse_valid_actions(self.game_state[player_id], player_id, self.max_entity_number)
         return self.action_parser.get_valid_actions(self.game_state[player_id], player_id)
     
     def get_va_space(self, map_size):
+        if self.sparse_valid_actions:
+            return self.get_sparse_va_space(map_size)
         space = {
             'factory_act': spaces.MultiBinary([4, map_size, map_size]), 
             'move': spaces.MultiBinary([5, 2, map_size, map_size]), 
@@ -451,6 +484,24 @@ class LuxEnv(gym.Env):
         )
         
         return space
+
+    def get_sparse_va_space(self, map_size):
+        n = self.max_entity_number
+        space = {
+            'factory_act': spaces.MultiBinary([n, 4]),
+            'move': spaces.MultiBinary([n, 5, 2]),
+            'transfer': spaces.MultiBinary([n, 5, 5, 2]),
+            'pickup': spaces.MultiBinary([n, 5, 2]),
+            'dig': spaces.MultiBinary([n, 2]),
+            'self_destruct': spaces.MultiBinary([n, 2]),
+            'recharge': spaces.MultiBinary([n, 2]),
+            'do_nothing': spaces.MultiBinary([n]),
+            'factory_pos': spaces.Box(low=-1, high=map_size - 1, shape=(n, 2), dtype=np.int16),
+            'unit_pos': spaces.Box(low=-1, high=map_size - 1, shape=(n, 2), dtype=np.int16),
+        }
+        if not self.rule_based_early_step:
+            space.update({'bid': spaces.MultiBinary(11), 'factory_spawn': spaces.MultiBinary([map_size, map_size])})
+        return spaces.Dict(space)
     
     def concatenate_obs(self, observations_list):
         bs = len(observations_list)
@@ -487,41 +538,160 @@ class LuxEnv(gym.Env):
         # return deepcopy(actions)
         return actions
 
+def valid_actions_to_torch(valid_actions, np2torch):
+    """
+    masks to bool tensors, and the entity positions of sparse valid actions to long tensors
+    """
+    return tree.map_structure_with_path(
+        lambda path, x: np2torch(x, torch.long if path[-1] in SPARSE_POSITION_KEYS else torch.bool), valid_actions
+    )
+
+
+def valid_actions_for_players(env):
+    return [env.get_valid_actions(player_id) for player_id in range(2)]
+
+
+def shared_memory_template(env):
+    """
+    zero arrays shaped like one env's results that lux_worker writes to shared memory instead of sending them
+    """
+    env = env.unwrapped
+    entities = (2, env.max_entity_number)
+    va_space = env.get_va_space(env.env_cfg.map_size)
+    single = lambda space: tree.map_structure(lambda x: x[0], create_empty_array(space, n=1, fn=np.zeros))
+    return {
+        "observation": single(env.observation_space),
+        "valid_actions": [single(va_space) for _ in range(2)],
+        "reward": np.zeros(entities, dtype=np.float32),
+        "termination": np.zeros(entities, dtype=np.bool_),
+        "truncation": np.zeros(entities, dtype=np.bool_),
+    }
+
+
+class SharedArrays:
+    """
+    The arrays of a template (see shared_memory_template) with a leading env dimension, each one backed by a
+    multiprocessing.shared_memory block. The vector env creates the blocks, workers attach to them by name.
+    """
+    def __init__(self, template, num_envs: int, names: list[str] = None):
+        leaves = tree.flatten(template)
+        if names is None:
+            self.blocks = [SharedMemory(create=True, size=max(leaf.nbytes * num_envs, 1)) for leaf in leaves]
+        else:
+            self.blocks = [SharedMemory(name=name) for name in names]
+        # frombuffer holds on to the buffer, so close() cannot unmap blocks that arrays still point to
+        self.arrays = tree.unflatten_as(template, [
+            np.frombuffer(block.buf, dtype=leaf.dtype, count=leaf.size * num_envs).reshape((num_envs,) + leaf.shape)
+            for leaf, block in zip(leaves, self.blocks)
+        ])
+
+    @property
+    def names(self) -> list[str]:
+        return [block.name for block in self.blocks]
+
+    def slot(self, index: int):
+        return tree.map_structure(lambda x: x[index], self.arrays)
+
+    def close(self, unlink: bool = False):
+        self.arrays = None
+        for block in self.blocks:
+            try:
+                block.close()
+            except BufferError:
+                # arrays handed out without copying are still alive, the mapping goes away with them
+                pass
+            if unlink:
+                block.unlink()
+
+
+def write_to_slot(slot, value):
+    tree.map_structure_up_to(slot, lambda dst, src: np.copyto(dst, src, casting="unsafe"), slot, value)
+
+
+class LuxEnvGroup:
+    """
+    The LuxEnvs that one lux_worker process owns and steps in a loop, envs[i] is env first_index + i of the vector env
+    """
+    def __init__(self, env_fns, first_index: int = 0):
+        self.envs = [env_fn() for env_fn in env_fns]
+        self.first_index = first_index
+        self.metadata = self.envs[0].metadata
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+
 def lux_worker(index, env_fn, pipe, parent_pipe, shared_memory, error_queue):
     assert shared_memory is None
-    env = env_fn()
+    group: LuxEnvGroup = env_fn()
+    envs = group.envs
     parent_pipe.close()
+    # the slots of the group's envs in the vector env's SharedArrays, once the vector env asked to attach to them
+    shared_arrays, slots = None, None
     # try:
     while True:
         command, data = pipe.recv()
+        # commands carry one entry per env of the group and are answered with one message holding a result per env.
+        # reset and step also send the valid actions of both players for the new observation, which saves the two
+        # get_valid_actions round trips a training step would make otherwise. With shared memory, results are
+        # written to the slots and only infos go through the pipe
         if command == "reset":
-            if data is None:
-                data = {}
-            seed = data.get("seed", None)
-            options = data.get("options", None)
-            observation = env.reset(seed=seed, options=options)
-            pipe.send((observation, True))
+            results = []
+            for i, (env, kwargs) in enumerate(zip(envs, data)):
+                observation, info = env.reset(seed=kwargs.get("seed", None), options=kwargs.get("options", None))
+                if slots is None:
+                    results.append(((observation, info), valid_actions_for_players(env)))
+                else:
+                    write_to_slot(slots[i]["observation"], observation)
+                    write_to_slot(slots[i]["valid_actions"], valid_actions_for_players(env))
+                    results.append(info)
+            pipe.send((results, True))
         elif command == "step":
-            observation, reward, termination, truncation, info = env.step(data)
-            done = (termination | truncation).all(axis=-1).any()
-            if done:
-                observation, _ = env.reset()
-            pipe.send(((observation, reward, termination, truncation, info), True))
+            results = []
+            for i, (env, action) in enumerate(zip(envs, data)):
+                observation, reward, termination, truncation, info = env.step(action)
+                done = (termination | truncation).all(axis=-1).any()
+                if done:
+                    observation, _ = env.reset()
+                if slots is None:
+                    results.append(((observation, reward, termination, truncation, info), valid_actions_for_players(env)))
+                else:
+                    write_to_slot(slots[i], {
+                        "observation": observation,
+                        "valid_actions": valid_actions_for_players(env),
+                        "reward": reward,
+                        "termination": termination,
+                        "truncation": truncation,
+                    })
+                    results.append(info)
+            pipe.send((results, True))
+        elif command == "attach_shared_memory":
+            names, num_envs = data
+            shared_arrays = SharedArrays(shared_memory_template(envs[0]), num_envs, names)
+            slots = [shared_arrays.slot(group.first_index + i) for i in range(len(envs))]
+            pipe.send((None, True))
         elif command == "seed":
-            env.seed(data)
+            for env, seed in zip(envs, data):
+                env.seed(seed)
             pipe.send((None, True))
         elif command == "get_valid_actions":
-            valid_actions = env.get_valid_actions(data)
+            valid_actions = [env.get_valid_actions(data) for env in envs]
             pipe.send((valid_actions))
         elif command == "close":
+            if shared_arrays is not None:
+                slots = None
+                shared_arrays.close()
             pipe.send((None, True))
             break
         elif command == "_check_observation_space":
-            pipe.send((data == env.observation_space, True))
+            pipe.send((data == group.observation_space, True))
         elif command == "_check_spaces":
             pipe.send(
                 (
-                    (data[0] == env.observation_space, data[1] == env.action_space),
+                    (data[0] == group.observation_space, data[1] == group.action_space),
                     True,
                 )
             )
@@ -531,12 +701,12 @@ def lux_worker(index, env_fn, pipe, parent_pipe, shared_memory, error_queue):
             eval_policy = torch.load("eval_policy.pt")
             enemy_policy = torch.load("enemy_policy.pt")
 
-            episode_length, r_own, r_enemy, i_own, i_enemy = env.eval(eval_policy, enemy_policy)
-            pipe.send((episode_length, r_own, r_enemy, i_own, i_enemy))
+            # (episode_length, r_own, r_enemy, i_own, i_enemy) per env
+            pipe.send([env.eval(eval_policy, enemy_policy) for env in envs])
         else:
             raise RuntimeError(
                 f"Received unknown command `{command}`. Must "
-                "be one of {`reset`, `step`, `seed`, `close`, "
+                "be one of {`reset`, `step`, `seed`, `close`, `attach_shared_memory`, "
                 "`_check_observation_space`, `get_valid_actions`, "
                 "`_check_spaces`, "
                 "`eval`}."
@@ -545,29 +715,330 @@ def lux_worker(index, env_fn, pipe, parent_pipe, shared_memory, error_queue):
     #     error_queue.put((index,) + sys.exc_info()[:2])
     #     pipe.send((None, False))
     # finally:
-    env.close()
+    group.close()
 
 class LuxSyncVectorEnv(gym.vector.AsyncVectorEnv):
-    def __init__(self, env_fns, observation_space=None, action_space=None, copy=True, shared_memory=False, worker=lux_worker, device="cpu"):
-        super().__init__(env_fns=env_fns, observation_space=observation_space, action_space=action_space, copy=copy, shared_memory=shared_memory, worker=worker)
+    """
+    Runs the LuxEnvs in lux_worker processes, each one owning a LuxEnvGroup of up to envs_per_worker envs that it
+    steps in a loop, so the number of processes does not have to grow with the batch size.
+
+    With shared_memory=True the workers write observations, valid actions, rewards, terminations and truncations into
+    multiprocessing.shared_memory blocks (see SharedArrays) instead of pickling them through the pipes, which then only
+    carry commands and infos.
+    """
+    def __init__(self, env_fns, observation_space=None, action_space=None, copy=True, shared_memory=False, worker=lux_worker, device="cpu", envs_per_worker: int = 1):
+        if shared_memory:
+            # workers share the resource tracker if it runs before they start. Otherwise each would start its own,
+            # which unlinks the blocks it attached to when the worker exits
+            resource_tracker.ensure_running()
         dummy_env = env_fns[0]()
+        num_envs = len(env_fns)
+        # envs of every worker process
+        self.env_slices = [
+            slice(start, min(start + envs_per_worker, num_envs)) for start in range(0, num_envs, envs_per_worker)
+        ]
+        # gymnasium's own shared memory only covers observations, the workers are handed SharedArrays below instead
+        super().__init__(
+            env_fns=[functools.partial(LuxEnvGroup, env_fns[env_slice], env_slice.start) for env_slice in self.env_slices],
+            observation_space=observation_space or dummy_env.observation_space,
+            action_space=action_space or dummy_env.action_space,
+            copy=copy,
+            shared_memory=False,
+            worker=worker,
+        )
+        # gymnasium sized the batch by the number of processes
+        gym.vector.VectorEnv.__init__(self, num_envs, self.single_observation_space, self.single_action_space)
+        self.observations = create_empty_array(
+            self.single_observation_space, n=self.num_envs, fn=np.zeros
+        )
         self.single_vas_space = dummy_env.get_va_space(dummy_env.env_cfg.map_size)
         self.dummy_env_cfg = deepcopy(dummy_env.env_cfg)
         self.vas = create_empty_array(
             self.single_vas_space, n=self.num_envs, fn=np.zeros
         )
+        self.shared_arrays = None
+        if shared_memory:
+            self.shared_arrays = SharedArrays(shared_memory_template(dummy_env), self.num_envs)
+            for pipe in self.parent_pipes:
+                pipe.send(("attach_shared_memory", (self.shared_arrays.names, self.num_envs)))
+            _, successes = zip(*[pipe.recv() for pipe in self.parent_pipes])
+            self._raise_if_errors(successes)
+            self.observations = self.shared_arrays.arrays["observation"]
         dummy_env.close()
         del dummy_env
+        # valid actions per player sent along with the last reset/step results, None when they may be stale. Lists of
+        # per env valid actions, or the batched shared arrays with shared memory
+        self.cached_valid_actions = None
+        # workers with a step sent by step_async_envs whose results step_wait_any has not received yet
+        self.pending_workers = set()
+        self.env_workers = np.repeat(
+            np.arange(len(self.env_slices)), [env_slice.stop - env_slice.start for env_slice in self.env_slices]
+        )
 
         self.rule_based_early_step = EnvParam.rule_based_early_step
 
         self.device = device
-    
-    def get_valid_actions(self, player_id):
+
+    def _recv_env_results(self):
+        """
+        receives a reply from every worker and returns their per env results in env order
+        """
+        results, successes = zip(*[pipe.recv() for pipe in self.parent_pipes])
+        self._raise_if_errors(successes)
+        return [result for worker_results in results for result in worker_results]
+
+    def _assert_no_pending_envs(self, name):
+        if self.pending_workers:
+            raise AlreadyPendingCallError(
+                f"Calling `{name}` while the steps of envs sent by `step_async_envs` are pending", "step_async_envs"
+            )
+
+    def reset_async(self, seed=None, options=None):
         self._assert_is_running()
-        for pipe in self.parent_pipes:
-            pipe.send(("get_valid_actions", player_id))
-        valid_actions = [pipe.recv() for pipe in self.parent_pipes]
+        self._assert_no_pending_envs("reset_async")
+        if seed is None:
+            seed = [None for _ in range(self.num_envs)]
+        if isinstance(seed, int):
+            seed = [seed + i for i in range(self.num_envs)]
+        assert len(seed) == self.num_envs
+        if self._state != AsyncState.DEFAULT:
+            raise AlreadyPendingCallError(
+                f"Calling `reset_async` while waiting for a pending call to `{self._state.value}` to complete",
+                self._state.value,
+            )
+
+        kwargs = [dict(seed=single_seed, options=options) for single_seed in seed]
+        for pipe, env_slice in zip(self.parent_pipes, self.env_slices):
+            pipe.send(("reset", kwargs[env_slice]))
+        self._state = AsyncState.WAITING_RESET
+
+    def reset_wait(self, timeout=None, seed=None, options=None):
+        self._assert_is_running()
+        if self._state != AsyncState.WAITING_RESET:
+            raise NoAsyncCallError(
+                "Calling `reset_wait` without any prior call to `reset_async`.",
+                AsyncState.WAITING_RESET.value,
+            )
+        if not self._poll(timeout):
+            self._state = AsyncState.DEFAULT
+            raise mp.TimeoutError(f"The call to `reset_wait` has timed out after {timeout} second(s).")
+
+        results = self._recv_env_results()
+        self._state = AsyncState.DEFAULT
+
+        infos = {}
+        if self.shared_arrays is not None:
+            self.cached_valid_actions = self.shared_arrays.arrays["valid_actions"]
+            for i, info in enumerate(results):
+                infos = self._add_info(infos, info, i)
+            return (deepcopy(self.observations) if self.copy else self.observations), infos
+
+        results, valid_actions = zip(*results)
+        self.cached_valid_actions = [list(player_valid_actions) for player_valid_actions in zip(*valid_actions)]
+        observations_list, info_data = zip(*results)
+        for i, info in enumerate(info_data):
+            infos = self._add_info(infos, info, i)
+        self.observations = concatenate(
+            self.single_observation_space, observations_list, self.observations
+        )
+        return (deepcopy(self.observations) if self.copy else self.observations), infos
+
+    def step_async(self, actions):
+        self._assert_is_running()
+        self._assert_no_pending_envs("step_async")
+        if self._state != AsyncState.DEFAULT:
+            raise AlreadyPendingCallError(
+                f"Calling `step_async` while waiting for a pending call to `{self._state.value}` to complete.",
+                self._state.value,
+            )
+
+        actions = list(iterate(self.action_space, actions))
+        for pipe, env_slice in zip(self.parent_pipes, self.env_slices):
+            pipe.send(("step", actions[env_slice]))
+        self._state = AsyncState.WAITING_STEP
+
+    def step_wait(self, timeout=None):
+        self._assert_is_running()
+        if self._state != AsyncState.WAITING_STEP:
+            raise NoAsyncCallError(
+                "Calling `step_wait` without any prior call to `step_async`.",
+                AsyncState.WAITING_STEP.value,
+            )
+        if not self._poll(timeout):
+            self._state = AsyncState.DEFAULT
+            raise mp.TimeoutError(f"The call to `step_wait` has timed out after {timeout} second(s).")
+
+        results = self._recv_env_results()
+        self._state = AsyncState.DEFAULT
+
+        if self.shared_arrays is not None:
+            arrays = self.shared_arrays.arrays
+            self.cached_valid_actions = arrays["valid_actions"]
+            infos = {}
+            for i, info in enumerate(results):
+                infos = self._add_info(infos, info, i)
+            return (
+                deepcopy(self.observations) if self.copy else self.observations,
+                arrays["reward"].copy(),
+                arrays["termination"].copy(),
+                arrays["truncation"].copy(),
+                infos,
+            )
+
+        results, valid_actions = zip(*results)
+        self.cached_valid_actions = [list(player_valid_actions) for player_valid_actions in zip(*valid_actions)]
+        observations_list, rewards, terminateds, truncateds, infos = [], [], [], [], {}
+        for i, (observation, reward, terminated, truncated, info) in enumerate(results):
+            observations_list.append(observation)
+            rewards.append(reward)
+            terminateds.append(terminated)
+            truncateds.append(truncated)
+            infos = self._add_info(infos, info, i)
+        self.observations = concatenate(
+            self.single_observation_space, observations_list, self.observations
+        )
+        return (
+            deepcopy(self.observations) if self.copy else self.observations,
+            np.array(rewards),
+            np.array(terminateds, dtype=np.bool_),
+            np.array(truncateds, dtype=np.bool_),
+            infos,
+        )
+
+    def step_async_envs(self, actions, env_ids):
+        """
+        Sends actions batched over env_ids to those envs and returns without waiting, step_wait_any then returns
+        whichever envs are done first. Other envs can be sent their next step while some are still pending, so a slow
+        env does not hold up the rest. env_ids must cover whole worker groups, which are stepped together.
+        """
+        self._assert_is_running()
+        if self._state != AsyncState.DEFAULT:
+            raise AlreadyPendingCallError(
+                f"Calling `step_async_envs` while waiting for a pending call to `{self._state.value}` to complete.",
+                self._state.value,
+            )
+        env_actions = dict(zip((int(env_id) for env_id in env_ids), iterate(self.action_space, actions)))
+        workers = sorted(set(self.env_workers[list(env_actions)].tolist()))
+        for worker in workers:
+            env_slice = self.env_slices[worker]
+            if worker in self.pending_workers:
+                raise AlreadyPendingCallError(
+                    f"Calling `step_async_envs` for envs {env_slice.start}-{env_slice.stop - 1} before receiving their last step",
+                    "step_async_envs",
+                )
+            if not all(env_id in env_actions for env_id in range(env_slice.start, env_slice.stop)):
+                raise ValueError(
+                    f"env_ids must hold all envs {env_slice.start}-{env_slice.stop - 1} stepped by the same worker"
+                )
+        for worker in workers:
+            env_slice = self.env_slices[worker]
+            self.parent_pipes[worker].send(("step", [env_actions[env_id] for env_id in range(env_slice.start, env_slice.stop)]))
+            self.pending_workers.add(worker)
+
+    def step_wait_any(self, min_envs: int = 1, timeout=None, max_wait=None):
+        """
+        Waits until at least min_envs of the envs sent by step_async_envs are done, or for at most max_wait seconds
+        after the first one is done, and returns the results of all envs done by then, `(env_ids, observations,
+        rewards, terminations, truncations, infos)`. Observations, rewards, terminations and truncations are batched
+        in env_ids order, infos are indexed by env id like the infos of step with the `_<key>` masks marking the
+        returned envs. get_valid_actions(player_id, env_ids) gives the valid actions of the returned envs.
+        """
+        self._assert_is_running()
+        if not self.pending_workers:
+            raise NoAsyncCallError(
+                "Calling `step_wait_any` without any prior call to `step_async_envs`.", "step_async_envs"
+            )
+        min_envs = min(min_envs, int(np.isin(self.env_workers, list(self.pending_workers)).sum()))
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        pipe_workers = {self.parent_pipes[worker]: worker for worker in self.pending_workers}
+        ready, ready_envs, wait_deadline = [], 0, None
+        while ready_envs < min_envs:
+            deadlines = [d for d in (deadline, wait_deadline) if d is not None]
+            remaining = max(min(deadlines) - time.perf_counter(), 0) if deadlines else None
+            pipes = mp.connection.wait([pipe for pipe, worker in pipe_workers.items() if worker not in ready], remaining)
+            if not pipes:
+                if wait_deadline is not None and time.perf_counter() >= wait_deadline:
+                    break
+                raise mp.TimeoutError(f"The call to `step_wait_any` has timed out after {timeout} second(s).")
+            if wait_deadline is None and max_wait is not None:
+                wait_deadline = time.perf_counter() + max_wait
+            for pipe in pipes:
+                worker = pipe_workers[pipe]
+                ready.append(worker)
+                ready_envs += self.env_slices[worker].stop - self.env_slices[worker].start
+        ready.sort()
+
+        results, successes = zip(*[self.parent_pipes[worker].recv() for worker in ready])
+        self.pending_workers.difference_update(ready)
+        self._raise_if_errors(successes)
+        results = [result for worker_results in results for result in worker_results]
+        env_ids = np.concatenate([np.arange(self.env_slices[worker].start, self.env_slices[worker].stop) for worker in ready])
+
+        infos = {}
+        if self.shared_arrays is not None:
+            arrays = self.shared_arrays.arrays
+            self.cached_valid_actions = arrays["valid_actions"]
+            for env_id, info in zip(env_ids, results):
+                infos = self._add_info(infos, info, env_id)
+            # indexing with env_ids copies the rows, which the workers only write again when these envs are stepped
+            return (
+                env_ids,
+                tree.map_structure(lambda x: x[env_ids], self.observations),
+                arrays["reward"][env_ids],
+                arrays["termination"][env_ids],
+                arrays["truncation"][env_ids],
+                infos,
+            )
+
+        if self.cached_valid_actions is None:
+            self.cached_valid_actions = [[None] * self.num_envs for _ in range(2)]
+        observations_list, rewards, terminateds, truncateds = [], [], [], []
+        for env_id, ((observation, reward, terminated, truncated, info), valid_actions) in zip(env_ids, results):
+            for player_id in range(2):
+                self.cached_valid_actions[player_id][env_id] = valid_actions[player_id]
+            observations_list.append(observation)
+            rewards.append(reward)
+            terminateds.append(terminated)
+            truncateds.append(truncated)
+            infos = self._add_info(infos, info, env_id)
+        observations = concatenate(
+            self.single_observation_space,
+            observations_list,
+            create_empty_array(self.single_observation_space, n=len(env_ids), fn=np.zeros),
+        )
+        return (
+            env_ids,
+            observations,
+            np.array(rewards),
+            np.array(terminateds, dtype=np.bool_),
+            np.array(truncateds, dtype=np.bool_),
+            infos,
+        )
+
+    def get_valid_actions(self, player_id, env_ids=None):
+        """
+        valid actions of the player batched over all envs, or over env_ids in that order
+        """
+        self._assert_is_running()
+        if self.shared_arrays is not None and self.cached_valid_actions is not None:
+            if env_ids is None:
+                # the workers write the next step's valid actions into the same arrays
+                valid_actions = self.cached_valid_actions[player_id]
+                return tree.map_structure(np.copy, valid_actions) if self.copy else valid_actions
+            return tree.map_structure(lambda x: x[env_ids], self.cached_valid_actions[player_id])
+        if self.cached_valid_actions is not None:
+            valid_actions = self.cached_valid_actions[player_id]
+        else:
+            self._assert_no_pending_envs("get_valid_actions")
+            for pipe in self.parent_pipes:
+                pipe.send(("get_valid_actions", player_id))
+            valid_actions = [va for pipe in self.parent_pipes for va in pipe.recv()]
+        if env_ids is not None:
+            return concatenate(
+                self.single_vas_space,
+                [valid_actions[env_id] for env_id in env_ids],
+                create_empty_array(self.single_vas_space, n=len(env_ids), fn=np.zeros),
+            )
         # valid_actions = [env.get_valid_actions(player_id) for env in self.envs]
         self.vas = concatenate(
             self.single_vas_space, valid_actions, self.vas
@@ -629,6 +1100,7 @@ class LuxSyncVectorEnv(gym.vector.AsyncVectorEnv):
     
     def eval(self, eval_policy, enemy_policy=None):
         self._assert_is_running()
+        self._assert_no_pending_envs("eval")
 
         if enemy_policy is None:
             enemy_policy = eval_policy
@@ -638,17 +1110,32 @@ class LuxSyncVectorEnv(gym.vector.AsyncVectorEnv):
 
         for pipe in self.parent_pipes:
             pipe.send(("eval", (eval_policy, enemy_policy)))
-        results = [pipe.recv() for pipe in self.parent_pipes]
+        results = [result for pipe in self.parent_pipes for result in pipe.recv()]
+        # eval plays its own games in the workers
+        self.cached_valid_actions = None
         results = self.process_eval_results(results)
 
         # return deepcopy(results)
         return results
 
     def set_seed(self, seed: int):
-        for i, pipe in enumerate(self.parent_pipes):
-            pipe.send(("seed", seed + i))
+        self._assert_no_pending_envs("set_seed")
+        for pipe, env_slice in zip(self.parent_pipes, self.env_slices):
+            pipe.send(("seed", [seed + i for i in range(env_slice.start, env_slice.stop)]))
         for pipe in self.parent_pipes:
             pipe.recv()
+
+    def close_extras(self, timeout=None, terminate=False):
+        if not terminate:
+            # the workers answer close after the steps they were sent
+            for worker in getattr(self, "pending_workers", ()):
+                self.parent_pipes[worker].recv()
+            self.pending_workers = set()
+        super().close_extras(timeout=timeout, terminate=terminate)
+        if getattr(self, "shared_arrays", None) is not None:
+            self.observations = self.cached_valid_actions = None
+            self.shared_arrays.close(unlink=True)
+            self.shared_arrays = None
     
     def process_eval_results(self, results):
         if self.num_envs==1:
@@ -14,6 +14,7 @@ from kit.kit import GameState, json_obs_to_game_state
 from kit.utils import my_turn_to_place_factory
 from luxai_s2 import actions as lux_actions
 from luxai_s2.actions import move_deltas
+from parsers.feature_parser import FeatureParser
 import tree
 import dataclasses
 
@@ -27,6 +28,13 @@ factory_adjacent_delta_xy = np.array([
 factory_adjacent_delta_xy = np.concatenate([factory_adjacent_delta_xy, -factory_adjacent_delta_xy])
 factory_adjacent_delta_xy = np.concatenate([factory_adjacent_delta_xy, factory_adjacent_delta_xy[:, ::-1]])
 
+# offsets of the 3x3 tiles a factory covers
+factory_footprint_delta_xy = np.stack(np.meshgrid([-1, 0, 1], [-1, 0, 1], indexing='ij'), axis=-1).reshape(-1, 2)
+
+# valid actions of the sparse format that are indexed by entity, and the positions of the entities
+SPARSE_ENTITY_KEYS = ("factory_act", "move", "transfer", "pickup", "dig", "self_destruct", "recharge", "do_nothing")
+SPARSE_POSITION_KEYS = ("factory_pos", "unit_pos")
+
 
 def ind2vec(ind, shape):
     element_size = np.cumprod(shape[::-1])[::-1]
@@ -257,7 +265,10 @@ class ActionParser():
         return self.get_valid_actions(game_state, player_id)
 
     @staticmethod
-    def get_valid_actions(game_state: GameState, player_id: int):
+    def get_valid_actions_loop(game_state: GameState, player_id: int):
+        """
+        per unit reference implementation of get_valid_actions
+        """
         player = 'player_0' if player_id == 0 else 'player_1'
         enemy = 'player_1' if player_id == 0 else 'player_0'
         board = game_state.board
@@ -509,6 +520,216 @@ class ActionParser():
             if unit.power < unit.unit_cfg.BATTERY_CAPACITY:
                 valid_actions["unit_act"]["recharge"]['repeat'][0, x, y] = True
 
+        return ActionParser._flatten_valid_actions(game_state, player, valid_actions)
+
+    _act_dims_cache = None
+
+    @staticmethod
+    def _act_dims():
+        """
+        EnvParam.act_dims_mapping as a nested dict, converted once
+        """
+        if ActionParser._act_dims_cache is None:
+            ActionParser._act_dims_cache = dataclasses.asdict(EnvParam.act_dims_mapping)
+        return ActionParser._act_dims_cache
+
+    @staticmethod
+    def _empty_valid_actions(dims, shape: tuple):
+        """
+        False masks shaped (dim,) + shape for every action component of dims
+        """
+        if isinstance(dims, dict):
+            return {key: ActionParser._empty_valid_actions(dim, shape) for key, dim in dims.items()}
+        return np.zeros((dims,) + shape, dtype=np.bool_)
+
+    @staticmethod
+    def _scatter_valid_actions(dst, src, index):
+        """
+        writes the per entity masks src ([dim, n] leaves) to dst[:, index] (e.g. the tiles or slots of the entities)
+        """
+        if isinstance(dst, dict):
+            for key, value in dst.items():
+                ActionParser._scatter_valid_actions(value, src[key], index)
+        else:
+            dst[(slice(None),) + index] = src
+
+    @staticmethod
+    def _factory_index_map(factory_pos: np.ndarray, map_size: int) -> np.ndarray:
+        """
+        index of the factory covering each tile, -1 for tiles without a factory
+        """
+        index_map = np.full((map_size, map_size), -1, dtype=np.int64)
+        tiles = factory_pos[:, None, :] + factory_footprint_delta_xy
+        index_map[tiles[..., 0], tiles[..., 1]] = np.arange(len(factory_pos))[:, None]
+        return index_map
+
+    @staticmethod
+    def _entity_valid_actions(game_state: GameState, player_id: int):
+        """
+        valid action components of all factories and units of a player, computed for all of them at once from arrays
+        of their positions, power and cargo. Returns the factories, their positions and [4, n_factories] masks, and the
+        units, their positions and masks shaped [dim, n_units] in the structure of act_dims_mapping["unit_act"]
+        """
+        player = 'player_0' if player_id == 0 else 'player_1'
+        enemy = 'player_1' if player_id == 0 else 'player_0'
+        board = game_state.board
+        env_cfg = game_state.env_cfg
+        map_size = EnvParam.map_size
+        light_cfg, heavy_cfg = env_cfg.ROBOTS['LIGHT'], env_cfg.ROBOTS['HEAVY']
+
+        factories = list(game_state.factories[player].values())
+        factory_pos = np.array([f.pos for f in factories], dtype=np.int64).reshape(-1, 2)
+        factory_index_map = ActionParser._factory_index_map(factory_pos, map_size)
+        factory_power = np.array([f.power for f in factories], dtype=np.int64)
+        factory_center_map = np.zeros((map_size, map_size), dtype=bool)
+        factory_center_map[factory_pos[:, 0], factory_pos[:, 1]] = True
+        enemy_factory_pos = np.array([f.pos for f in game_state.factories[enemy].values()], dtype=np.int64).reshape(-1, 2)
+        enemy_factory_map = ActionParser._factory_index_map(enemy_factory_pos, map_size) != -1
+
+        units = list(game_state.units[player].values())
+        n = len(units)
+        pos = np.array([u.pos for u in units], dtype=np.int64).reshape(n, 2)
+        x, y = pos[:, 0], pos[:, 1]
+        heavy = np.array([u.unit_type == "HEAVY" for u in units], dtype=bool)
+        power = np.array([u.power for u in units], dtype=np.int64)
+        cargo = np.array([[u.cargo.ice, u.cargo.ore, u.cargo.water, u.cargo.metal] for u in units],
+                         dtype=np.int64).reshape(n, 4)
+        queued_dig = np.array([len(u.action_queue) > 0 and u.action_queue[0][0] == UnitActType.DIG for u in units],
+                              dtype=bool)
+
+        def unit_cfg(name):
+            return np.where(heavy, getattr(heavy_cfg, name), getattr(light_cfg, name))
+
+        unit_va = ActionParser._empty_valid_actions(ActionParser._act_dims()["unit_act"], (n,))
+
+        unit_map = np.zeros((map_size, map_size), dtype=bool)
+        unit_map[x, y] = True
+        enemy_pos = np.array([u.pos for u in game_state.units[enemy].values()], dtype=np.int64).reshape(-1, 2)
+        enemy_unit_map = np.zeros((map_size, map_size), dtype=bool)
+        enemy_unit_map[enemy_pos[:, 0], enemy_pos[:, 1]] = True
+
+        # factory actions
+        factory_va = np.zeros((ActDims.factory_act, len(factories)), dtype=np.bool_)
+        fx, fy = factory_pos[:, 0], factory_pos[:, 1]
+        metal = np.array([f.cargo.metal for f in factories], dtype=np.int64)
+        unit_on_factory = unit_map[fx, fy]
+        factory_va[FactoryActType.BUILD_HEAVY] = (metal >= heavy_cfg.METAL_COST) \
+            & (factory_power >= heavy_cfg.POWER_COST) & ~unit_on_factory
+        factory_va[FactoryActType.BUILD_LIGHT] = (metal >= light_cfg.METAL_COST) \
+            & (factory_power >= light_cfg.POWER_COST) & ~unit_on_factory
+        # watering is never valid (get_valid_actions_loop only ever sets it to False)
+        factory_va[FactoryActType.DO_NOTHING] = ~factory_va[FactoryActType.BUILD_HEAVY]
+
+        # power masking, units without the power to update their action queue can only do nothing
+        action_queue_cost = unit_cfg("ACTION_QUEUE_POWER_COST")
+        battery_capacity = unit_cfg("BATTERY_CAPACITY")
+        active = power >= action_queue_cost
+        not_full = power < battery_capacity
+        act_type = np.repeat(active[None], ActDims.robot_act, axis=0)
+        act_type[UnitActType.SELF_DESTRUCT] = False
+        act_type[UnitActType.DO_NOTHING] = ~active
+        act_type[UnitActType.RECHARGE] &= not_full
+        act_type[UnitActType.PICKUP] &= not_full
+        unit_va["act_type"][:] = act_type
+
+        # move, to in-map tiles that are not under enemy factories, not taken by own units and not the center of an
+        # own factory. Lights can't step on enemy units.
+        target = pos[:, None, :] + move_deltas[None, 1:]
+        inside = ((target >= 0) & (target < map_size)).all(axis=-1)
+        # wrapped into the map for the lookups, tiles outside are masked by `inside`
+        tx, ty = target[..., 0] % map_size, target[..., 1] % map_size
+        move_cost = np.floor(unit_cfg("MOVE_COST")[:, None] + unit_cfg("RUBBLE_MOVEMENT_COST")[:, None] * board.rubble[tx, ty])
+        can_move = active[:, None] & inside & ~enemy_factory_map[tx, ty] & ~unit_map[tx, ty] \
+            & ~factory_center_map[tx, ty] & (heavy[:, None] | ~enemy_unit_map[tx, ty]) \
+            & ((power - action_queue_cost)[:, None] >= move_cost)
+        # a target tile goes to the first unit moving there, in the order of heavy first, then most ice, then most
+        # power (stable, so ties keep the order of game_state.units)
+        rank = np.empty(n, dtype=np.int64)
+        rank[np.lexsort((-power, -cargo[:, 0], -heavy.astype(np.int64)))] = np.arange(n)
+        target_rank = np.full((map_size, map_size), n, dtype=np.int64)
+        unit_rank = np.repeat(rank[:, None], can_move.shape[1], axis=1)
+        np.minimum.at(target_rank, (tx[can_move], ty[can_move]), unit_rank[can_move])
+        can_move &= target_rank[tx, ty] == unit_rank
+        unit_va["move"]["direction"][1:] = can_move.T
+        unit_va["move"]["repeat"][1] = active
+
+        # transfer ice or ore to an adjacent own factory
+        unit_va["transfer"]["repeat"][0] = active
+        unit_va["transfer"]["resource"][ResourceType.ICE] = active & (cargo[:, 0] > 0)
+        unit_va["transfer"]["resource"][ResourceType.ORE] = active & (cargo[:, 1] > 0)
+        unit_va["transfer"]["direction"][1:] = (active[:, None] & inside & (factory_index_map[tx, ty] != -1)).T
+
+        # pick up power from the own factory under the unit
+        factory_under_unit = factory_index_map[x, y]
+        on_factory = factory_under_unit != -1
+        # (index -1 of the padded powers is the 0 of units not on a factory)
+        pickup_power = act_type[UnitActType.PICKUP] & (np.append(factory_power, 0)[factory_under_unit] > 0)
+        unit_va["pickup"]["resource"][ResourceType.POWER] = pickup_power
+        unit_va["pickup"]["repeat"][0] = pickup_power
+
+        # dig, off own factories and with room for what is dug. The action queue is free to update if it already digs.
+        dig_action_queue_cost = np.where(queued_dig, 0, action_queue_cost)
+        cargo_full = cargo.sum(axis=1) + unit_cfg("DIG_RESOURCE_GAIN") >= unit_cfg("CARGO_SPACE")
+        can_dig = active & ~on_factory & (power - dig_action_queue_cost >= unit_cfg("DIG_COST")) & ~cargo_full
+        on_resource = (board.ice[x, y] > 0) | (board.ore[x, y] > 0)
+        unit_va["dig"]["repeat"][1] = can_dig & on_resource
+        unit_va["dig"]["repeat"][0] = can_dig & ~on_resource & (board.rubble[x, y] > 0)
+
+        # recharge, if not full
+        unit_va["recharge"]["repeat"][0] = active & not_full
+
+        return factories, factory_pos, factory_va, units, pos, unit_va
+
+    @staticmethod
+    def get_valid_actions(game_state: GameState, player_id: int):
+        """
+        valid actions as masks over the map, the same as get_valid_actions_loop gives
+        """
+        player = 'player_0' if player_id == 0 else 'player_1'
+        map_size = EnvParam.map_size
+        _, factory_pos, factory_va, _, unit_pos, unit_va = ActionParser._entity_valid_actions(game_state, player_id)
+        valid_actions = ActionParser._empty_valid_actions(ActionParser._act_dims(), (map_size, map_size))
+        valid_actions["factory_act"][:, factory_pos[:, 0], factory_pos[:, 1]] = factory_va
+        ActionParser._scatter_valid_actions(valid_actions["unit_act"], unit_va, (unit_pos[:, 0], unit_pos[:, 1]))
+        return ActionParser._flatten_valid_actions(game_state, player, valid_actions)
+
+    @staticmethod
+    def get_sparse_valid_actions(game_state: GameState, player_id: int, max_entity_number: int):
+        """
+        valid actions as [max_entity_number, ...] masks indexed by the entity ids of FeatureParser's location feature,
+        with the [max_entity_number, 2] positions of the entities in factory_pos and unit_pos (-1 for empty slots).
+        Slot i of a mask holds the mask of the tile of entity i in get_valid_actions, bid and factory_spawn are the same.
+        """
+        player = 'player_0' if player_id == 0 else 'player_1'
+        factories, factory_pos, factory_va, units, unit_pos, unit_va = \
+            ActionParser._entity_valid_actions(game_state, player_id)
+        factory_ids = np.array([FeatureParser.get_factory_id(f) for f in factories], dtype=np.int64)
+        unit_ids = np.array([FeatureParser.get_unit_id(u, None, None) for u in units], dtype=np.int64)
+        if max(factory_ids.max(initial=-1), unit_ids.max(initial=-1)) >= max_entity_number:
+            raise ValueError(f"entity ids of {player} do not fit into max_entity_number={max_entity_number}")
+
+        valid_actions = ActionParser._empty_valid_actions(ActionParser._act_dims(), (max_entity_number,))
+        valid_actions["factory_act"][:, factory_ids] = factory_va
+        ActionParser._scatter_valid_actions(valid_actions["unit_act"], unit_va, (unit_ids,))
+        valid_actions = ActionParser._flatten_valid_actions(game_state, player, valid_actions)
+        for key in SPARSE_ENTITY_KEYS:
+            # [..., entity] -> [entity, ...]
+            valid_actions[key] = np.ascontiguousarray(np.moveaxis(valid_actions[key], -1, 0))
+
+        for key, ids, pos in [("factory_pos", factory_ids, factory_pos), ("unit_pos", unit_ids, unit_pos)]:
+            valid_actions[key] = np.full((max_entity_number, 2), -1, dtype=np.int16)
+            valid_actions[key][ids] = pos
+        return valid_actions
+
+    @staticmethod
+    def _flatten_valid_actions(game_state: GameState, player: str, valid_actions):
+        """
+        combines the per component masks of valid_actions (act type, direction, resource, repeat) into the masks of
+        the flattened action space
+        """
+        board = game_state.board
+        factory_va = valid_actions["factory_act"]
+
         # calculate va for the flattened action space
         move_va = valid_actions["unit_act"]["move"]
         move_va = valid_actions["unit_act"]["act_type"][UnitActType.MOVE][None, None] \
@@ -540,7 +761,7 @@ class ActionParser():
 
         do_nothing_va = valid_actions["unit_act"]["act_type"][UnitActType.DO_NOTHING]  # 1
 
-        valid_actions = {}
+        flat_va = {}
         if not EnvParam.rule_based_early_step:
             if game_state.env_steps == 0:
                 bid_va = np.ones(ActDims.bid, dtype=np.bool8)
@@ -554,12 +775,12 @@ class ActionParser():
             else:
                 factory_spawn = np.zeros_like(board.valid_spawns_mask, dtype=np.bool8)
 
-            valid_actions = {
+            flat_va = {
                 "bid": bid_va,
                 "factory_spawn": factory_spawn,
             }
 
-        valid_actions.update({
+        flat_va.update({
             "factory_act": factory_va,
             "move": move_va,
             "transfer": transfer_va,
@@ -569,7 +790,7 @@ class ActionParser():
             "recharge": recharge_va,
             "do_nothing": do_nothing_va,
         })
-        return valid_actions
+        return flat_va
 
     def action_stats(self, player, actions, game_state: GameState):
         action_stats = {
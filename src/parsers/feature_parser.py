@@ -1,14 +1,21 @@
 import numpy as np
-import tree
 
 from impl_config import EnvParam
 import kit.kit
 from typing import NamedTuple
 from luxai_s2.config import EnvConfig
-from functools import reduce
+from luxai_s2.state import STATS_KEYS
 
 import sys
 
+# names of the stats counters in the env_stats logs, e.g. "generation_ice_heavy"
+ENV_STATS_LOG_NAMES = ["_".join(path).lower() for path in STATS_KEYS]
+
+
+# offsets of the 4 tiles next to a position
+ADJACENT_DX = np.array([0, 0, 1, -1])
+ADJACENT_DY = np.array([1, -1, 0, 0])
+
 
 class LuxFeature(NamedTuple):
     global_feature: np.ndarray
@@ -26,6 +33,8 @@ class FeatureParser():
             "player_0": None,
             "player_1": None
         }
+        # map feature planes of the current game that don't change, see _static_planes
+        self.static_planes = None
 
         self.global_feature_names = [
             'env_step',
@@ -202,19 +211,31 @@ class FeatureParser():
             ]
         }
 
-    def parse(self, obs, reset, env_cfg):
+    def parse(self, obs, reset, env_cfg, game_states=None):
+        """
+        `game_states` optionally gives the kit game state of every player's obs when the caller already converted them
+        """
         all_feature = {}
         global_info = {}
+        if reset:
+            self.static_planes = None
         for player, player_obs in obs.items():
-            env_step = player_obs['real_env_steps'] + player_obs['board']['factories_per_team'] * 2 + 1
-            game_state = kit.kit.obs_to_game_state(env_step, env_cfg, player_obs)
+            if game_states is not None:
+                game_state = game_states[player]
+            else:
+                env_step = player_obs['real_env_steps'] + player_obs['board']['factories_per_team'] * 2 + 1
+                game_state = kit.kit.obs_to_game_state(env_step, env_cfg, player_obs)
             
             if reset:
                 self.last_game_states[player] = None
             
             last_game_state = self.last_game_states[player]
 
-            parsed_feature = self._get_feature(obs=game_state, player=player)
+            # the terrain planes don't change during a game, they are made once per reset
+            if self.static_planes is None:
+                self.static_planes = self._static_planes(game_state)
+
+            parsed_feature = self._get_feature(obs=game_state, player=player, static_planes=self.static_planes)
             all_feature[player] = parsed_feature
 
             global_info[player] = self._get_info(player, game_state, last_game_state)
@@ -345,15 +366,16 @@ class FeatureParser():
                     else:
                         global_info['heavy_destroyed'] += 1
 
-        for factory in factories:
+        lichen_tiles, lichen_amounts = self.lichen_per_strain(obs.board, [factory.strain_id for factory in factories])
+        for factory, lichen_tile_count, lichen_amount in zip(factories, lichen_tiles, lichen_amounts):
             factory_info[factory.unit_id] = {
                 'power': factory.power,
                 'cargo_ice': factory.cargo.ice,
                 'cargo_ore': factory.cargo.ore,
                 'cargo_water': factory.cargo.water,
                 'cargo_metal': factory.cargo.metal,
-                'water_cost': np.sum(obs.board.lichen_strains == factory.strain_id) // obs.env_cfg.LICHEN_WATERING_COST_FACTOR + 1,
-                'lichen_count': obs.board.lichen[obs.board.lichen_strains == factory.strain_id].sum(),
+                'water_cost': lichen_tile_count // obs.env_cfg.LICHEN_WATERING_COST_FACTOR + 1,
+                'lichen_count': lichen_amount,
                 'x': factory.pos[0],
                 'y': factory.pos[1],
                 'group_id': self.get_factory_id(factory)
@@ -410,6 +432,7 @@ class FeatureParser():
                 if factory_name in prev_obs.factories[player]:
                     prev_factory = prev_obs.factories[player][factory_name]
                     lichen_now = obs.board.lichen[obs.board.lichen_strains == factory.strain_id].sum()
+                    # NOTE: with copy_obs=False observations the previous board is a view of the current one
                     lichen_prev = prev_obs.board.lichen[prev_obs.board.lichen_strains == factory.strain_id].sum()
                     lichen_grown = max(lichen_now - lichen_prev, 0)
                     global_info['lichen_grown'] += lichen_grown
@@ -421,7 +444,147 @@ class FeatureParser():
 
         return global_info
 
-    def _get_feature(self, obs: kit.kit.GameState, player: str, output_dict=True):
+    def _static_planes(self, obs: kit.kit.GameState):
+        """
+        map feature array with the planes that stay the same for a whole game (ice and ore) filled in, the others zero
+        """
+        map_feature = np.zeros((len(self.map_featrue_names),) + obs.board.ice.shape, dtype=np.float64)
+        map_feature[self.map_featrue_names.index('ice')] = obs.board.ice
+        map_feature[self.map_featrue_names.index('ore')] = obs.board.ore
+        return map_feature
+
+    @staticmethod
+    def lichen_tiles_per_strain(board, strain_ids):
+        """
+        number of lichen tiles of every strain in strain_ids, counted in one pass over the board
+        """
+        # lichen_strains is -1 where there is no lichen
+        tiles = np.bincount(board.lichen_strains.ravel() + 1, minlength=max(strain_ids, default=-1) + 2)
+        return tiles[np.asarray(strain_ids, dtype=np.int64) + 1]
+
+    @staticmethod
+    def lichen_per_strain(board, strain_ids):
+        """
+        number of lichen tiles and amount of lichen of every strain in strain_ids
+        """
+        strains = board.lichen_strains.ravel() + 1
+        lichen = np.bincount(strains, weights=board.lichen.ravel(), minlength=max(strain_ids, default=-1) + 2)
+        lichen = lichen.astype(board.lichen.dtype)[np.asarray(strain_ids, dtype=np.int64) + 1]
+        return FeatureParser.lichen_tiles_per_strain(board, strain_ids), lichen
+
+    def _get_feature(self, obs: kit.kit.GameState, player: str, output_dict=True, static_planes=None):
+        """
+        the features of `player`, with the attributes of all units and factories gathered into arrays and scattered
+        into the planes at once. Gives the same arrays as _get_feature_loop. `static_planes` is the _static_planes
+        array of the game, which is made from `obs` if not given
+        """
+        env_cfg: EnvConfig = obs.env_cfg
+        board = obs.board
+        shape = board.ice.shape
+
+        other_player = "player_0" if player == "player_1" else "player_1"
+
+        # normalize
+        light_cfg = env_cfg.ROBOTS['LIGHT']
+        heavy_cfg = env_cfg.ROBOTS['HEAVY']
+
+        # Location
+
+        location_feature = np.full((len(self.location_feature_names),) + shape, -1, dtype=np.int32)
+        location_planes = dict(zip(self.location_feature_names, location_feature))
+
+        # Global
+
+        global_feature = {name: 0 for name in self.global_feature_names}
+        # normalize between -1 and 1
+        global_feature['env_step'] = (obs.real_env_steps - 0) / (env_cfg.max_episode_length - 0) * 2 - 1
+        hour = obs.real_env_steps % env_cfg.CYCLE_LENGTH
+        global_feature['daytime_or_night'] = hour < 30
+
+        # Map
+
+        # float64 like the planes of the loop version stacked together
+        if static_planes is None:
+            static_planes = self._static_planes(obs)
+        map_feature = static_planes.copy()
+        map_planes = dict(zip(self.map_featrue_names, map_feature))
+        # (rubble - 0) / (MAX_RUBBLE - 0) * 2 - 1 without the temporaries
+        np.divide(board.rubble, env_cfg.MAX_RUBBLE, out=map_planes['rubble'])
+        map_planes['rubble'] *= 2
+        map_planes['rubble'] -= 1
+
+        # Factory
+
+        factory_feature = np.zeros((len(self.factory_feature_names),) + shape, dtype=np.float32)
+        factory_planes = dict(zip(self.factory_feature_names, factory_feature))
+        factories = [(owner, factory) for owner, owner_factories in obs.factories.items() for factory in owner_factories.values()]
+        if factories:
+            x, y = np.array([factory.pos for _, factory in factories]).reshape(-1, 2).T
+            location_planes['factory'][x, y] = [self.get_factory_id(factory) for _, factory in factories]
+
+            power, ice, water, ore, metal = np.array([
+                (factory.power, factory.cargo.ice, factory.cargo.water, factory.cargo.ore, factory.cargo.metal)
+                for _, factory in factories
+            ]).T
+            factory_planes['factory_power'][x, y] = (power - 0) / (heavy_cfg.BATTERY_CAPACITY - 0) * 2 - 1
+            factory_planes['factory_ice'][x, y] = (ice - 0) / (heavy_cfg.CARGO_SPACE - 0) * 2 - 1
+            factory_planes['factory_water'][x, y] = (water - 0) / (heavy_cfg.CARGO_SPACE - 0) * 2 - 1
+            factory_planes['factory_ore'][x, y] = (ore - 0) / (heavy_cfg.CARGO_SPACE - 0) * 2 - 1
+            factory_planes['factory_metal'][x, y] = (metal - 0) / (heavy_cfg.CARGO_SPACE - 0) * 2 - 1
+
+            lichen_tiles = self.lichen_tiles_per_strain(board, [factory.strain_id for _, factory in factories])
+            water_cost = lichen_tiles // env_cfg.LICHEN_WATERING_COST_FACTOR + 1
+            factory_planes['factory_water_cost'][x, y] = (water_cost - 0) / (heavy_cfg.CARGO_SPACE - 0) * 2 - 1
+
+            # tiles next to own factories
+            own = np.array([owner == player for owner, _ in factories])
+            nx, ny = (x[own, None] + ADJACENT_DX).ravel(), (y[own, None] + ADJACENT_DY).ravel()
+            inside = (0 <= nx) & (nx < shape[0]) & (0 <= ny) & (ny < shape[1])
+            map_planes['factory'][nx[inside], ny[inside]] = 1.0
+
+        # Unit
+
+        unit_feature = np.zeros((len(self.unit_feature_names),) + shape, dtype=np.float32)
+        unit_planes = dict(zip(self.unit_feature_names, unit_feature))
+        units = list(obs.units[player].values())
+        if units:
+            x, y = np.array([unit.pos for unit in units]).reshape(-1, 2).T
+            own_factories = list(obs.factories[player].values())
+            location_planes['unit'][x, y] = [self.get_unit_id(unit, own_factories, units) for unit in units]
+
+            light = np.array([unit.unit_type == 'LIGHT' for unit in units])
+            power, cargo_ice, cargo_ore = np.array([(unit.power, unit.cargo.ice, unit.cargo.ore) for unit in units]).T
+            cargo_space = np.where(light, light_cfg.CARGO_SPACE, heavy_cfg.CARGO_SPACE)
+            battery_capacity = np.where(light, light_cfg.BATTERY_CAPACITY, heavy_cfg.BATTERY_CAPACITY)
+            unit_planes['heavy'][x, y] = [unit.unit_type == 'HEAVY' for unit in units]
+            unit_planes['power'][x, y] = (power - 0) / (battery_capacity - 0) * 2 - 1
+            unit_planes['cargo_ice'][x, y] = (cargo_ice - 0) / (cargo_space - 0) * 2 - 1
+            unit_planes['cargo_ore'][x, y] = (cargo_ore - 0) / (cargo_space - 0) * 2 - 1
+
+            map_planes['unit'][x, y] = 1.0
+
+        enemy_units = list(obs.units[other_player].values())
+        if enemy_units:
+            x, y = np.array([unit.pos for unit in enemy_units]).reshape(-1, 2).T
+            map_planes['enemy'][x, y] = 1.0
+        enemy_factories = list(obs.factories[other_player].values())
+        if enemy_factories:
+            x, y = np.array([factory.pos for factory in enemy_factories]).reshape(-1, 2).T
+            map_planes['enemy'][x[:, None] + ADJACENT_DX, y[:, None] + ADJACENT_DY] = 1.0
+
+        # Assemble return
+
+        global_feature = np.array(list(global_feature.values()))
+
+        if output_dict:
+            return {'global_feature': global_feature, 'map_feature': map_feature, 'factory_feature': factory_feature, 'unit_feature': unit_feature, 'location_feature': location_feature}
+
+        return LuxFeature(global_feature, map_feature, factory_feature, unit_feature, location_feature)
+
+    def _get_feature_loop(self, obs: kit.kit.GameState, player: str, output_dict=True):
+        """
+        per entity version of _get_feature, the reference its output is tested against
+        """
         env_cfg: EnvConfig = obs.env_cfg
 
         other_player = "player_0" if player == "player_1" else "player_1"
@@ -672,13 +835,5 @@ class FeatureParser():
 
     @staticmethod
     def log_env_stats(env_stats):
-        for team in [0, 1]:
-            player = f"player_{team}"
-            stat = tree.flatten_with_path(env_stats[player])
-            stat = list(map(
-                lambda item: {"_".join(item[0]).lower(): item[1]},
-                stat,
-            ))
-            stat = reduce(lambda cat1, cat2: dict(cat1, **cat2), stat)
-            env_stats_logs = stat
-        return env_stats_logs
\ No newline at end of file
+        # logs the counters of the last team only, the names are the flattened stats key paths
+        return dict(zip(ENV_STATS_LOG_NAMES, env_stats["player_1"].counters.tolist()))
\ No newline at end of file
@@ -12,7 +12,8 @@ BIG_NEG = -1e10
 def sample_from_categorical(logits, va, action=None, is_deterministic=False):
     n = logits.shape[0]
     if n > 0:
-        logits = torch.where(va, logits, torch.tensor(BIG_NEG).type_as(logits))
+        # masking and the log prob and entropy math in float32, also for bf16 logits under autocast
+        logits = torch.where(va, logits.float(), torch.tensor(BIG_NEG, dtype=torch.float32, device=logits.device))
         distribution = Categorical(logits=logits)
         if is_deterministic:
             # Choose action with highest probability deterministically
@@ -11,12 +11,24 @@ import hashlib
 
 used_names = set()
 
+# the smallest entity count the compiled heads pad to, see entity_bucket
+MIN_ENTITY_BUCKET = 32
 
-def create_embedding_trace(embedding_layer, global_feature, map_feature, factory_feature, unit_feature):
-    B, _, H, W = map_feature.shape
-    global_feature = global_feature[..., None, None].expand(-1, -1, H, W)
-    all_features = torch.cat([global_feature, factory_feature, unit_feature, map_feature], dim=1)
-    return torch.jit.trace(embedding_layer, all_features)
+# the unit action types with a head for each param, in the order the params are sampled
+UNIT_PARAM_TYPES = {
+    "direction": [UnitActType.MOVE, UnitActType.TRANSFER],
+    "resource": [UnitActType.TRANSFER, UnitActType.PICKUP],
+    "amount": [UnitActType.PICKUP, UnitActType.RECHARGE],
+    "repeat": [UnitActType.MOVE, UnitActType.DIG],
+}
+
+
+def entity_bucket(n: int) -> int:
+    """
+    the entity count the compiled factory and unit heads pad n entities to: the next power of two, at least
+    MIN_ENTITY_BUCKET. Every bucket is one compiled graph
+    """
+    return max(MIN_ENTITY_BUCKET, 1 << (n - 1).bit_length())
 
 
 def myHash(text: str) -> int:
@@ -235,10 +247,14 @@ class SimpleNet(nn.Module):
     def _gather_from_map(self, x, pos):
         return x[pos[0], ..., pos[1], pos[2]]
 
-    def __init__(self, max_entity_number: int, seed: int):
+    def __init__(self, max_entity_number: int, seed: int, bf16: bool = False):
         super(SimpleNet, self).__init__()
 
         self.max_entity_number = max_entity_number
+        # run the forward under bf16 autocast, the weights, values, log probs and entropies stay float32
+        self.bf16 = bf16
+        # torch.compile kwargs of the compiled forward, None runs it eagerly. See compile_forward
+        self.compile_kwargs = None
 
         # EMBEDDINGS
         """
@@ -319,18 +335,82 @@ class SimpleNet(nn.Module):
         })
 
 
+    def compile_forward(self, **compile_kwargs):
+        """
+        compiles the forward with torch.compile. The convolutions over the map (_trunk) are one graph with the batch
+        size as a dynamic dimension, the batch norm statistics in training mode rule out padding the batch. The factory
+        and unit heads run on entity counts padded to entity_bucket, without boolean masks, one static graph per bucket.
+        Gathering the entities and scattering their results stay eager. compile_kwargs go to torch.compile
+        """
+        self.compile_kwargs = compile_kwargs
+        # a graph per bucket, per training / eval mode and per forced / sampled actions
+        # named cache_size_limit before torch 2.2
+        limit = "recompile_limit" if hasattr(torch._dynamo.config, "recompile_limit") else "cache_size_limit"
+        setattr(torch._dynamo.config, limit, max(getattr(torch._dynamo.config, limit), 64))
+        return self
+
+
+    def _compiled(self, name: str):
+        compiled = self.__dict__.setdefault("_compiled_fns", {})
+        if name not in compiled:
+            compiled[name] = torch.compile(getattr(self, name), dynamic=None if name == "_trunk" else False, **self.compile_kwargs)
+        return compiled[name]
+
+
+    def __getstate__(self):
+        # the compiled functions are bound to this module, copies compile their own
+        state = self.__dict__.copy()
+        state.pop("_compiled_fns", None)
+        return state
+
+
     def forward(self, global_feature, map_feature, factory_feature, unit_feature, location_feature, va, action=None, is_deterministic=False):
+        with torch.autocast(device_type=map_feature.device.type, dtype=torch.bfloat16, enabled=self.bf16):
+            return self._forward(global_feature, map_feature, factory_feature, unit_feature, location_feature, va, action, is_deterministic)
+
+
+    def _forward(self, global_feature, map_feature, factory_feature, unit_feature, location_feature, va, action=None, is_deterministic=False):
         B, _, H, W = map_feature.shape
         max_group_count = self.max_entity_number
 
         # Embeddings
         global_feature = global_feature[..., None, None].expand(-1, -1, H, W)
         all_features = torch.cat([global_feature, factory_feature, unit_feature, map_feature], dim=1)
-        features_embedded_actor = self.embedding_actor(all_features)
+        trunk = self._trunk if self.compile_kwargs is None else self._compiled("_trunk")
+        features_embedded_actor, critic_maps = trunk(all_features)
+
+        # Locations, ids and valid actions of the entities
+        if 'unit_pos' in va:
+            factory_pos, factory_ids, factory_va, unit_pos, unit_ids, unit_va = self._entities_from_sparse_va(va)
+        else:
+            factory_pos, factory_ids, factory_va, unit_pos, unit_ids, unit_va = self._entities_from_va(va, location_feature)
+
+        unit_indices = unit_pos[0] * max_group_count + unit_ids
+        if len(unit_indices) > 0:
+            assert unit_indices.max(dim=-1)[0] < (B * max_group_count)
+            assert unit_indices.min(dim=-1)[0] >= 0
+        factory_indices = factory_pos[0] * max_group_count + factory_ids
+        if len(factory_indices) > 0:
+            assert factory_indices.max(dim=-1)[0] < (B * max_group_count)
+            assert factory_indices.min(dim=-1)[0] >= 0
+
+        # Critic
         if self.training:
-            features_embedded_value = self.embedding_value(all_features)
+            critic_value = self.critic(critic_maps, unit_pos, factory_pos, unit_indices, factory_indices, max_group_count)
+        else:
+            critic_value = None
 
-        # Valid actions
+        # Actor
+        logp, action, entropy = self.actor(features_embedded_actor, factory_va, unit_va, factory_pos, unit_pos, max_group_count, unit_indices, factory_indices, action, is_deterministic)
+
+        return logp, critic_value, action, entropy
+
+
+    def _entities_from_va(self, va, location_feature):
+        """
+        positions (batch, x, y), ids and valid actions of the factories and units with any valid action, from valid
+        actions over the map
+        """
         unit_act_type_va = torch.stack(
             [
                 va['move'].flatten(1, 2).any(1),
@@ -344,52 +424,87 @@ class SimpleNet(nn.Module):
             axis=1,
         )
 
-        # Locations
         factory_pos = torch.where(va['factory_act'].any(1))
         unit_pos = torch.where(unit_act_type_va.any(1))
 
         factory_ids = self._gather_from_map(location_feature[:, 0], factory_pos).int()
         unit_ids = (self._gather_from_map(location_feature[:, 1], unit_pos)).int()
 
-        unit_indices = unit_pos[0] * max_group_count + unit_ids
-        if len(unit_indices) > 0:
-            assert unit_indices.max(dim=-1)[0] < (B * max_group_count)
-            assert unit_indices.min(dim=-1)[0] >= 0
-        factory_indices = factory_pos[0] * max_group_count + factory_ids
-        if len(factory_indices) > 0:
-            assert factory_indices.max(dim=-1)[0] < (B * max_group_count)
-            assert factory_indices.min(dim=-1)[0] >= 0
+        factory_va = self._gather_from_map(va['factory_act'], factory_pos)
+        unit_va = {
+            'act_type': self._gather_from_map(unit_act_type_va, unit_pos),
+            'move': self._gather_from_map(va['move'], unit_pos),
+            'transfer': self._gather_from_map(va['transfer'], unit_pos),
+            'pickup': self._gather_from_map(va['pickup'], unit_pos),
+            'dig': self._gather_from_map(va['dig'], unit_pos),
+            'self_destruct': self._gather_from_map(va['self_destruct'], unit_pos),
+            'recharge': self._gather_from_map(va['recharge'], unit_pos),
+            'do_nothing': self._gather_from_map(va['do_nothing'], unit_pos),
+        }
+        return factory_pos, factory_ids, factory_va, unit_pos, unit_ids, unit_va
 
-        # Critic
-        if self.training:
-            critic_value = self.critic(features_embedded_value, unit_pos, factory_pos, unit_indices, factory_indices, max_group_count)
-        else:
-            critic_value = None
 
-        # Actor
-        logp, action, entropy = self.actor(features_embedded_actor, va, factory_pos, unit_act_type_va, unit_pos, max_group_count, unit_indices, factory_indices, action, is_deterministic)
+    def _entities_from_sparse_va(self, va):
+        """
+        the same as _entities_from_va, from [batch, entity, ...] valid actions and the factory_pos and unit_pos of the
+        entities (see ActionParser.get_sparse_valid_actions). Entities come in the order of their ids instead of their
+        positions.
+        """
+        unit_act_type_va = torch.stack(
+            [
+                va['move'].flatten(2).any(-1),
+                va['transfer'].flatten(2).any(-1),
+                va['pickup'].flatten(2).any(-1),
+                va['dig'].any(-1),
+                va['self_destruct'].any(-1),
+                va['recharge'].any(-1),
+                va['do_nothing'],
+            ],
+            axis=-1,
+        )
 
-        return logp, critic_value, action, entropy
+        factory_batch, factory_ids = torch.where(va['factory_act'].any(-1))
+        unit_batch, unit_ids = torch.where(unit_act_type_va.any(-1))
 
+        factory_xy = va['factory_pos'][factory_batch, factory_ids].long()
+        unit_xy = va['unit_pos'][unit_batch, unit_ids].long()
+        factory_pos = (factory_batch, factory_xy[:, 0], factory_xy[:, 1])
+        unit_pos = (unit_batch, unit_xy[:, 0], unit_xy[:, 1])
 
-    def critic(self, x, unit_pos, factory_pos, unit_indices, factory_indices, max_group_count):
-        B, _, _, _ = x.shape
+        factory_va = va['factory_act'][factory_batch, factory_ids]
+        unit_va = {'act_type': unit_act_type_va[unit_batch, unit_ids]}
+        for name in ['move', 'transfer', 'pickup', 'dig', 'self_destruct', 'recharge', 'do_nothing']:
+            unit_va[name] = va[name][unit_batch, unit_ids]
+        return factory_pos, factory_ids, factory_va, unit_pos, unit_ids, unit_va
 
-        final_critic_value = torch.zeros((B, max_group_count), device=x.device)
-        final_critic_value = final_critic_value.view(-1)
 
-        critic_embedding = self.critic_head(x)
+    def _trunk(self, all_features):
+        """
+        the actor embedding and in training mode the value maps of the critic heads, everything that runs over the map
+        """
+        features_embedded_actor = self.embedding_actor(all_features)
+        if not self.training:
+            return features_embedded_actor, None
+
+        critic_embedding = self.critic_head(self.embedding_value(all_features))
+        # values in float32 also under autocast
+        critic_maps = tuple(
+            head(critic_embedding)[:, 0].float()
+            for head in [self.critic_unit_head, self.critic_factory_head, self.critic_global_unit_head, self.critic_global_factory_head]
+        )
+        return features_embedded_actor, critic_maps
 
-        critic_value_unit = self.critic_unit_head(critic_embedding)[:, 0]
-        critic_value_unit = self._gather_from_map(critic_value_unit, unit_pos)
 
-        critic_value_factory = self.critic_factory_head(critic_embedding)[:, 0]
-        critic_value_factory = self._gather_from_map(critic_value_factory, factory_pos)
+    def critic(self, critic_maps, unit_pos, factory_pos, unit_indices, factory_indices, max_group_count):
+        critic_value_unit, critic_value_factory, critic_value_global_unit, critic_value_global_factory = critic_maps
+        B, _, _ = critic_value_unit.shape
 
-        critic_value_global_unit = self.critic_global_unit_head(critic_embedding)[:, 0]
-        critic_value_global_unit = critic_value_global_unit.view(B, -1).mean(dim=1)
+        final_critic_value = torch.zeros((B, max_group_count), device=critic_value_unit.device)
+        final_critic_value = final_critic_value.view(-1)
 
-        critic_value_global_factory = self.critic_global_factory_head(critic_embedding)[:, 0]
+        critic_value_unit = self._gather_from_map(critic_value_unit, unit_pos)
+        critic_value_factory = self._gather_from_map(critic_value_factory, factory_pos)
+        critic_value_global_unit = critic_value_global_unit.view(B, -1).mean(dim=1)
         critic_value_global_factory = critic_value_global_factory.view(B, -1).mean(dim=1)
 
         if len(unit_indices) > 0:
@@ -407,7 +522,7 @@ class SimpleNet(nn.Module):
         return final_critic_value
 
 
-    def actor(self, x, va, factory_pos, unit_act_type_va, unit_pos, max_group_count, unit_indices, factory_indices, action=None, is_deterministic=False):
+    def actor(self, x, factory_va, unit_va, factory_pos, unit_pos, max_group_count, unit_indices, factory_indices, action=None, is_deterministic=False):
         B, _, H, W = x.shape
         def _put_into_map(emb, pos):
             shape = (B, ) + emb.shape[1:] + (H, W)
@@ -426,14 +541,22 @@ class SimpleNet(nn.Module):
 
         # factory actor
         factory_emb = self._gather_from_map(x, factory_pos)
-        factory_va = self._gather_from_map(va['factory_act'], factory_pos)
         factory_action = action and self._gather_from_map(action['factory_act'], factory_pos)
-        factory_logp, factory_action, factory_entropy = self.factory_actor(
-            factory_emb,
-            factory_va,
-            factory_action,
-            is_deterministic=is_deterministic,
-        )
+        if self.compile_kwargs is None:
+            factory_logp, factory_action, factory_entropy = self.factory_actor(
+                factory_emb,
+                factory_va,
+                factory_action,
+                is_deterministic=is_deterministic,
+            )
+        else:
+            factory_logp, factory_action, factory_entropy = self._padded_call(
+                "factory_actor",
+                factory_emb,
+                factory_va,
+                factory_action,
+                is_deterministic=is_deterministic,
+            )
 
         if len(factory_indices) > 0:
             logp.scatter_add_(0, factory_indices, factory_logp)
@@ -443,26 +566,23 @@ class SimpleNet(nn.Module):
 
         # unit actor
         unit_emb = self._gather_from_map(x, unit_pos)
-        
-        unit_va = {
-            'act_type': self._gather_from_map(unit_act_type_va, unit_pos),
-            'move': self._gather_from_map(va['move'], unit_pos),
-            'transfer': self._gather_from_map(va['transfer'], unit_pos),
-            'pickup': self._gather_from_map(va['pickup'], unit_pos),
-            'dig': self._gather_from_map(va['dig'], unit_pos),
-            'self_destruct': self._gather_from_map(va['self_destruct'], unit_pos),
-            'recharge': self._gather_from_map(va['recharge'], unit_pos),
-            'do_nothing': self._gather_from_map(va['do_nothing'], unit_pos),
-        }
 
         unit_action = action and self._gather_from_map(action['unit_act'], unit_pos)
-        unit_logp, unit_action, unit_entropy = self.unit_actor(
-            unit_emb,
-            unit_emb,
-            unit_va,
-            unit_action,
-            is_deterministic=is_deterministic,
-        )
+        if self.compile_kwargs is None:
+            unit_logp, unit_action, unit_entropy = self.unit_actor(
+                unit_emb,
+                unit_va,
+                unit_action,
+                is_deterministic=is_deterministic,
+            )
+        else:
+            unit_logp, unit_action, unit_entropy = self._padded_call(
+                "unit_actor",
+                unit_emb,
+                unit_va,
+                unit_action,
+                is_deterministic=is_deterministic,
+            )
 
         if len(unit_indices) > 0:
             logp.scatter_add_(0, unit_indices, unit_logp)
@@ -496,7 +616,88 @@ class SimpleNet(nn.Module):
         return logp, output_action, entropy
 
 
-    def unit_actor(self, x_act, x_param,  va, action=None, is_deterministic=False):
+    def unit_actor(self, x, va, action=None, is_deterministic=False):
+        """
+        the act type head and the param heads of all types fused into one projection of the units, then each param is
+        sampled in one pass over all units from the logits of their act type's head. Units whose act type has no head
+        for a param get no log prob or entropy for it and a zero in its action channel. Without boolean masks the shapes
+        only depend on the number of units
+        """
+        n_units = x.shape[0]
+        unit_idx = torch.arange(n_units, device=x.device)
+
+        heads = [self.unit_act_type_net] + [
+            self.param_heads[unit_act_type.name][param_name]
+            for param_name, unit_act_types in UNIT_PARAM_TYPES.items() for unit_act_type in unit_act_types
+        ]
+        linears = [next(m for m in head.modules() if isinstance(m, nn.Linear)) for head in heads]
+        logits = F.linear(x, torch.cat([linear.weight for linear in linears]), torch.cat([linear.bias for linear in linears]))
+        act_type_logits, *param_logits = logits.split([linear.out_features for linear in linears], dim=-1)
+        param_logits = iter(param_logits)
+
+        logp, act_type, entropy = sample_from_categorical(
+            act_type_logits,
+            va['act_type'],
+            action[:, int(UnitActChannel.TYPE)] if action is not None else None,
+            is_deterministic
+        )
+        # plain ints as indices and constants, torch 2.1 writes enum members into the compiled graph's code as their repr
+        output_action = torch.zeros((n_units, len(UnitActChannel)), device=x.device)
+        output_action[:, int(UnitActChannel.TYPE)] = act_type
+        output_action[:, int(UnitActChannel.N)] = 1
+
+        params = {}
+        for param_name, unit_act_types in UNIT_PARAM_TYPES.items():
+            has_param = torch.zeros(n_units, dtype=torch.bool, device=x.device)
+            for unit_act_type in unit_act_types:
+                type_logits = next(param_logits)
+                type_va = self._param_va(param_name, unit_act_type, va, unit_idx, params)
+                is_type = (act_type == int(unit_act_type))
+                if unit_act_type == unit_act_types[0]:
+                    param_logits_of_type, param_va = type_logits, type_va
+                else:
+                    param_logits_of_type = torch.where(is_type[:, None], type_logits, param_logits_of_type)
+                    param_va = torch.where(is_type[:, None], type_va, param_va)
+                has_param = has_param | is_type
+
+            channel = int(UnitActChannel[param_name.upper()])
+            param_logp, params[param_name], param_entropy = sample_from_categorical(
+                param_logits_of_type,
+                param_va,
+                action[:, channel] if action is not None else None,
+                is_deterministic,
+            )
+            logp = logp + torch.where(has_param, param_logp, 0)
+            entropy = entropy + torch.where(has_param, param_entropy, 0)
+            output_action[:, channel] = torch.where(has_param, params[param_name], 0)
+
+        return logp, output_action, entropy
+
+
+    def _param_va(self, param_name, unit_act_type, va, unit_idx, params):
+        """
+        the valid values of a param of all units as if they were of unit_act_type, given the params sampled before.
+        The same masks as get_direction_param, get_resource_param, get_amount_param and get_repeat_param
+        """
+        type_va = va[unit_act_type.name.lower()]
+        if param_name == "direction":
+            return type_va.flatten(2).any(dim=-1)
+        if param_name == "resource":
+            if unit_act_type == UnitActType.TRANSFER:
+                return type_va[unit_idx, params["direction"]].flatten(2).any(-1)
+            return type_va.flatten(2).any(-1)
+        if param_name == "amount":
+            return torch.ones((len(unit_idx), ActDims.amount), dtype=torch.bool, device=unit_idx.device)
+        if unit_act_type == UnitActType.MOVE:
+            return type_va[unit_idx, params["direction"]]
+        return type_va
+
+
+    def unit_actor_per_type(self, x_act, x_param,  va, action=None, is_deterministic=False):
+        """
+        unit_actor with a pass of the param heads per act type over the units of that type, the reference unit_actor is
+        tested against
+        """
         act_type_logp, act_type, act_type_entropy = sample_from_categorical(
             self.unit_act_type_net(x_act),
             va['act_type'],
@@ -523,6 +724,23 @@ class SimpleNet(nn.Module):
         return logp, output_action, entropy
 
 
+    def _padded_call(self, name, x, va, action=None, is_deterministic=False):
+        """
+        the compiled factory_actor or unit_actor on the entities padded to entity_bucket. Padding entities
+        have zero features and actions and all actions valid, their results are dropped
+        """
+        n = x.shape[0]
+        if n == 0:
+            return getattr(self, name)(x, va, action, is_deterministic)
+        size = entity_bucket(n)
+        pad = lambda t, value: torch.cat([t, t.new_full((size - n,) + t.shape[1:], value)])
+        x = pad(x, 0)
+        va = {key: pad(value, True) for key, value in va.items()} if isinstance(va, dict) else pad(va, True)
+        action = None if action is None else pad(action, 0)
+        logp, output_action, entropy = self._compiled(name)(x, va, action, is_deterministic)
+        return logp[:n], output_action[:n], entropy[:n]
+
+
     def get_unit_action(self, x, va, unit_act_type, action=None, is_deterministic=False):
         n_units = x.shape[0]
         unit_idx = torch.arange(n_units, device=x.device)
@@ -0,0 +1,188 @@
+"""
+Rollout storage for collecting PPO data from LuxSyncVectorEnv.step_wait_any, which returns whichever envs finished
+their step first. Data is stored [env, step] with a step counter per env, so envs that come back out of order (or
+several steps ahead of a straggler) still write their steps in order. RolloutBuffer is the [step, env] storage for
+the lockstep rollout of train.py, which fills one step of all envs at a time.
+
+Also the GAE advantages of a collected rollout, as the per step loop train.py used and as a scan over all steps.
+"""
+from typing import Union
+
+import numpy as np
+import torch
+import tree
+
+
+class PerEnvRollout:
+    def __init__(self, num_envs: int, num_steps: int, device: Union[torch.device, str] = "cpu"):
+        self.num_envs = num_envs
+        self.num_steps = num_steps
+        self.device = device
+        # next step to write for every env
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        # nested dict of [env, step, ...] tensors, allocated on the first insert of a field
+        self.data = {}
+
+    def insert(self, env_ids, data: dict, step_offset: int = 0):
+        """
+        writes data batched over env_ids to the current step of each env. step_offset=-1 writes to the step an env
+        advanced from, e.g. the reward of the action stored there
+        """
+        env_ids = np.asarray(env_ids, dtype=np.int64)
+        steps = self.steps[env_ids] + step_offset
+        assert ((steps >= 0) & (steps < self.num_steps)).all(), f"steps {steps} of envs {env_ids} out of range"
+        self._insert(self.data, data, torch.from_numpy(env_ids), torch.from_numpy(steps))
+
+    def _insert(self, store: dict, data: dict, env_ids: torch.Tensor, steps: torch.Tensor):
+        for key, value in data.items():
+            if isinstance(value, dict):
+                self._insert(store.setdefault(key, {}), value, env_ids, steps)
+                continue
+            value = torch.as_tensor(value)
+            if key not in store:
+                store[key] = torch.zeros(
+                    (self.num_envs, self.num_steps) + value.shape[1:], dtype=value.dtype, device=self.device
+                )
+            store[key][env_ids, steps] = value.to(self.device)
+
+    def advance(self, env_ids):
+        self.steps[np.asarray(env_ids, dtype=np.int64)] += 1
+
+    def unfinished(self, env_ids) -> np.ndarray:
+        """
+        the envs of env_ids that still have steps to collect
+        """
+        env_ids = np.asarray(env_ids, dtype=np.int64)
+        return env_ids[self.steps[env_ids] < self.num_steps]
+
+    @property
+    def full(self) -> bool:
+        return bool((self.steps >= self.num_steps).all())
+
+    def step_major(self) -> dict:
+        """
+        contiguous [step, env, ...] copies of the data, the layout of the stores train.py fills step by step
+        """
+        return tree.map_structure(lambda x: x.transpose(0, 1).contiguous(), self.data)
+
+    def reset(self):
+        self.steps[:] = 0
+        tree.map_structure(lambda x: x.zero_(), self.data)
+
+
+class RolloutBuffer:
+    """
+    Preallocated [step, env, ...] storage for steps collected from all envs at once. Every field is a single contiguous
+    tensor, optionally in pinned memory, allocated on the first insert of its top level key and reused after that. A
+    step is written by copying into a slice of the fields, from tensors or from torch.from_numpy views of arrays, so
+    the dtype conversion is the only copy. There is one extra step after the last one, holding the observations and
+    dones PPO bootstraps from and the next rollout starts with
+    """
+    def __init__(self, num_steps: int, num_envs: int, device: Union[torch.device, str] = "cpu", pin_memory: bool = False):
+        self.num_steps = num_steps
+        self.num_envs = num_envs
+        self.device = device
+        self.pin_memory = pin_memory
+        # top level key -> nested dict of [step, env, ...] tensors, and the same tensors in tree.flatten order
+        self.fields = {}
+        self._flat_fields = {}
+
+    def _allocate(self, value, dtype: Union[torch.dtype, None]) -> torch.Tensor:
+        value = torch.as_tensor(value)
+        return torch.zeros(
+            (self.num_steps + 1, self.num_envs) + value.shape[1:],
+            dtype=value.dtype if dtype is None else dtype,
+            device=self.device,
+            pin_memory=self.pin_memory,
+        )
+
+    def insert(self, step: int, data: dict, dtype: Union[torch.dtype, None] = None):
+        """
+        writes data batched over all envs to step, for step in [0, num_steps]. dtype is the dtype of fields allocated
+        by this insert, by default the dtype of their data
+        """
+        assert 0 <= step <= self.num_steps, f"step {step} out of range"
+        for key, value in data.items():
+            if key not in self.fields:
+                self.fields[key] = tree.map_structure(lambda x: self._allocate(x, dtype), value)
+                self._flat_fields[key] = tree.flatten(self.fields[key])
+            values = tree.flatten(value)
+            assert len(values) == len(self._flat_fields[key]), f"the structure of {key} changed"
+            for field, x in zip(self._flat_fields[key], values):
+                field[step].copy_(torch.from_numpy(x) if isinstance(x, np.ndarray) else x)
+
+    def row(self, step: int, key: str) -> dict:
+        """
+        views of the fields of key at step
+        """
+        return tree.map_structure(lambda x: x[step], self.fields[key])
+
+    @property
+    def data(self) -> dict:
+        """
+        views of the fields of the num_steps collected steps
+        """
+        return tree.map_structure(lambda x: x[:self.num_steps], self.fields)
+
+    def reset(self):
+        """
+        carries the extra step over to step 0. The other steps are not cleared, every step of a rollout overwrites them
+        """
+        for fields in self._flat_fields.values():
+            for field in fields:
+                field[0].copy_(field[self.num_steps])
+
+
+def gae_loop(rewards: torch.Tensor, values: torch.Tensor, dones: torch.Tensor, gamma: float, gae_lambda: float) -> torch.Tensor:
+    """
+    GAE advantages of [step, ...] rewards, values and dones, one step at a time from the last one. The last step has
+    no next value to bootstrap from and gets an advantage of 0
+    """
+    num_steps = rewards.shape[0]
+    advantages = torch.zeros_like(rewards)
+    lastgaelam = 0
+    for t in reversed(range(num_steps - 1)):
+        nextnonterminal = 1.0 - dones[t + 1]
+        nextvalues = values[t + 1]
+        delta = rewards[t] + gamma * nextvalues * nextnonterminal - values[t]
+        advantages[t] = lastgaelam = delta + gamma * gae_lambda * nextnonterminal * lastgaelam
+    return advantages
+
+
+def _linear_recurrence(a: torch.Tensor, b: torch.Tensor) -> torch.Tensor:
+    """
+    x_i = a_i + b_i * x_i-1 along dim 0, with x_-1 = 0. Pairs of steps are merged into a recurrence over the odd steps
+    of half the length, which is solved the same way, and the even steps are filled in from it. That is
+    2 * log2(n) rounds of a few elementwise ops with n steps of work in total
+    """
+    n = a.shape[0]
+    if n == 1:
+        return a.clone()
+    paired = n - n % 2
+    # x_2j+1 = (a_2j+1 + b_2j+1 * a_2j) + b_2j+1 * b_2j * x_2j-1
+    x_odd = _linear_recurrence(
+        a[1::2] + b[1::2] * a[0:paired:2],
+        b[1::2] * b[0:paired:2],
+    )
+    x = torch.empty_like(a)
+    x[1::2] = x_odd
+    x[0] = a[0]
+    # x_2j = a_2j + b_2j * x_2j-1
+    x[2::2] = a[2::2] + b[2::2] * x_odd[:(n - 1) // 2]
+    return x
+
+
+def gae_scan(rewards: torch.Tensor, values: torch.Tensor, dones: torch.Tensor, gamma: float, gae_lambda: float) -> torch.Tensor:
+    """
+    the advantages of gae_loop, for all steps at once: A_t = delta_t + c_t * A_t+1 solved as a linear recurrence over
+    the reversed steps, in O(log num_steps) rounds of elementwise ops instead of num_steps rounds over single steps
+    """
+    num_steps = rewards.shape[0]
+    advantages = torch.zeros_like(rewards)
+    if num_steps <= 1:
+        return advantages
+    nextnonterminal = 1.0 - dones[1:]
+    delta = rewards[:-1] + gamma * values[1:] * nextnonterminal - values[:-1]
+    coef = gamma * gae_lambda * nextnonterminal
+    advantages[:-1] = _linear_recurrence(delta.flip(0), coef.flip(0)).flip(0)
+    return advantages
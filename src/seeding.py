@@ -3,7 +3,16 @@ import numpy as np
 import random
 import os
 
-def set_seed(seed: int = 42):
+def rank_seed(seed: int, rank: int = 0) -> int:
+    """
+    the seed of a data parallel rank, rank 0 keeps the seed of a single process run
+    """
+    if rank == 0:
+        return seed
+    return np.random.SeedSequence([seed, rank]).generate_state(1)[0].item()
+
+def set_seed(seed: int = 42, rank: int = 0):
+    seed = rank_seed(seed, rank)
     random.seed(seed)
     np.random.seed(seed)
     torch.manual_seed(seed)
@@ -11,3 +20,21 @@ def set_seed(seed: int = 42):
     torch.backends.cudnn.benchmark = False
     torch.backends.cudnn.deterministic = True
     os.environ["PYTHONHASHSEED"] = str(seed)
+
+def get_rng_state() -> dict:
+    """
+    the states of the random number generators set_seed seeds, for set_rng_state
+    """
+    return {
+        "random": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+def set_rng_state(state: dict):
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
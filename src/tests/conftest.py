@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from tensorboard.backend.event_processing.event_accumulator import EventAccumulator
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def play_random_actions(obs, env, rng):
+    """
+    random but legal looking actions for every step of a game: bids, factory placements, then unit moves and
+    recharges while factories build lights and heavies or water lichen
+    """
+    if env.env_steps == 0:
+        return {agent: dict(faction="AlphaStrike", bid=0) for agent in env.agents}
+    actions = dict()
+    for agent in env.agents:
+        if env.state.real_env_steps < 0:
+            spawns = np.argwhere(obs[agent]["board"]["valid_spawns_mask"])
+            actions[agent] = dict(spawn=spawns[rng.randint(len(spawns))], metal=150, water=150)
+            continue
+        a = dict()
+        for unit_id in obs[agent]["units"][agent]:
+            if rng.rand() < 0.5:
+                a[unit_id] = [np.array([rng.choice([0, 3]), rng.randint(5), 0, 0, 0, 1])]
+        for factory_id in obs[agent]["factories"][agent]:
+            r = rng.rand()
+            if r < 0.6:
+                # build lights, now and then a heavy, or water lichen
+                a[factory_id] = 2 if r >= 0.25 else int(r >= 0.2)
+        actions[agent] = a
+    return actions
+
+
+@pytest.fixture
+def random_actions():
+    return play_random_actions
+
+
+def run_train(save_dir, *args):
+    """
+    runs train.py on cpu without evaluation, logging to save_dir. A process per run, SimpleNet seeds every layer name
+    once per process
+    """
+    subprocess.run(
+        [sys.executable, "train.py", "--cuda", "False", "--evaluate-interval", "0", "--save-dir", str(save_dir), *args],
+        cwd=SRC, check=True, capture_output=True,
+    )
+
+
+def logged_scalars(directory, tag):
+    """
+    the (step, value) pairs of a TensorBoard tag logged to directory
+    """
+    events = EventAccumulator(str(directory))
+    events.Reload()
+    return [(event.step, event.value) for event in events.Scalars(tag)]
+
+
+@pytest.fixture
+def train():
+    return run_train
+
+
+@pytest.fixture
+def scalars():
+    return logged_scalars
@@ -0,0 +1,129 @@
+'''
+The array version of ActionParser.get_valid_actions must give the same masks as the per unit loop, and the sparse
+per entity valid actions the same masks as the dense ones.
+'''
+import numpy as np
+import pytest
+
+from impl_config import EnvParam
+from kit.kit import obs_to_game_state
+from luxai_s2 import LuxAI_S2
+from parsers import ActionParser, FeatureParser
+from parsers.action_parser_full_act import SPARSE_ENTITY_KEYS, SPARSE_POSITION_KEYS
+
+
+def crowd_units(game_state, rng):
+    """
+    moves all units onto distinct tiles around a factory and gives them random types, power and cargo, so units compete
+    for move targets, stand next to enemies and factories run out of power
+    """
+    env_cfg = game_state.env_cfg
+    center = next(iter(game_state.factories["player_0"].values())).pos
+    window = np.argwhere(np.ones((9, 9), dtype=bool)) + center - 4
+    window = window[((window >= 0) & (window < EnvParam.map_size)).all(axis=1)]
+    units = [unit for units in game_state.units.values() for unit in units.values()]
+    tiles = window[rng.permutation(len(window))[:len(units)]]
+    for unit, tile in zip(units, tiles):
+        unit.unit_type = rng.choice(["LIGHT", "HEAVY"])
+        unit.unit_cfg = env_cfg.ROBOTS[unit.unit_type]
+        unit.pos = tile
+        unit.power = rng.choice([0, rng.randint(unit.unit_cfg.BATTERY_CAPACITY + 1), unit.unit_cfg.BATTERY_CAPACITY])
+        unit.cargo.ice = rng.choice([0, rng.randint(unit.unit_cfg.CARGO_SPACE)])
+        unit.cargo.ore = rng.choice([0, rng.randint(unit.unit_cfg.CARGO_SPACE)])
+    for factories in game_state.factories.values():
+        for factory in factories.values():
+            factory.power *= rng.randint(2)
+
+
+def assert_same_valid_actions(game_state, player_id):
+    expected = ActionParser.get_valid_actions_loop(game_state, player_id)
+    actual = ActionParser.get_valid_actions(game_state, player_id)
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        assert actual[key].dtype == value.dtype, key
+        assert actual[key].shape == value.shape, key
+        assert actual[key].tobytes() == value.tobytes(), key
+
+
+@pytest.mark.parametrize("rule_based_early_step", [True, False])
+def test_get_valid_actions_matches_loop(monkeypatch, rule_based_early_step, random_actions):
+    monkeypatch.setattr(EnvParam, "rule_based_early_step", rule_based_early_step)
+    env = LuxAI_S2(verbose=0, FACTORY_WATER_CONSUMPTION=0)
+    rng = np.random.RandomState(0)
+    obs, _ = env.reset(seed=0)
+    n_units = 0
+    for step in range(200):
+        for player_id, player in enumerate(env.agents):
+            game_state = obs_to_game_state(env.env_steps, env.env_cfg, obs[player])
+            assert_same_valid_actions(game_state, player_id)
+            n_units += len(game_state.units[player])
+        obs, _, terminations, _, _ = env.step(random_actions(obs, env, rng))
+        if any(terminations.values()):
+            break
+    assert n_units > 0
+
+
+def test_get_valid_actions_matches_loop_crowded(random_actions):
+    env = LuxAI_S2(verbose=0, FACTORY_WATER_CONSUMPTION=0)
+    rng = np.random.RandomState(1)
+    obs, _ = env.reset(seed=1)
+    for step in range(150):
+        obs, _, _, _, _ = env.step(random_actions(obs, env, rng))
+        if step < 20 or step % 5:
+            continue
+        for player_id, player in enumerate(env.agents):
+            game_state = obs_to_game_state(env.env_steps, env.env_cfg, obs[player])
+            crowd_units(game_state, rng)
+            assert_same_valid_actions(game_state, player_id)
+
+
+def assert_sparse_matches_dense(game_state, player_id, max_entity_number=500):
+    dense = ActionParser.get_valid_actions(game_state, player_id)
+    sparse = ActionParser.get_sparse_valid_actions(game_state, player_id, max_entity_number)
+    assert sparse.keys() == dense.keys() | set(SPARSE_POSITION_KEYS)
+    player = f"player_{player_id}"
+    entities = {
+        "factory_pos": {FeatureParser.get_factory_id(f): f.pos for f in game_state.factories[player].values()},
+        "unit_pos": {FeatureParser.get_unit_id(u, None, None): u.pos for u in game_state.units[player].values()},
+    }
+    for key, value in dense.items():
+        if key not in SPARSE_ENTITY_KEYS:
+            np.testing.assert_array_equal(sparse[key], value, err_msg=key)
+            continue
+        pos_key = "factory_pos" if key == "factory_act" else "unit_pos"
+        ids = np.array(sorted(entities[pos_key]), dtype=np.int64)
+        assert sparse[key].shape == (max_entity_number,) + value.shape[:-2]
+        x, y = sparse[pos_key][ids].T
+        np.testing.assert_array_equal(sparse[key][ids], np.moveaxis(value[..., x, y], -1, 0), err_msg=key)
+        # nothing outside the entity slots and tiles
+        assert sparse[key].sum() == sparse[key][ids].sum() == value.sum(), key
+    for pos_key, positions in entities.items():
+        ids = list(positions)
+        np.testing.assert_array_equal(sparse[pos_key][ids], np.array(list(positions.values())).reshape(-1, 2))
+        assert (np.delete(sparse[pos_key], ids, axis=0) == -1).all()
+
+
+@pytest.mark.parametrize("rule_based_early_step", [True, False])
+def test_sparse_valid_actions_match_dense(monkeypatch, rule_based_early_step, random_actions):
+    monkeypatch.setattr(EnvParam, "rule_based_early_step", rule_based_early_step)
+    env = LuxAI_S2(verbose=0, FACTORY_WATER_CONSUMPTION=0)
+    rng = np.random.RandomState(2)
+    obs, _ = env.reset(seed=2)
+    for step in range(150):
+        for player_id, player in enumerate(env.agents):
+            game_state = obs_to_game_state(env.env_steps, env.env_cfg, obs[player])
+            assert_sparse_matches_dense(game_state, player_id)
+        obs, _, terminations, _, _ = env.step(random_actions(obs, env, rng))
+        if any(terminations.values()):
+            break
+
+
+def test_sparse_valid_actions_entity_ids_out_of_range(random_actions):
+    env = LuxAI_S2(verbose=0, FACTORY_WATER_CONSUMPTION=0)
+    rng = np.random.RandomState(0)
+    obs, _ = env.reset(seed=0)
+    while not obs["player_0"]["units"]["player_0"]:
+        obs, _, _, _, _ = env.step(random_actions(obs, env, rng))
+    game_state = obs_to_game_state(env.env_steps, env.env_cfg, obs["player_0"])
+    with pytest.raises(ValueError):
+        ActionParser.get_sparse_valid_actions(game_state, 0, max_entity_number=10)
@@ -0,0 +1,41 @@
+'''
+Both delta formats of State.get_change_obs must rebuild the same boards, through the engine and through the kit.
+'''
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from kit.kit import process_obs, to_json
+from luxai_s2 import LuxAI_S2
+from luxai_s2.state import State
+
+BOARD_DELTA_ITEMS = ["rubble", "lichen", "lichen_strains"]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_change_obs_round_trip(compact):
+    env = LuxAI_S2(verbose=0)
+    env.reset(seed=0)
+    rng = np.random.RandomState(0)
+    prev_obs = env.state.get_obs()
+    engine_board = SimpleNamespace(**{item: prev_obs["board"][item].copy() for item in BOARD_DELTA_ITEMS})
+    kit_obs = process_obs("player_0", None, 0, json.loads(json.dumps(to_json(prev_obs))))
+    board = env.state.board
+    for _ in range(10):
+        # random edits stand in for a step's worth of board changes
+        for item in BOARD_DELTA_ITEMS:
+            arr = getattr(board, item)
+            mask = rng.rand(*arr.shape) < 0.05
+            arr[mask] = rng.randint(-1, 100, size=mask.sum())
+        change_obs = env.state.get_change_obs(prev_obs, compact=compact)
+        if compact:
+            assert set(change_obs["board"]["lichen"]) == {"index", "value"}
+
+        State.accumulate_board_changes(engine_board, [change_obs["board"]])
+        kit_obs = process_obs("player_0", kit_obs, 1, json.loads(json.dumps(to_json(change_obs))))
+        for item in BOARD_DELTA_ITEMS:
+            np.testing.assert_array_equal(getattr(engine_board, item), getattr(board, item))
+            np.testing.assert_array_equal(kit_obs["board"][item], getattr(board, item))
+        prev_obs = env.state.get_obs()
@@ -0,0 +1,93 @@
+'''
+train.py resumed from one of its checkpoints must end up with the same weights, optimizer state, counters, random
+generator states and TensorBoard scalars as a run that was never interrupted, and the CheckpointWriter must keep only
+the newest checkpoints, each of them complete. With the inference server the policy that samples a step depends on
+timing, so only the counters, generator states and the steps of the scalars are compared there.
+'''
+import os
+import shutil
+
+import numpy as np
+import pytest
+import torch
+
+from checkpoint import CheckpointWriter, latest_checkpoint, list_checkpoints, load_checkpoint
+
+
+def create():
+    model = torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.ReLU(), torch.nn.Linear(16, 1))
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-2, eps=1e-5)
+    return model, optimizer
+
+
+def state(model, optimizer, update):
+    return {
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "update": update,
+    }
+
+
+TRAIN_ARGS = ["--num-envs", "2", "--num-steps", "8", "--total-timesteps", "48", "--train-num-collect", "16",
+              "--num-minibatches", "2", "--update-epochs", "1", "--save-interval", "16", "--keep-checkpoints", "0"]
+
+
+@pytest.mark.parametrize("args, exact", [([], True), (["--inference-server", "True"], False)])
+def test_resume_matches_uninterrupted(tmp_path, args, exact, train, scalars):
+    uninterrupted, resumed = tmp_path / "uninterrupted", tmp_path / "resumed"
+    train(uninterrupted, *TRAIN_ARGS, *args)
+
+    # the run stopped after writing the checkpoint of update 2 of 3, and had logged part of update 3
+    shutil.copytree(uninterrupted, resumed)
+    os.remove(resumed / "checkpoint_48.pt")
+    os.remove(resumed / "model_48.pth")
+    train(resumed, *TRAIN_ARGS, "--resume", str(resumed), *args)
+
+    expected, actual = load_checkpoint(str(uninterrupted)), load_checkpoint(str(resumed))
+    for key in ["global_step", "update", "last_eval_step", "last_save_model_step"]:
+        assert expected[key] == actual[key], key
+    assert torch.equal(expected["rng"]["torch"], actual["rng"]["torch"])
+    np.testing.assert_array_equal(expected["rng"]["numpy"][1], actual["rng"]["numpy"][1])
+    assert expected["rng"]["random"] == actual["rng"]["random"]
+    assert actual["update"] == 3
+    if not exact:
+        assert [step for step, _ in scalars(resumed, "losses/value_loss_0")] == [16, 32, 48]
+        return
+    for key in expected["model"]:
+        assert torch.equal(expected["model"][key], actual["model"][key]), key
+    # the annealed learning rate, the Adam step counts and moments
+    assert expected["optimizer"]["param_groups"] == actual["optimizer"]["param_groups"]
+    for param, param_state in expected["optimizer"]["state"].items():
+        for key, value in param_state.items():
+            assert torch.equal(value, actual["optimizer"]["state"][param][key]), key
+
+    # the steps the interrupted run logged after its checkpoint are replaced, not duplicated
+    for tag in ["charts/learning_rate", "losses/value_loss_0"]:
+        assert scalars(resumed, tag) == scalars(uninterrupted, tag)
+        assert [step for step, _ in scalars(resumed, tag)] == [16, 32, 48]
+
+
+def test_snapshot_is_taken_on_save(tmp_path):
+    model, optimizer = create()
+    writer = CheckpointWriter(str(tmp_path))
+    expected = model[0].weight.detach().clone()
+    writer.save(0, state(model, optimizer, 0))
+    with torch.no_grad():
+        model[0].weight.add_(1)
+    writer.close()
+    assert torch.equal(load_checkpoint(str(tmp_path))["model"]["0.weight"], expected)
+
+
+def test_rotation(tmp_path):
+    model, optimizer = create()
+    writer = CheckpointWriter(str(tmp_path), keep=2)
+    for step in [100, 200, 300, 400]:
+        writer.save(step, state(model, optimizer, step), model_path=os.path.join(tmp_path, f"model_{step}.pth"))
+    writer.close()
+
+    assert [step for step, _ in list_checkpoints(str(tmp_path))] == [300, 400]
+    assert latest_checkpoint(str(tmp_path)).endswith("checkpoint_400.pt")
+    # the model files are not rotated, and no temporary file is left
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("model_")) == [f"model_{step}.pth" for step in [100, 200, 300, 400]]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    model.load_state_dict(torch.load(os.path.join(tmp_path, "model_400.pth")))
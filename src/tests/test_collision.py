@@ -0,0 +1,179 @@
+'''
+Differential tests for the vectorized collision resolution against the per tile rules the movement phase of LuxAI_S2
+had before, on random pileups and in games.
+'''
+import math
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from luxai_s2 import LuxAI_S2
+from luxai_s2.actions import move_deltas
+from luxai_s2.state import STATS_INDEX
+from luxai_s2.unit import UnitType
+from luxai_s2.utils.collision import resolve_collisions
+from luxai_s2.utils.utils import get_top_two_power_units
+
+
+class FakeUnit:
+    def __init__(self, i, unit_type, power):
+        self.unit_id = i
+        self.unit_type = unit_type
+        self.power = power
+
+
+def reference_resolve(pos_index, power, is_heavy, moved, power_loss_factor):
+    # the per tile decision rules of the movement phase, without the env around it
+    units = [
+        FakeUnit(i, UnitType.HEAVY if h else UnitType.LIGHT, int(p)) for i, (p, h) in enumerate(zip(power, is_heavy))
+    ]
+    tiles = defaultdict(list)
+    heavy_entered = defaultdict(list)
+    light_entered = defaultdict(list)
+    for u, p, m in zip(units, pos_index, moved):
+        tiles[p].append(u)
+        if m:
+            (heavy_entered if u.unit_type == UnitType.HEAVY else light_entered)[p].append(u)
+    survive = np.zeros(len(units), dtype=bool)
+    for p, tile_units in tiles.items():
+        surviving_unit = None
+        if len(tile_units) == 1:
+            surviving_unit = tile_units[0]
+        elif len(heavy_entered[p]) > 1:
+            most, next_most = get_top_two_power_units(tile_units, UnitType.HEAVY)
+            if most.power != next_most.power:
+                most.power -= math.ceil(next_most.power * power_loss_factor)
+                surviving_unit = most
+        elif len(heavy_entered[p]) > 0:
+            surviving_unit = heavy_entered[p][0]
+        else:
+            heavies = [u for u in tile_units if u.unit_type == UnitType.HEAVY]
+            if len(heavies) == 1:
+                surviving_unit = heavies[0]
+            elif len(light_entered[p]) > 1:
+                most, next_most = get_top_two_power_units(tile_units, UnitType.LIGHT)
+                if most.power != next_most.power:
+                    most.power -= math.ceil(next_most.power * power_loss_factor)
+                    surviving_unit = most
+            elif len(light_entered[p]) > 0:
+                surviving_unit = light_entered[p][0]
+        if surviving_unit is not None:
+            survive[surviving_unit.unit_id] = True
+    return survive, np.array([u.power for u in units])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_resolve_collisions_matches_reference(seed):
+    rng = np.random.RandomState(seed)
+    for _ in range(50):
+        n = rng.randint(1, 40)
+        # few tiles so that most of them see multi unit pileups, low power range so that ties happen
+        pos_index = rng.randint(0, rng.randint(1, 12), size=n)
+        power = rng.randint(0, 8, size=n)
+        is_heavy = rng.rand(n) < rng.rand()
+        moved = rng.rand(n) < 0.7
+        # reference order: movers first, then stationary units
+        order = np.argsort(~moved, kind="stable")
+        pos_index, power, is_heavy, moved = pos_index[order], power[order], is_heavy[order], moved[order]
+
+        expected_survive, expected_power = reference_resolve(pos_index, power, is_heavy, moved, 0.5)
+        survive, new_power, collided = resolve_collisions(pos_index, power, is_heavy, moved, 0.5)
+        np.testing.assert_array_equal(survive, expected_survive)
+        np.testing.assert_array_equal(new_power, expected_power)
+        np.testing.assert_array_equal(collided, np.bincount(pos_index)[pos_index] > 1)
+
+
+def reference_movement(env, actions_by_type):
+    """
+    the movement phase as it was before resolve_collisions: every unit, moved or not, goes through the per tile rules
+    """
+    board = env.state.board
+    moved_units = []
+    for unit, move_action in actions_by_type["move"]:
+        if move_action.move_dir != 0:
+            board.remove_unit(unit)
+            unit.pos = unit.pos + move_action.dist * move_deltas[move_action.move_dir]
+            unit.power -= move_action.power_cost
+            moved_units.append(unit)
+        unit.repeat_action(move_action)
+    units = moved_units + [u for agent in env.state.units for u in env.state.units[agent].values() if u not in moved_units]
+    survive, power = reference_resolve(
+        [board.flat_index(u.pos) for u in units],
+        [u.power for u in units],
+        [u.unit_type == UnitType.HEAVY for u in units],
+        [u in moved_units for u in units],
+        env.env_cfg.POWER_LOSS_FACTOR,
+    )
+    for u, p in zip(units, power):
+        u.power = int(p)
+    for u, s in zip(units, survive):
+        if s:
+            board.add_unit(u)
+    for u, s in zip(units, survive):
+        if not s:
+            env.destroy_unit(u)
+            env.state.stats[u.team.agent].add(1, "destroyed", u.unit_type.name)
+
+
+def play_crowded_game(seed, steps):
+    env = LuxAI_S2(
+        collect_stats=True,
+        verbose=0,
+        FACTORY_WATER_CONSUMPTION=0,
+        INIT_WATER_METAL_PER_FACTORY=2000,
+    )
+    obs, _ = env.reset(seed=seed)
+    rng = np.random.RandomState(seed)
+    obs, _, _, _, _ = env.step({agent: dict(faction="AlphaStrike", bid=0) for agent in env.agents})
+    while env.state.real_env_steps < 0:
+        actions = dict()
+        for agent in env.agents:
+            spawns = np.argwhere(obs[agent]["board"]["valid_spawns_mask"])
+            actions[agent] = dict(spawn=spawns[rng.randint(len(spawns))], metal=400, water=400)
+        obs, _, _, _, _ = env.step(actions)
+
+    history = []
+    for _ in range(steps):
+        actions = dict()
+        for agent in env.agents:
+            a = dict()
+            for unit_id in obs[agent]["units"][agent]:
+                if rng.rand() < 0.7:
+                    a[unit_id] = [np.array([0, rng.randint(5), 0, 0, 0, 1])]
+            for factory_id in obs[agent]["factories"][agent]:
+                if rng.rand() < 0.6:
+                    a[factory_id] = int(rng.rand() < 0.3)
+            actions[agent] = a
+        obs, rewards, terminations, _, _ = env.step(actions)
+        units = {
+            unit_id: (tuple(u.pos.pos), u.power)
+            for agent in env.state.units
+            for unit_id, u in env.state.units[agent].items()
+        }
+        history.append((units, env.state.board.units_map.copy(), env.state.board.rubble.copy(),
+                        {agent: stats.counters.copy() for agent, stats in env.state.stats.items()}))
+        if terminations["player_0"] or terminations["player_1"]:
+            break
+    return history
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_movement_matches_reference_in_games(seed, monkeypatch):
+    resolved = play_crowded_game(seed, 150)
+    with monkeypatch.context() as m:
+        m.setattr(LuxAI_S2, "_handle_movement_actions", reference_movement)
+        reference = play_crowded_game(seed, 150)
+    assert len(reference) == len(resolved)
+    destroyed = 0
+    for (units_a, units_map_a, rubble_a, stats_a), (units_b, units_map_b, rubble_b, stats_b) in zip(reference, resolved):
+        assert units_a == units_b
+        np.testing.assert_array_equal(units_map_a, units_map_b)
+        np.testing.assert_array_equal(rubble_a, rubble_b)
+        assert stats_a.keys() == stats_b.keys()
+        for agent in stats_a:
+            np.testing.assert_array_equal(stats_a[agent], stats_b[agent])
+    # the games had collisions to resolve
+    for agent in stats_b:
+        destroyed += stats_b[agent][[STATS_INDEX[("destroyed", "LIGHT")], STATS_INDEX[("destroyed", "HEAVY")]]].sum()
+    assert destroyed > 0
@@ -0,0 +1,35 @@
+'''
+The array version of FeatureParser._get_feature must give the same features as the per entity loop.
+'''
+import numpy as np
+
+from kit.kit import obs_to_game_state
+from luxai_s2 import LuxAI_S2
+from parsers import FeatureParser
+
+
+def test_get_feature_matches_loop(random_actions):
+    env = LuxAI_S2(verbose=0, FACTORY_WATER_CONSUMPTION=0)
+    parser = FeatureParser()
+    rng = np.random.RandomState(0)
+    obs, _ = env.reset(seed=0)
+    for step in range(120):
+        obs, _, _, _, _ = env.step(random_actions(obs, env, rng))
+        if step % 10:
+            continue
+        game_state = obs_to_game_state(env.env_steps, env.env_cfg, obs["player_0"])
+        static_planes = parser._static_planes(game_state)
+        for player in env.agents:
+            expected = parser._get_feature_loop(game_state, player)
+            actual = parser._get_feature(game_state, player, static_planes=static_planes)
+            for key, value in expected.items():
+                assert actual[key].dtype == value.dtype, key
+                np.testing.assert_array_equal(actual[key], value, err_msg=key)
+
+        board = game_state.board
+        strain_ids = [factory.strain_id for factories in game_state.factories.values() for factory in factories.values()]
+        tiles, lichen = FeatureParser.lichen_per_strain(board, strain_ids + [99])
+        assert tiles.tolist() == [np.sum(board.lichen_strains == strain_id) for strain_id in strain_ids] + [0]
+        assert lichen.tolist() == [board.lichen[board.lichen_strains == strain_id].sum() for strain_id in strain_ids] + [0]
+    # the random game grew lichen and built units
+    assert board.lichen.sum() > 0 and len(game_state.units["player_0"]) > 0
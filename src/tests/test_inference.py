@@ -0,0 +1,62 @@
+'''
+The inference server must hand every player the actions, log probs and values of its own observations from the one
+forward over both players, and reload the policy only when the learner published a new version.
+'''
+import multiprocessing as mp
+
+import torch
+
+from inference import PolicyCopy, sample_actions
+
+FEATURE_NAMES = ["global_feature", "map_feature", "factory_feature", "unit_feature", "location_feature"]
+
+
+class FakePolicy(torch.nn.Module):
+    """
+    the outputs of SimpleNet, made of the inputs so they can be traced back to their player
+    """
+    def forward(self, global_feature, map_feature, factory_feature, unit_feature, location_feature, va, action=None, is_deterministic=False):
+        logp = global_feature[:, :1].expand(-1, 3)
+        value = logp * 10
+        action = {"factory_act": map_feature[:, 0].long(), "unit_act": va["move"].long()}
+        return logp, value, action, None
+
+
+def test_sample_actions_per_player():
+    num_envs = 3
+    obs = {
+        player: {name: torch.full((num_envs, 2, 4, 4), float(player_id + 1)) for name in FEATURE_NAMES}
+        for player_id, player in enumerate(["player_0", "player_1"])
+    }
+    for player_id, player in enumerate(["player_0", "player_1"]):
+        obs[player]["global_feature"] = torch.arange(num_envs)[:, None].float() + 100 * player_id
+    valid_action = {
+        "player_0": {"move": torch.zeros(num_envs, 5, 2, 4, 4, dtype=torch.bool)},
+        "player_1": {"move": torch.ones(num_envs, 5, 2, 4, 4, dtype=torch.bool)},
+    }
+    action, logprob, value = sample_actions(FakePolicy(), obs, valid_action, "cpu")
+    for player_id, player in enumerate(["player_0", "player_1"]):
+        expected = torch.arange(num_envs)[:, None].float().expand(-1, 3) + 100 * player_id
+        assert torch.equal(logprob[player], expected)
+        assert torch.equal(value[player], expected * 10)
+        assert (action[player]["factory_act"] == player_id + 1).all()
+        assert action[player]["factory_act"].shape == (num_envs, 4, 4)
+        assert (action[player]["unit_act"] == player_id).all()
+
+
+def test_policy_copy_reloads_published_versions():
+    published = torch.nn.Linear(3, 2).share_memory()
+    version, lock = mp.Value("q", 0), mp.Lock()
+    policy = PolicyCopy(published, version, lock, "cpu")
+    assert policy.policy is not published and policy.policy.training
+
+    # the weights change without a new version while the learner writes them
+    with torch.no_grad():
+        published.weight.add_(1)
+    policy.refresh()
+    assert not torch.equal(policy.policy.weight, published.weight)
+
+    version.value += 1
+    policy.refresh()
+    assert policy.policy_version == 1
+    assert torch.equal(policy.policy.weight, published.weight)
@@ -0,0 +1,47 @@
+'''
+Factory.cache_water_info skips the lichen BFS when nothing it reads changed, the positions it keeps must always be the
+ones a fresh search on the same board finds.
+'''
+import numpy as np
+import pytest
+
+from luxai_s2 import LuxAI_S2
+from luxai_s2.factory import WATER_INFO_DELTAS, Factory, compute_water_info, lichen_growth_forbidden
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_cached_water_info_matches_fresh_search(seed, monkeypatch, random_actions):
+    cache_water_info = Factory.cache_water_info
+    checked = {"calls": 0, "skipped": 0}
+
+    def checked_cache_water_info(self, board, env_cfg, forbidden=None):
+        before = self._water_info_cache
+        cache_water_info(self, board, env_cfg, forbidden)
+        checked["calls"] += 1
+        checked["skipped"] += before is not None and self._water_info_cache is before
+        grow, connected = compute_water_info(
+            WATER_INFO_DELTAS + self.pos.pos,
+            env_cfg.MIN_LICHEN_TO_SPREAD,
+            board.lichen,
+            board.lichen_strains,
+            board.factory_occupancy_map,
+            self.num_id,
+            lichen_growth_forbidden(board),
+        )
+        assert self.grow_lichen_positions == grow
+        assert self.connected_lichen_positions == connected
+
+    monkeypatch.setattr(Factory, "cache_water_info", checked_cache_water_info)
+
+    # no water consumption so factories survive and keep watering lichen
+    env = LuxAI_S2(collect_stats=True, verbose=0, FACTORY_WATER_CONSUMPTION=0)
+    obs, _ = env.reset(seed=seed)
+    rng = np.random.RandomState(seed)
+    for _ in range(300):
+        obs, _, terminations, _, _ = env.step(random_actions(obs, env, rng))
+        if terminations["player_0"] or terminations["player_1"]:
+            break
+
+    assert env.state.board.lichen.sum() > 0
+    # both the search and the cache were exercised
+    assert 0 < checked["skipped"] < checked["calls"]
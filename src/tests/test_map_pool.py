@@ -0,0 +1,34 @@
+'''
+Resets that load maps from a map pool must give the same games as resets that generate them.
+'''
+import numpy as np
+
+from luxai_s2 import LuxAI_S2
+from luxai_s2.map_generator.pool import MapPool, board_seed, generate_map_pool
+
+
+def test_map_pool_reset_matches_generated(tmp_path):
+    pool = generate_map_pool(str(tmp_path), range(3))
+    assert len(pool) == 3 and board_seed(0) in pool
+
+    env = LuxAI_S2(verbose=0)
+    pooled_env = LuxAI_S2(verbose=0, map_pool=str(tmp_path))
+    assert isinstance(pooled_env.map_pool, MapPool)
+    # seed 3 is not in the pool and gets generated
+    for seed in range(4):
+        obs, _ = env.reset(seed=seed)
+        pooled_obs, _ = pooled_env.reset(seed=seed)
+        for key, value in obs["player_0"]["board"].items():
+            np.testing.assert_array_equal(pooled_obs["player_0"]["board"][key], value)
+        assert pooled_env.state.board.map.symmetry == env.state.board.map.symmetry
+        assert pooled_env.state.board.rubble.dtype == env.state.board.rubble.dtype
+        # games go on from the same rng state
+        assert pooled_env.seed_rng.randint(1 << 30) == env.seed_rng.randint(1 << 30)
+
+
+def test_map_pool_other_map_size(tmp_path):
+    generate_map_pool(str(tmp_path), range(1), map_size=32)
+    # a pool for another map size is ignored
+    pooled_obs, _ = LuxAI_S2(verbose=0, map_pool=str(tmp_path)).reset(seed=0)
+    obs, _ = LuxAI_S2(verbose=0).reset(seed=0)
+    np.testing.assert_array_equal(pooled_obs["player_0"]["board"]["rubble"], obs["player_0"]["board"]["rubble"])
@@ -0,0 +1,86 @@
+'''
+PerEnvRollout must end up with the same data whatever order the envs' steps arrive in, RolloutBuffer must store the
+steps train.py writes into it, and gae_scan must give the advantages of gae_loop.
+'''
+import numpy as np
+import torch
+import tree
+
+from rollout import PerEnvRollout, RolloutBuffer, gae_loop, gae_scan
+
+
+def fill(rollout, order):
+    for env_ids in order:
+        env_ids = np.array(env_ids)
+        steps = torch.from_numpy(rollout.steps[env_ids]).float()
+        rollout.insert(env_ids, {
+            "obs": {"player_0": {"map_feature": (torch.from_numpy(env_ids).float() * 100 + steps)[:, None, None].repeat(1, 2, 3)}},
+            "logprobs": {"player_0": -steps[:, None].repeat(1, 4)},
+        })
+        rollout.advance(env_ids)
+        rollout.insert(env_ids, {"rewards": {"player_0": (steps + 0.5)[:, None].repeat(1, 4)}}, step_offset=-1)
+
+
+def test_out_of_order_matches_lockstep():
+    num_envs, num_steps = 3, 4
+    lockstep = PerEnvRollout(num_envs, num_steps)
+    fill(lockstep, [range(num_envs)] * num_steps)
+    shuffled = PerEnvRollout(num_envs, num_steps)
+    fill(shuffled, [[2], [0, 1], [0], [0], [2], [1, 2], [0, 2], [1], [1]])
+
+    assert lockstep.full and shuffled.full
+    assert shuffled.unfinished(range(num_envs)).size == 0
+    expected, actual = lockstep.step_major(), shuffled.step_major()
+    for key in ["obs", "logprobs", "rewards"]:
+        for leaf_expected, leaf_actual in zip(tree.flatten(expected[key]), tree.flatten(actual[key])):
+            torch.testing.assert_close(leaf_actual, leaf_expected)
+    map_feature = actual["obs"]["player_0"]["map_feature"]
+    assert map_feature.shape == (num_steps, num_envs, 2, 3) and map_feature.is_contiguous()
+    assert map_feature[3, 2, 0, 0] == 203
+
+    shuffled.reset()
+    assert not shuffled.full and shuffled.unfinished([0, 2]).tolist() == [0, 2]
+    assert shuffled.data["rewards"]["player_0"].abs().sum() == 0
+
+
+def test_rollout_buffer_stores_steps():
+    num_envs, num_steps = 3, 4
+    rng = np.random.default_rng(0)
+    obs = rng.random((num_steps + 1, num_envs, 2, 3))
+    done = rng.random((num_steps + 1, num_envs, 2, 5)) < 0.5
+    action = torch.from_numpy(rng.integers(0, 9, (num_steps, num_envs, 6)))
+    buffer = RolloutBuffer(num_steps, num_envs)
+    buffer.insert(0, {"obs": {"player_0": {"map_feature": obs[0]}}, "dones": {"player_0": done[0, :, 0], "player_1": done[0, :, 1]}}, dtype=torch.float32)
+    for step in range(num_steps):
+        buffer.insert(step, {"actions": {"player_0": {"unit_act": action[step]}}})
+        buffer.insert(step + 1, {"obs": {"player_0": {"map_feature": obs[step + 1]}}, "dones": {"player_0": done[step + 1, :, 0], "player_1": done[step + 1, :, 1]}})
+
+    data = buffer.data
+    map_feature = data["obs"]["player_0"]["map_feature"]
+    assert map_feature.dtype == torch.float32 and map_feature.is_contiguous()
+    torch.testing.assert_close(map_feature, torch.from_numpy(obs[:num_steps]).float())
+    torch.testing.assert_close(data["dones"]["player_1"], torch.from_numpy(done[:num_steps, :, 1]).float())
+    assert data["actions"]["player_0"]["unit_act"].dtype == torch.int64
+    assert torch.equal(data["actions"]["player_0"]["unit_act"], action)
+    torch.testing.assert_close(buffer.row(num_steps, "obs")["player_0"]["map_feature"], torch.from_numpy(obs[-1]).float())
+
+    # the next rollout starts from the last observations and dones
+    buffer.reset()
+    torch.testing.assert_close(buffer.row(0, "obs")["player_0"]["map_feature"], torch.from_numpy(obs[-1]).float())
+    torch.testing.assert_close(buffer.row(0, "dones")["player_0"], torch.from_numpy(done[-1, :, 0]).float())
+
+
+def test_gae_scan_matches_loop():
+    torch.manual_seed(0)
+    for num_steps in [1, 2, 3, 7, 64, 257]:
+        rewards = torch.randn(num_steps, 3, 5)
+        values = torch.randn(num_steps, 3, 5)
+        dones = (torch.rand(num_steps, 3, 5) < 0.05).float()
+        inputs = [x.clone() for x in (rewards, values, dones)]
+        expected = gae_loop(rewards, values, dones, 0.99, 0.95)
+        actual = gae_scan(rewards, values, dones, 0.99, 0.95)
+        torch.testing.assert_close(actual, expected, rtol=1e-5, atol=1e-5)
+        # the loop has no next value for the last step
+        assert (actual[-1] == 0).all()
+        for x, before in zip((rewards, values, dones), inputs):
+            assert torch.equal(x, before)
@@ -0,0 +1,218 @@
+'''
+SimpleNet must give the same log probs, values, entropies and deterministic actions with sparse per entity valid
+actions as with valid actions over the map, about the same ones in float32 under bf16 autocast, and the same ones
+compiled with the entities padded to buckets. The fused unit param heads must give the same ones as a pass of the heads
+per act type.
+'''
+import copy
+
+import numpy as np
+import pytest
+import torch
+import tree
+
+from luxenv import LuxEnv, valid_actions_to_torch
+from policy.simple_net import MIN_ENTITY_BUCKET, SimpleNet, entity_bucket
+
+np2torch = lambda x, dtype: torch.tensor(np.array(x)[None], dtype=dtype)
+
+max_entity_number = 500
+
+
+@pytest.fixture(scope="module")
+def net():
+    # layer names can only be seeded once, so there is one SimpleNet for all tests
+    return SimpleNet(max_entity_number, seed=0)
+
+
+def player_features(obs, player_id):
+    features = obs[f"player_{player_id}"]
+    return [
+        np2torch(features[name], torch.int32 if name == "location_feature" else torch.float32)
+        for name in ["global_feature", "map_feature", "factory_feature", "unit_feature", "location_feature"]
+    ]
+
+
+def test_sparse_valid_actions_match_dense(net):
+    env = LuxEnv(max_entity_number=max_entity_number)
+    env.current_seed = 0
+    obs, _ = env.reset()
+    torch.manual_seed(0)
+    n_units = 0
+    for step in range(40):
+        actions = {}
+        for player_id in range(2):
+            features = player_features(obs, player_id)
+            game_state = env.game_state[player_id]
+            dense = valid_actions_to_torch(env.action_parser.get_valid_actions(game_state, player_id), np2torch)
+            sparse = valid_actions_to_torch(
+                env.action_parser.get_sparse_valid_actions(game_state, player_id, max_entity_number), np2torch
+            )
+            n_units += len(game_state.units[f"player_{player_id}"])
+
+            net.eval()
+            with torch.no_grad():
+                dense_out = net(*features, dense, is_deterministic=True)
+                sparse_out = net(*features, sparse, is_deterministic=True)
+                for name, a, b in zip(["logp", "action", "entropy"], dense_out[::2] + dense_out[3:], sparse_out[::2] + sparse_out[3:]):
+                    tree.map_structure(lambda x, y: torch.testing.assert_close(x, y, msg=name), a, b)
+
+                # log probs and values of the same actions in training mode (spectral norm updates its state there)
+                _, _, action, _ = net(*features, dense)
+                train_dense, train_sparse = copy.deepcopy(net).train(), copy.deepcopy(net).train()
+                dense_out = train_dense(*features, dense, action)
+                sparse_out = train_sparse(*features, sparse, action)
+                for name, a, b in zip(["logp", "value", "entropy"], dense_out[:2] + dense_out[3:], sparse_out[:2] + sparse_out[3:]):
+                    torch.testing.assert_close(a, b, msg=name)
+            actions[player_id] = tree.map_structure(lambda x: x[0].numpy().astype(np.int32), action)
+        obs, _, _, _, _ = env.step(actions)
+    assert n_units > 0
+
+
+def test_bf16_autocast_matches_float32(net):
+    env = LuxEnv(max_entity_number=max_entity_number)
+    env.current_seed = 0
+    obs, _ = env.reset()
+    torch.manual_seed(0)
+    n_entities = 0
+    for step in range(40):
+        actions = {}
+        for player_id in range(2):
+            features = player_features(obs, player_id)
+            va = valid_actions_to_torch(env.action_parser.get_valid_actions(env.game_state[player_id], player_id), np2torch)
+            net.eval()
+            with torch.no_grad():
+                _, _, action, _ = net(*features, va)
+
+            float32, bf16 = copy.deepcopy(net).train(), copy.deepcopy(net).train()
+            bf16.bf16 = True
+            float32_out = float32(*features, va, action)
+            bf16_out = bf16(*features, va, action)
+            for name, a, b in zip(["logp", "value", "entropy"], float32_out[:2] + float32_out[3:], bf16_out[:2] + bf16_out[3:]):
+                assert b.dtype == torch.float32, name
+                torch.testing.assert_close(b, a, rtol=0.05, atol=1e-4, msg=name)
+            n_entities += int((bf16_out[0] != 0).sum())
+
+            # master weights and their gradients stay float32
+            (bf16_out[0].sum() + bf16_out[1].sum()).backward()
+            assert all(p.dtype == torch.float32 and (p.grad is None or p.grad.dtype == torch.float32) for p in bf16.parameters())
+
+            # actions sampled under autocast are valid ones, masked actions would have log probs around BIG_NEG
+            with torch.no_grad():
+                logp, _, _, _ = bf16(*features, va)
+            assert (logp > -100).all()
+            actions[player_id] = tree.map_structure(lambda x: x[0].numpy().astype(np.int32), action)
+        obs, _, _, _, _ = env.step(actions)
+    assert n_entities > 0
+
+
+def test_compiled_forward_matches_eager(net):
+    assert [entity_bucket(n) for n in [1, MIN_ENTITY_BUCKET, MIN_ENTITY_BUCKET + 1]] == [MIN_ENTITY_BUCKET, MIN_ENTITY_BUCKET, 2 * MIN_ENTITY_BUCKET]
+
+    env = LuxEnv(max_entity_number=max_entity_number)
+    env.current_seed = 0
+    obs, _ = env.reset()
+    torch.manual_seed(0)
+    # the eager backend traces the same graphs as inductor without its compile time
+    compiled = copy.deepcopy(net).compile_forward(backend="eager")
+    train_eager, train_compiled = copy.deepcopy(net).train(), copy.deepcopy(net).train().compile_forward(backend="eager")
+    n_entities = 0
+    for step in range(40):
+        actions = {}
+        for player_id in range(2):
+            features = player_features(obs, player_id)
+            va = valid_actions_to_torch(env.action_parser.get_valid_actions(env.game_state[player_id], player_id), np2torch)
+            net.eval()
+            compiled.eval()
+            with torch.no_grad():
+                eager_out = net(*features, va, is_deterministic=True)
+                compiled_out = compiled(*features, va, is_deterministic=True)
+                for name, a, b in zip(["logp", "action", "entropy"], eager_out[::2] + eager_out[3:], compiled_out[::2] + compiled_out[3:]):
+                    tree.map_structure(lambda x, y: torch.testing.assert_close(y, x, msg=name), a, b)
+                _, _, action, _ = net(*features, va)
+
+            # forced actions in training mode, the padding entities must not change the gradients
+            eager_out = train_eager(*features, va, action)
+            compiled_out = train_compiled(*features, va, action)
+            for name, a, b in zip(["logp", "value", "entropy"], eager_out[:2] + eager_out[3:], compiled_out[:2] + compiled_out[3:]):
+                torch.testing.assert_close(b, a, msg=name)
+            for model, out in [(train_eager, eager_out), (train_compiled, compiled_out)]:
+                model.zero_grad()
+                (out[0].sum() + out[1].sum() + out[3].sum()).backward()
+            for (name, a), b in zip(train_eager.named_parameters(), train_compiled.parameters()):
+                if a.grad is not None:
+                    torch.testing.assert_close(b.grad, a.grad, msg=name)
+            n_entities += int((compiled_out[0] != 0).sum())
+            actions[player_id] = tree.map_structure(lambda x: x[0].numpy().astype(np.int32), action)
+        obs, _, _, _, _ = env.step(actions)
+    assert n_entities > 0
+
+
+def per_type_unit_actor(net):
+    # net with the unit actor it is tested against
+    net.unit_actor = lambda x, va, action=None, is_deterministic=False: net.unit_actor_per_type(x, x, va, action, is_deterministic)
+    return net
+
+
+def test_fused_unit_heads_match_per_type(net):
+    env = LuxEnv(max_entity_number=max_entity_number)
+    env.current_seed = 0
+    obs, _ = env.reset()
+    torch.manual_seed(0)
+    per_type = per_type_unit_actor(copy.deepcopy(net))
+    fused_train, per_type_train = copy.deepcopy(net).train(), per_type_unit_actor(copy.deepcopy(net).train())
+    n_units = 0
+    for step in range(60):
+        actions = {}
+        for player_id in range(2):
+            features = player_features(obs, player_id)
+            va = valid_actions_to_torch(env.action_parser.get_valid_actions(env.game_state[player_id], player_id), np2torch)
+            n_units += len(env.game_state[player_id].units[f"player_{player_id}"])
+            net.eval()
+            per_type.eval()
+            with torch.no_grad():
+                fused_out = net(*features, va, is_deterministic=True)
+                per_type_out = per_type(*features, va, is_deterministic=True)
+                for name, a, b in zip(["logp", "action", "entropy"], per_type_out[::2] + per_type_out[3:], fused_out[::2] + fused_out[3:]):
+                    tree.map_structure(lambda x, y: torch.testing.assert_close(y, x, msg=name), a, b)
+                # sampled params are valid ones, masked ones would have log probs around BIG_NEG
+                logp, _, action, _ = net(*features, va)
+                assert (logp > -100).all()
+
+            fused_out = fused_train(*features, va, action)
+            per_type_out = per_type_train(*features, va, action)
+            for name, a, b in zip(["logp", "value", "entropy"], per_type_out[:2] + per_type_out[3:], fused_out[:2] + fused_out[3:]):
+                torch.testing.assert_close(b, a, msg=name)
+            for model, out in [(fused_train, fused_out), (per_type_train, per_type_out)]:
+                model.zero_grad()
+                (out[0].sum() + out[3].sum()).backward()
+            for (name, a), b in zip(per_type_train.named_parameters(), fused_train.parameters()):
+                if a.grad is not None:
+                    torch.testing.assert_close(b.grad, a.grad, msg=name)
+            actions[player_id] = tree.map_structure(lambda x: x[0].numpy().astype(np.int32), action)
+        obs, _, _, _, _ = env.step(actions)
+    assert n_units > 0
+
+
+def test_fused_unit_heads_match_per_type_for_all_act_types(net):
+    # the games above have no transfers or digs, random valid actions have units of every act type
+    torch.manual_seed(0)
+    n_units = 256
+    x = torch.randn(n_units, net.actor_dim) * 100
+    shapes = dict(move=(5, 2), transfer=(5, 5, 2), pickup=(5, 2), dig=(2,), self_destruct=(2,), recharge=(2,), do_nothing=())
+    va = {name: torch.rand((n_units,) + shape) < 0.6 for name, shape in shapes.items()}
+    va['act_type'] = torch.stack([va[name].flatten(1).any(1) if va[name].dim() > 1 else va[name] for name in shapes], dim=1)
+    # units without a valid action do nothing
+    none_valid = ~va['act_type'].any(1)
+    va['do_nothing'][none_valid] = True
+    va['act_type'][none_valid, -1] = True
+
+    with torch.no_grad():
+        _, action, _ = net.unit_actor(x, va)
+    assert set(action[:, 0].long().tolist()) == set(range(len(shapes)))
+    for kwargs in [dict(is_deterministic=True), dict(action=action.long())]:
+        fused = net.unit_actor(x, va, **kwargs)
+        per_type = net.unit_actor_per_type(x, x, va, **kwargs)
+        for name, a, b in zip(["logp", "action", "entropy"], per_type, fused):
+            torch.testing.assert_close(b, a, msg=name)
+    assert (fused[0] > -100).all()
@@ -0,0 +1,66 @@
+'''
+TeamStats counters must convert back to the nested stats dict they replace, and writes through the nested dict access
+must reach the counters.
+'''
+import copy
+
+import numpy as np
+import pytest
+
+from luxai_s2.state import STATS_INDEX, STATS_KEYS, StatsDictView, TeamStats, TeamStatsView, create_empty_stats
+
+
+def test_team_stats_to_dict():
+    stats = TeamStats()
+    assert stats.to_dict() == create_empty_stats()
+
+    expected = create_empty_stats()
+    for i, path in enumerate(STATS_KEYS):
+        stats.add(i, *path)
+        entry = expected
+        for k in path[:-1]:
+            entry = entry[k]
+        entry[path[-1]] += i
+    assert stats.to_dict() == expected
+    assert stats == expected
+    assert stats["generation"] == expected["generation"]
+
+
+def test_stats_dict_view_snapshot():
+    stats = dict(player_0=TeamStats(), player_1=TeamStats())
+    view = StatsDictView(stats)
+    snapshot = copy.deepcopy(view)
+    stats["player_0"].add(3, "generation", "ice", "HEAVY")
+    assert view["player_0"]["generation"]["ice"]["HEAVY"] == 3
+    assert snapshot["player_0"]["generation"]["ice"]["HEAVY"] == 0
+    assert list(view) == ["player_0", "player_1"]
+    np.testing.assert_array_equal(stats["player_1"].counters, 0)
+
+
+def test_team_stats_item_writes_reach_counters():
+    stats = TeamStats()
+    stats["destroyed"]["LIGHT"] += 1
+    stats["generation"]["ice"]["HEAVY"] += 5
+    stats["action_queue_updates_total"] += 2
+    generation = stats["generation"]
+    generation["power"]["FACTORY"] = 7
+    assert stats.counters[STATS_INDEX[("destroyed", "LIGHT")]] == 1
+    assert stats.counters[STATS_INDEX[("generation", "ice", "HEAVY")]] == 5
+    assert stats.counters[STATS_INDEX[("action_queue_updates_total",)]] == 2
+    assert stats.counters[STATS_INDEX[("generation", "power", "FACTORY")]] == 7
+    # views read the counters as they are now
+    stats.add(1, "generation", "power", "FACTORY")
+    assert generation["power"]["FACTORY"] == 8
+    assert generation.to_dict() == stats.to_dict()["generation"]
+    assert isinstance(generation, TeamStatsView) and isinstance(generation.to_dict()["power"], dict)
+
+    # the keys are the ones of the nested stats dict and fixed
+    assert set(stats["generation"]) == set(create_empty_stats()["generation"])
+    with pytest.raises(KeyError):
+        stats["generation"]["gold"] = 1
+    with pytest.raises(KeyError):
+        stats["generation"]["gold"]
+    with pytest.raises(TypeError):
+        stats["generation"]["ice"] = dict(LIGHT=1, HEAVY=1)
+    with pytest.raises(TypeError):
+        del stats["destroyed"]["LIGHT"]
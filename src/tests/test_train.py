@@ -0,0 +1,89 @@
+'''
+optimize_for_players must train on every minibatch, and a joint pass over both players must give every player the
+losses and stats of a pass over that player alone. A fixed seed train.py run under --bf16 must collect the same first
+rollout as the float32 run and train on it with about the same losses.
+'''
+import copy
+
+import pytest
+import torch
+
+from train import optimize_for_players
+
+PLAYERS = ["player_0", "player_1"]
+FEATURE_NAMES = ["global_feature", "map_feature", "factory_feature", "unit_feature", "location_feature"]
+max_entity_number = 6
+num_steps, num_envs = 4, 2
+
+
+class FakePolicy(torch.nn.Module):
+    """
+    log probs, values and entropies of every entity from the global features, each sample on its own
+    """
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.logp = torch.nn.Linear(3, max_entity_number)
+        self.value = torch.nn.Linear(3, max_entity_number)
+
+    def forward(self, global_feature, map_feature, factory_feature, unit_feature, location_feature, va, action=None, is_deterministic=False):
+        logp = -torch.nn.functional.softplus(self.logp(global_feature + action["unit_act"]))
+        return logp, self.value(global_feature), action, -logp
+
+
+def batch():
+    torch.manual_seed(1)
+    shape = (num_steps, num_envs)
+    obs = {player: {name: torch.randn(*shape, 3) for name in FEATURE_NAMES} for player in PLAYERS}
+    va = {player: {"unit_act": torch.ones(*shape, 3, dtype=torch.bool)} for player in PLAYERS}
+    actions = {player: {"unit_act": torch.randn(*shape, 3)} for player in PLAYERS}
+    per_entity = lambda: {player: torch.randn(num_steps * num_envs, max_entity_number) for player in PLAYERS}
+    logprobs = {player: -torch.rand(num_steps * num_envs, max_entity_number) - 0.1 for player in PLAYERS}
+    return obs, va, actions, logprobs, per_entity(), per_entity(), per_entity()
+
+
+def optimize(players, agent, optimizer, minibatch_size):
+    b_inds = torch.randperm(num_steps * num_envs, generator=torch.Generator().manual_seed(2))
+    return optimize_for_players(players, agent, optimizer, b_inds, *batch(), max_entity_number, num_steps * num_envs,
+                                minibatch_size, True, 0.2, True, 0.01, 0.5, 0.5, "cpu")
+
+
+def test_trains_on_every_minibatch():
+    agent = FakePolicy()
+    optimizer = torch.optim.Adam(agent.parameters(), lr=1e-3)
+    results = optimize(PLAYERS, agent, optimizer, minibatch_size=2)
+    assert optimizer.state[agent.logp.weight]["step"] == 4
+    for player in PLAYERS:
+        assert len(results[player][-1]) == 4
+
+
+@pytest.mark.parametrize("player", PLAYERS)
+def test_joint_losses_match_single_player(player):
+    agent = FakePolicy()
+    optimizer = torch.optim.Adam(agent.parameters(), lr=1e-3)
+    single_agent = copy.deepcopy(agent)
+    single_optimizer = torch.optim.Adam(single_agent.parameters(), lr=1e-3)
+
+    # one minibatch, so both passes see the same weights
+    joint = optimize(PLAYERS, agent, optimizer, minibatch_size=num_steps * num_envs)[player]
+    single = optimize([player], single_agent, single_optimizer, minibatch_size=num_steps * num_envs)[player]
+    for name, a, b in zip(["v_loss", "pg_loss", "entropy", "approx_kl", "old_approx_kl"], joint[:-1], single[:-1]):
+        torch.testing.assert_close(a, b, msg=name)
+    assert joint[-1] == pytest.approx(single[-1])
+
+
+def test_bf16_first_update_matches_float32(tmp_path, train, scalars):
+    args = ["--num-envs", "2", "--num-steps", "32", "--total-timesteps", "64", "--train-num-collect", "64",
+            "--num-minibatches", "2", "--update-epochs", "2", "--save-interval", "0"]
+    train(tmp_path / "fp32", *args)
+    train(tmp_path / "bf16", *args, "--bf16", "True")
+    logged = lambda name, tag: [value for _, value in scalars(tmp_path / name, tag)]
+
+    # the same rollout: actions sampled under bf16 are the ones sampled in float32
+    for tag in ["losses/num_agents_total", "losses/logprob_total", "charts/episodic_total_return"]:
+        assert logged("bf16", tag) == pytest.approx(logged("fp32", tag), rel=1e-5), tag
+    assert logged("bf16", "losses/return_total") == pytest.approx(logged("fp32", "losses/return_total"), rel=1e-3)
+    # the losses of every minibatch, the policy loss of advantages normalized per minibatch
+    for tag, rel, abs in [("losses/entropy_total", 1e-3, 0), ("losses/value_loss_total", 5e-2, 0),
+                          ("losses/policy_loss_total", 0, 2e-2), ("losses/explained_variance_total", 0, 1e-2)]:
+        assert logged("bf16", tag) == pytest.approx(logged("fp32", tag), rel=rel, abs=abs), tag
@@ -0,0 +1,182 @@
+'''
+LuxSyncVectorEnv must give the same observations, rewards, terminations, truncations and valid actions whichever way
+the results get from the workers, pickled through the pipes or written to shared memory, and however the envs are
+grouped into worker processes or stepped out of order with step_async_envs and step_wait_any.
+'''
+import numpy as np
+import pytest
+import tree
+from gymnasium.error import AlreadyPendingCallError
+from gymnasium.vector.utils import concatenate, create_empty_array
+
+from luxenv import LuxSyncVectorEnv, SharedArrays
+from utils import make_env
+
+max_entity_number = 500
+num_steps = 4
+
+
+def make_envs(num_envs, **kwargs):
+    return LuxSyncVectorEnv([make_env(i, i, None, max_entity_number=max_entity_number) for i in range(num_envs)], **kwargs)
+
+
+def sampled_actions(num_envs, seed=0):
+    """
+    the actions of every env at every step, [step][env]
+    """
+    space = make_env(0, 0, None, max_entity_number=max_entity_number)().action_space
+    space.seed(seed)
+    to_int = lambda action: tree.map_structure(lambda x: x.astype(np.int32), action)
+    return [[to_int(space.sample()) for _ in range(num_envs)] for _ in range(num_steps)]
+
+
+def batch(envs, actions):
+    space = envs.single_action_space
+    return tree.map_structure(
+        lambda x: x.astype(np.int32), concatenate(space, actions, create_empty_array(space, n=len(actions), fn=np.zeros))
+    )
+
+
+def results_with_valid_actions(envs, results):
+    # copies, the vector env reuses its arrays for the next call
+    copy = lambda x: tree.map_structure(np.copy, x)
+    return copy(list(results)) + [copy(envs.get_valid_actions(player_id)) for player_id in range(2)]
+
+
+def play(num_envs, actions, **kwargs):
+    """
+    the reset and step results of lockstep play, each with the valid actions of both players
+    """
+    envs = make_envs(num_envs, **kwargs)
+    try:
+        obs, _ = envs.reset(seed=0)
+        history = [results_with_valid_actions(envs, [obs])]
+        for step_actions in actions:
+            obs, reward, termination, truncation, _ = envs.step(batch(envs, step_actions))
+            history.append(results_with_valid_actions(envs, [obs, reward, termination, truncation]))
+        return history
+    finally:
+        envs.close()
+
+
+def assert_same_history(expected, actual):
+    assert len(expected) == len(actual)
+    for step, (expected_results, actual_results) in enumerate(zip(expected, actual)):
+        assert len(expected_results) == len(actual_results)
+        for expected_result, actual_result in zip(expected_results, actual_results):
+            tree.map_structure(
+                lambda x, y: np.testing.assert_array_equal(x, y, err_msg=f"step {step}"), expected_result, actual_result
+            )
+
+
+def test_shared_memory_matches_pipes():
+    num_envs = 3
+    actions = sampled_actions(num_envs)
+    assert_same_history(play(num_envs, actions), play(num_envs, actions, shared_memory=True))
+
+
+@pytest.mark.parametrize("shared_memory", [False, True])
+def test_uneven_worker_groups_match_one_env_per_worker(shared_memory):
+    num_envs = 5
+    actions = sampled_actions(num_envs)
+    envs = make_envs(num_envs, envs_per_worker=2)
+    try:
+        assert envs.env_slices == [slice(0, 2), slice(2, 4), slice(4, 5)]
+        assert envs.env_workers.tolist() == [0, 0, 1, 1, 2]
+    finally:
+        envs.close()
+    assert_same_history(
+        play(num_envs, actions), play(num_envs, actions, envs_per_worker=2, shared_memory=shared_memory)
+    )
+
+
+def env_results(history, step, env_id):
+    return tree.map_structure(lambda x: x[env_id], history[step])
+
+
+def play_out_of_order(num_envs, actions, rng, **kwargs):
+    """
+    steps random sets of worker groups, each env with its own actions in its own order, and returns the results
+    step_wait_any gave for each env and step, (step, env_id, results with the valid actions of both players)
+    """
+    envs = make_envs(num_envs, **kwargs)
+    try:
+        envs.reset(seed=0)
+        steps = np.zeros(num_envs, dtype=int)
+        pending, returned = set(), []
+        while (steps < len(actions)).any() or pending:
+            idle = [worker for worker, env_slice in enumerate(envs.env_slices)
+                    if worker not in pending and steps[env_slice.start] < len(actions)]
+            if idle:
+                workers = rng.choice(idle, size=rng.integers(1, len(idle) + 1), replace=False)
+                env_ids = np.concatenate([np.arange(envs.env_slices[worker].start, envs.env_slices[worker].stop) for worker in workers])
+                envs.step_async_envs(batch(envs, [actions[steps[env_id]][env_id] for env_id in env_ids]), env_ids)
+                pending.update(workers.tolist())
+            if not pending:
+                continue
+            pending_envs = sum(envs.env_slices[worker].stop - envs.env_slices[worker].start for worker in pending)
+            min_envs = int(rng.integers(1, num_envs + 1))
+            max_wait = [None, 0.0, 0.01][rng.integers(3)]
+            env_ids, obs, reward, termination, truncation, _ = envs.step_wait_any(min_envs, max_wait=max_wait)
+            assert len(env_ids) > 0
+            if max_wait is None:
+                assert len(env_ids) >= min(min_envs, pending_envs)
+            valid_actions = [envs.get_valid_actions(player_id, env_ids) for player_id in range(2)]
+            pending.difference_update(envs.env_workers[env_ids].tolist())
+            for i, env_id in enumerate(env_ids):
+                steps[env_id] += 1
+                # no copies, the results must stay as they were while the other envs keep stepping
+                results = tree.map_structure(lambda x: x[i], [obs, reward, termination, truncation] + valid_actions)
+                returned.append((steps[env_id], env_id, results))
+        return returned
+    finally:
+        envs.close()
+
+
+@pytest.mark.parametrize("shared_memory", [False, True])
+@pytest.mark.parametrize("seed", range(2))
+def test_out_of_order_steps_match_lockstep(shared_memory, seed):
+    num_envs = 5
+    actions = sampled_actions(num_envs, seed)
+    expected = play(num_envs, actions)
+    returned = play_out_of_order(
+        num_envs, actions, np.random.default_rng(seed), envs_per_worker=2, shared_memory=shared_memory
+    )
+    assert sorted((step, env_id) for step, env_id, _ in returned) == [
+        (step, env_id) for step in range(1, num_steps + 1) for env_id in range(num_envs)
+    ]
+    for step, env_id, results in returned:
+        assert_same_history([env_results(expected, step, env_id)], [results])
+
+
+@pytest.mark.parametrize("shared_memory", [False, True])
+def test_step_async_envs_steps_whole_worker_groups(shared_memory):
+    num_envs = 3
+    actions = sampled_actions(num_envs)[0]
+    envs = make_envs(num_envs, envs_per_worker=2, shared_memory=shared_memory)
+    try:
+        envs.reset(seed=0)
+        # env 1 is stepped by the same worker as env 0
+        with pytest.raises(ValueError):
+            envs.step_async_envs(batch(envs, actions[:1]), [0])
+        assert not envs.pending_workers
+        envs.step_async_envs(batch(envs, actions[:2]), [0, 1])
+        with pytest.raises(AlreadyPendingCallError):
+            envs.step_async_envs(batch(envs, actions), [0, 1, 2])
+        env_ids, *_ = envs.step_wait_any()
+        assert env_ids.tolist() == [0, 1]
+    finally:
+        envs.close()
+
+
+def test_shared_arrays_outlive_close():
+    shared_arrays = SharedArrays({"reward": np.zeros((2, 3), dtype=np.float32)}, 4)
+    reward = shared_arrays.arrays["reward"][1]
+    reward[:] = 5
+    shared_arrays.close(unlink=True)
+    # the block stays mapped while an array points to it
+    np.testing.assert_array_equal(reward, 5)
+    # and can be closed once none does
+    del reward
+    for block in shared_arrays.blocks:
+        block.close()
@@ -1,8 +1,7 @@
-%%writefile src/train.py
-
 import argparse
 import os
 import random
+import socket
 import time
 from distutils.util import strtobool
 import sys
@@ -15,12 +14,17 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.tensorboard import SummaryWriter
 from policy.net import Net
-from policy.simple_net import SimpleNet, create_embedding_trace
-from luxenv import LuxSyncVectorEnv
+from policy.simple_net import SimpleNet
+from luxenv import LuxSyncVectorEnv, valid_actions_to_torch
+from rollout import PerEnvRollout, RolloutBuffer, gae_loop, gae_scan
+from inference import InferenceServer
 import tree
-from utils import save_args, save_model, cal_mean_return, make_env
+from utils import save_args, cal_mean_return, make_env
+from checkpoint import CheckpointWriter, load_checkpoint
 import gc
 from pprint import pprint
 import copy
@@ -31,9 +35,10 @@ import logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s %(module)s %(funcName)s %(message)s',
                     handlers=[logging.StreamHandler()])
-stream_handler = [h for h in logging.root.handlers if isinstance(h , logging.StreamHandler)][0]
-stream_handler.setLevel(logging.INFO)
-stream_handler.setStream(sys.stderr)
+# the handler basicConfig added, not the subclasses others (pytest) attach to the root logger
+for stream_handler in [h for h in logging.root.handlers if type(h) is logging.StreamHandler]:
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setStream(sys.stderr)
 logger = logging.getLogger("train")
 
 import warnings
@@ -110,20 +115,44 @@ def parse_args():
         help="the learning rate of the optimizer")
     parser.add_argument("--num-envs", type=int, default=16,
         help="the number of parallel game environments")
+    parser.add_argument("--num-ranks", type=int, default=1,
+        help="the number of data parallel learner processes started on this machine, each with its own envs, whose gradients are all-reduced over gloo. Under torchrun the ranks are torchrun's")
+    parser.add_argument("--envs-per-worker", type=int, default=1,
+        help="the number of game environments each worker process steps")
+    parser.add_argument("--shared-memory", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the env workers write their results to shared memory instead of sending them through pipes")
     parser.add_argument("--num-steps", type=int, default=256,
         help="the number of steps to run in each environment per policy rollout")
+    parser.add_argument("--async-envs", type=int, default=0,
+        help="if positive, sample actions as soon as this many environments are done stepping instead of waiting for all of them")
+    parser.add_argument("--inference-server", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="experimental: if toggled, a process of its own steps the envs and samples their actions while this process trains, with the policy at most one update behind. Only measured on one cpu so far, where it is slower than the lockstep rollouts")
+    parser.add_argument("--inference-max-wait", type=float, default=0.01,
+        help="the seconds the inference server waits for --async-envs envs (all envs if 0) after the first one is done stepping")
+    parser.add_argument("--sparse-valid-actions", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, valid actions are sent, stored and used as per entity masks instead of masks over the map")
+    parser.add_argument("--bf16", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the model runs under bf16 autocast in rollouts and training, with float32 weights. benchmarks/bench_bf16_ppo.py compares fixed seed runs against float32")
+    parser.add_argument("--compile", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the model forward runs torch.compile'd in rollouts and training, entity counts padded to buckets")
+    parser.add_argument("--pin-memory", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the rollout is stored in pinned memory for faster copies to cuda")
     parser.add_argument("--anneal-lr", type=lambda x: bool(strtobool(x)), default=True, nargs="?", const=True,
         help="Toggle learning rate annealing for policy and value networks")
     parser.add_argument("--gamma", type=float, default=0.99,
         help="the discount factor gamma")
     parser.add_argument("--gae-lambda", type=float, default=0.95,
         help="the lambda for the general advantage estimation")
+    parser.add_argument("--gae-impl", type=str, default="loop", choices=["scan", "loop"],
+        help="compute the advantages one step at a time (loop) or for all steps at once on the model device (scan). The loop is faster on cpu, the scan is not benchmarked on cuda yet")
     parser.add_argument("--train-num-collect", type=int, default=4096,
         help="the number of data collections in training process")
     parser.add_argument("--num-minibatches", type=int, default=8,
         help="the number of mini-batches")
     parser.add_argument("--update-epochs", type=int, default=10,
         help="the K epochs to update the policy")
+    parser.add_argument("--joint-players", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, both players are optimized in one pass over minibatches holding the data of both instead of one pass per player")
     parser.add_argument("--norm-adv", type=lambda x: bool(strtobool(x)), default=True, nargs="?", const=True,
         help="Toggles advantages normalization")
     parser.add_argument("--clip-coef", type=float, default=0.2,
@@ -140,12 +169,18 @@ def parse_args():
         help="the target KL divergence threshold")
     parser.add_argument("--save-interval", type=int, default=4096,
         help="global step interval to save model")
+    parser.add_argument("--save-dir", type=str, default=None,
+        help="the folder of the run's models, checkpoints and logs, runs/<run name> if not set")
+    parser.add_argument("--keep-checkpoints", type=int, default=3,
+        help="the number of newest checkpoints kept in the save dir, all of them if 0")
+    parser.add_argument("--resume", type=str, default=None,
+        help="a checkpoint, or a folder to take the newest checkpoint of, to continue training from. The other arguments must be the ones of the run that wrote it")
     parser.add_argument("--load-model-path", type=str, default=None,
         help="path for pretrained model loading")
     parser.add_argument("--replay-dir", type=str, default=None,
         help="replay dirs to reset state")
     parser.add_argument("--evaluate-interval", type=int, default=4096,
-        help="evaluation steps")
+        help="evaluation steps, no evaluation at all if 0")
     parser.add_argument("--evaluate-num", type=int, default=12,
         help="evaluation numbers")
 
@@ -173,6 +208,9 @@ def parse_args():
     args.minibatch_size = int(args.train_num_collect // args.num_minibatches)
     # how many steps to stop at when collecting data
     args.max_train_step = int(args.train_num_collect // args.num_envs)
+    if args.async_envs or args.inference_server:
+        # envs run ahead of each other, so a rollout can only be cut when every env reached its last step
+        assert args.max_train_step == args.num_steps, "--async-envs and --inference-server need train-num-collect == num-envs * num-steps"
 
     logger.info(args)
     return args
@@ -184,68 +222,28 @@ def layer_init(layer, std: float = np.sqrt(2), bias_const: float = 0.0):
     return layer
 
 
-def put_into_store(data: dict, ind: int, store: dict, max_train_step: int, num_envs: int, device: Union[torch.device, str]):
-    for key, value in data.items():
-        if isinstance(value, dict):
-            if key not in store:
-                store[key] = {}
-            put_into_store(value, ind, store[key], max_train_step, num_envs, device)
-        else:
-            if key not in store:
-                store[key] = torch.zeros((max_train_step, num_envs) + value.shape[1:], device=device, dtype=value.dtype)
-            store[key][ind] = value
-
-
-def reset_store(store: dict):
-    for key, value in store.items():
-        if isinstance(value, dict):
-            reset_store(store[key])
-        else:
-            if store[key].dtype in {torch.float32, torch.float64, torch.int32, torch.int64}:
-                store[key][:] = 0
-            elif store[key].dtype in {torch.bool}:
-                store[key][:] = False
-            else:
-                raise NotImplementedError(f"store[key].dtype={store[key].dtype}")
+def per_player(x: Union[np.ndarray, torch.Tensor]) -> dict:
+    """
+    split an [env, player, ...] array into views per player
+    """
+    return dict(player_0=x[:, 0], player_1=x[:, 1])
 
 
-def create_model(device: Union[torch.device, str], load_model_path: Union[str, None], learning_rate: float, max_entity_number: int, seed: int):
+def create_model(device: Union[torch.device, str], load_model_path: Union[str, None], learning_rate: float, max_entity_number: int, seed: int, bf16: bool = False, compile: bool = False):
     """
     Create the model
     """
-    agent = SimpleNet(max_entity_number, seed).to(device)
+    agent = SimpleNet(max_entity_number, seed, bf16=bf16).to(device)
     if load_model_path is not None:
         agent.load_state_dict(torch.load(load_model_path))
         print('load successfully')
+    if compile:
+        agent.compile_forward()
 
     optimizer = optim.Adam(agent.parameters(), lr=learning_rate, eps=1e-5)
     return agent, optimizer
 
 
-def create_traced_model(agent: Net, obs: TensorPerPlayer, envs: LuxSyncVectorEnv, device: Union[torch.device, str]):
-    valid_action = envs.get_valid_actions(0)
-    valid_action = tree.map_structure(lambda x: np2torch(x, torch.bool), valid_action)
-    obs = obs['player_0']
-
-    traced_model = copy.deepcopy(agent)
-    traced_model.eval()
-    actor_embedding = traced_model.embedding_actor
-    value_embedding = traced_model.embedding_value
-
-    gobal_feature = obs['global_feature'].to(device)
-    map_feature = obs['map_feature'].to(device)
-    factory_feature = obs['factory_feature'].to(device)
-    unit_feature = obs['unit_feature'].to(device)
-
-    actor_embedding_trace = create_embedding_trace(actor_embedding, gobal_feature, map_feature, factory_feature, unit_feature)
-    value_embedding_trace = create_embedding_trace(value_embedding, gobal_feature, map_feature, factory_feature, unit_feature)
-
-    traced_model.embedding_actor = actor_embedding_trace
-    traced_model.embedding_value = value_embedding_trace
-
-    return traced_model
-
-
 def sample_action_for_player(agent: Net, obs: TensorPerKey, valid_action: TensorPerKey, device: Union[torch.device, str], forced_action: Union[TensorPerKey, None] = None):
     """
     Sample action and value from the agent
@@ -267,10 +265,11 @@ def sample_actions_for_players(envs: LuxSyncVectorEnv,
                                agent: Net,
                                next_obs: TensorPerPlayer,
                                model_device: Union[torch.device, str],
-                               store_device: Union[torch.device, str]
+                               store_device: Union[torch.device, str],
+                               env_ids: Union[np.ndarray, None] = None
                                ) -> tuple[TensorPerPlayer, TensorPerPlayer, TensorPerPlayer, TensorPerPlayer]:
     """
-    Sample action and value for both players
+    Sample action and value for both players, in all envs or only in env_ids when next_obs holds just those envs
     """
     action = dict()
     valid_action = dict()
@@ -279,8 +278,8 @@ def sample_actions_for_players(envs: LuxSyncVectorEnv,
 
     for player_id, player in enumerate(['player_0', 'player_1']):
         with torch.no_grad():
-            _valid_action = envs.get_valid_actions(player_id)
-            _valid_action = tree.map_structure(lambda x: np2torch(x, torch.bool), _valid_action)
+            _valid_action = envs.get_valid_actions(player_id) if env_ids is None else envs.get_valid_actions(player_id, env_ids)
+            _valid_action = valid_actions_to_torch(_valid_action, np2torch)
 
             _logprob, _value, _action, _ = sample_action_for_player(agent, next_obs[player], _valid_action, model_device, None)
 
@@ -292,11 +291,101 @@ def sample_actions_for_players(envs: LuxSyncVectorEnv,
     return action, valid_action, logprob, value
 
 
-def calculate_returns(envs: LuxSyncVectorEnv,
-                      agent: Net,
-                      next_obs: TensorPerKey,
-                      next_done: torch.Tensor,
-                      dones: torch.Tensor,
+def collect_rollout_async(envs: LuxSyncVectorEnv,
+                          agent: Net,
+                          rollout: PerEnvRollout,
+                          next_obs: TensorPerPlayer,
+                          min_envs: int,
+                          max_entity_number: int,
+                          model_device: Union[torch.device, str],
+                          store_device: Union[torch.device, str]
+                          ) -> tuple[TensorPerPlayer, torch.Tensor, list[float], list[float], dict]:
+    """
+    Collect rollout.num_steps steps of every env, sampling actions for whichever `min_envs` or more envs are done
+    stepping instead of waiting for the slowest one. Returns the last observations and dones of all envs and the
+    episode returns, episode lengths and summed global info of the first episode of every env
+    """
+    num_envs = rollout.num_envs
+    next_done = torch.zeros((num_envs, 2, max_entity_number), device=store_device, dtype=torch.bool)
+
+    # Init stats
+    episode_return = np.zeros(num_envs)
+    episode_return_list = []
+    step_counts = np.zeros(num_envs)
+    episode_lengths = []
+    global_info_save = {}
+    first_episode = np.ones(num_envs, dtype=bool)
+
+    ready_ids, ready_obs, ready_done = np.arange(num_envs), next_obs, next_done
+    while True:
+        if len(ready_ids):
+            # Sample actions for the envs that are done stepping and send them their next step
+            action, valid_action, logprob, value = sample_actions_for_players(envs, agent, ready_obs, model_device, store_device, ready_ids)
+            rollout.insert(ready_ids, {
+                "obs": ready_obs,
+                "actions": action,
+                "valid_actions": valid_action,
+                "logprobs": logprob,
+                "values": value,
+                "dones": {player: ready_done[:, player_id].float() for player_id, player in enumerate(['player_0', 'player_1'])},
+            })
+            rollout.advance(ready_ids)
+            _action = {player_id: action[player] for player_id, player in enumerate(['player_0', 'player_1'])}
+            envs.step_async_envs(tree.map_structure(lambda x: torch2np(x, np.int32), _action), ready_ids)
+        if not envs.pending_workers:
+            break
+
+        env_ids, obs, reward, terminated, truncation, info = envs.step_wait_any(min_envs)
+        obs = tree.map_structure(lambda x: np2torch(x, torch.float32), obs)
+        done = terminated | truncation
+        _done = done.all(axis=-1).any(-1)
+        # the last step of an env ends its episodes for the stats, like the last step of the synchronous rollout
+        _done[rollout.steps[env_ids] == rollout.num_steps] = True
+        done = np2torch(done, torch.bool)
+
+        # Save rewards for PPO, for the step the envs advanced from
+        rewards = np2torch(reward, torch.float32)
+        rollout.insert(env_ids, {"rewards": {player: rewards[:, player_id] for player_id, player in enumerate(['player_0', 'player_1'])}}, step_offset=-1)
+
+        _env_ids = np2torch(env_ids, torch.long)
+        for player in ['player_0', 'player_1']:
+            for key, value in obs[player].items():
+                next_obs[player][key][_env_ids] = value
+        next_done[_env_ids] = done
+
+        # reward is shape (env, player, group)
+        episode_return[env_ids] += np.mean(np.sum(reward, axis=-1), axis=-1)
+        step_counts[env_ids] += 1
+
+        # Save global info
+        for key in log_from_global_info:
+            for env_id in env_ids:
+                if not first_episode[env_id]:
+                    continue
+                for player in ["player_0", "player_1"]:
+                    for group in [player, "total"]:
+                        global_info_save.setdefault(group, {}).setdefault(key, 0)
+                        global_info_save[group][key] += info[player][env_id][key]
+
+        # Save stats
+        for env_id in env_ids[_done]:
+            if first_episode[env_id]:
+                episode_return_list.append(episode_return[env_id])
+                episode_lengths.append(step_counts[env_id])
+            episode_return[env_id] = 0
+            step_counts[env_id] = 0
+            first_episode[env_id] = False
+
+        unfinished = rollout.steps[env_ids] < rollout.num_steps
+        ready_ids = env_ids[unfinished]
+        _unfinished = torch.from_numpy(unfinished)
+        ready_obs = tree.map_structure(lambda x: x[_unfinished], obs)
+        ready_done = done[_unfinished]
+
+    return next_obs, next_done, episode_return_list, episode_lengths, global_info_save
+
+
+def calculate_returns(dones: torch.Tensor,
                       rewards: TensorPerKey,
                       values: TensorPerKey,
                       max_train_step: int,
@@ -305,29 +394,22 @@ def calculate_returns(envs: LuxSyncVectorEnv,
                       gamma: float,
                       gae_lambda: float,
                       model_device: Union[torch.device, str],
-                      store_device: Union[torch.device, str]
+                      gae_impl: str = "loop"
                       ) -> tuple[dict[str, torch.Tensor], dict[str, torch.Tensor]]:
     """
-    Calculate GAE returns
+    Calculate GAE returns, with the per step gae_loop or gae_scan on the model device. The last step of the rollout
+    gets no advantage, so the value of the observation after it is not needed
     """
     returns = dict(player_0=torch.zeros((max_train_step, num_envs, max_entity_number)).to("cpu"),player_1=torch.zeros((max_train_step, num_envs, max_entity_number)).to("cpu"))
     advantages = dict(player_0=torch.zeros((max_train_step, num_envs, max_entity_number)).to("cpu"),player_1=torch.zeros((max_train_step, num_envs, max_entity_number)).to("cpu"))
     with torch.no_grad():
-        _, _, _, value = sample_actions_for_players(envs, agent, next_obs, model_device, store_device)
-
         for player in ['player_0', 'player_1']:
-            next_value = value[player]
-            next_value = next_value.reshape(1,-1)
-            lastgaelam = 0
-            for t in reversed(range(max_train_step-1)):
-                if t == max_train_step - 1:
-                    nextnonterminal = 1.0 - next_done
-                    nextvalues = next_value
-                else:
-                    nextnonterminal = 1.0 - dones[player][t + 1]
-                    nextvalues = values[player][t + 1]
-                delta = rewards[player][t] + gamma * nextvalues * nextnonterminal - values[player][t]
-                advantages[player][t] = lastgaelam = delta + gamma * gae_lambda * nextnonterminal * lastgaelam
+            if gae_impl == "scan":
+                advantages[player] = gae_scan(
+                    rewards[player].to(model_device), values[player].to(model_device), dones[player].to(model_device), gamma, gae_lambda
+                ).to("cpu")
+            else:
+                advantages[player] = gae_loop(rewards[player], values[player], dones[player], gamma, gae_lambda).to("cpu")
             returns[player] = advantages[player] + values[player]
 
     return returns, advantages
@@ -428,68 +510,91 @@ def calculate_loss(advantages: torch.Tensor,
     return loss, pg_loss, entropy_loss, v_loss
 
 
-def optimize_for_player(player: str,
-                        agent: Net,
-                        optimizer: optim.Optimizer,
-                        b_inds: torch.Tensor,
-                        b_obs: dict[str, list[torch.Tensor]],
-                        b_va: dict[str, list[torch.Tensor]],
-                        b_actions: dict[str, list[torch.Tensor]],
-                        b_logprobs: dict[str, list[torch.Tensor]],
-                        b_advantages: dict[str, list[torch.Tensor]],
-                        b_returns: dict[str, list[torch.Tensor]],
-                        b_values: dict[str, list[torch.Tensor]],
-                        max_entity_number: int,
-                        train_num_collect: int,
-                        minibatch_size: int,
-                        clip_vloss: bool,
-                        clip_coef: float,
-                        norm_adv: bool,
-                        ent_coef: float,
-                        vf_coef: float,
-                        max_grad_norm: float,
-                        device: Union[torch.device, str]
-                        ) -> tuple[float, float, float, float, float, list[float]]:
+def optimize_for_players(players: list[str],
+                         agent: Net,
+                         optimizer: optim.Optimizer,
+                         b_inds: torch.Tensor,
+                         b_obs: dict[str, list[torch.Tensor]],
+                         b_va: dict[str, list[torch.Tensor]],
+                         b_actions: dict[str, list[torch.Tensor]],
+                         b_logprobs: dict[str, list[torch.Tensor]],
+                         b_advantages: dict[str, list[torch.Tensor]],
+                         b_returns: dict[str, list[torch.Tensor]],
+                         b_values: dict[str, list[torch.Tensor]],
+                         max_entity_number: int,
+                         train_num_collect: int,
+                         minibatch_size: int,
+                         clip_vloss: bool,
+                         clip_coef: float,
+                         norm_adv: bool,
+                         ent_coef: float,
+                         vf_coef: float,
+                         max_grad_norm: float,
+                         device: Union[torch.device, str]
+                         ) -> dict[str, tuple[float, float, float, float, float, list[float]]]:
     """
-    Update weights for a player with PPO
+    Update weights for players with PPO. The minibatches of all players are folded into the batch dimension, so each
+    one is a single forward and backward pass and optimizer step on the mean of the players' losses. Returns the means
+    over the minibatches of the losses and stats of every player, with the clip fractions of all minibatches
     """
-    clipfracs = []
+    num_players = len(players)
+    # [step * env, ...] views of every player's data
+    b_data = tree.map_structure(
+        lambda x: x.view(-1, *x.shape[2:]),
+        {key: {player: b[player] for player in players} for key, b in [("obs", b_obs), ("va", b_va), ("actions", b_actions)]},
+    )
+    # the same minibatch of every player, concatenated along the batch dimension
+    fold = lambda *xs: (xs[0][mb_inds] if len(xs) == 1 else torch.cat([x[mb_inds] for x in xs])).to(device)
+    clipfracs = {player: [] for player in players}
+    stats = {player: [] for player in players}
     for start in range(0, train_num_collect, minibatch_size):
         end = start + minibatch_size
         mb_inds = b_inds[start:end]
 
-        mb_obs = tree.map_structure(lambda x: (x.view(-1, *x.shape[2:])[mb_inds]).to(device), b_obs[player])
-        mb_va = tree.map_structure(lambda x: (x.view(-1, *x.shape[2:])[mb_inds]).to(device), b_va[player])
-        mb_actions = tree.map_structure(lambda x: (x.view(-1, *x.shape[2:])[mb_inds]).to(device), b_actions[player])
-        mb_logprobs = (b_logprobs[player][mb_inds]).to(device)
-        mb_returns = (b_returns[player][mb_inds]).to(device)
-        mb_values = (b_values[player][mb_inds]).to(device)
+        mb_obs = tree.map_structure(fold, *[b_data["obs"][player] for player in players])
+        mb_va = tree.map_structure(fold, *[b_data["va"][player] for player in players])
+        mb_actions = tree.map_structure(fold, *[b_data["actions"][player] for player in players])
 
         newlogprob, newvalue, _, entropy = sample_action_for_player(agent, mb_obs, mb_va, device, mb_actions)
+        newlogprob = newlogprob.chunk(num_players)
+        newvalue = newvalue.view(-1, max_entity_number).chunk(num_players)
+        entropy = entropy.chunk(num_players)
+
+        results = {}
+        for player_id, player in enumerate(players):
+            mb_logprobs = (b_logprobs[player][mb_inds]).to(device)
+            mb_returns = (b_returns[player][mb_inds]).to(device)
+            mb_values = (b_values[player][mb_inds]).to(device)
+
+            logratio = newlogprob[player_id] - mb_logprobs
+            ratio = logratio.exp()
+
+            with torch.no_grad():
+                old_approx_kl = (-logratio).mean()
+                approx_kl = ((ratio - 1) - logratio).mean()
+                clipfracs[player] += [((ratio - 1.0).abs() > clip_coef).float().mean().item()]
+
+            mb_advantages = (b_advantages[player][mb_inds]).to(device)
+            if norm_adv:
+                if len(mb_inds)==1:
+                    mb_advantages = mb_advantages
+                else:
+                    mb_advantages = (mb_advantages - mb_advantages.mean()) / (mb_advantages.std() + 1e-8)
 
-        logratio = newlogprob - mb_logprobs
-        ratio = logratio.exp()
+            loss, pg_loss, entropy_loss, v_loss = calculate_loss(mb_advantages, mb_returns, mb_values, newvalue[player_id], entropy[player_id], mb_logprobs, ratio, max_entity_number, clip_vloss, clip_coef, ent_coef, vf_coef)
+            results[player] = (loss, v_loss, pg_loss, entropy_loss, approx_kl, old_approx_kl)
 
-        with torch.no_grad():
-            old_approx_kl = (-logratio).mean()
-            approx_kl = ((ratio - 1) - logratio).mean()
-            clipfracs += [((ratio - 1.0).abs() > clip_coef).float().mean().item()]
-
-        mb_advantages = (b_advantages[player][mb_inds]).to(device)
-        if norm_adv:
-            if len(mb_inds)==1:
-                mb_advantages = mb_advantages
-            else:
-                mb_advantages = (mb_advantages - mb_advantages.mean()) / (mb_advantages.std() + 1e-8)
-
-        loss, pg_loss, entropy_loss, v_loss = calculate_loss(mb_advantages, mb_returns, mb_values, newvalue, entropy, mb_logprobs, ratio, max_entity_number, clip_vloss, clip_coef, ent_coef, vf_coef)
+        loss = sum(result[0] for result in results.values()) / num_players
 
         optimizer.zero_grad(set_to_none=True)
         loss.backward()
         nn.utils.clip_grad_norm_(agent.parameters(), max_grad_norm)
         optimizer.step()
 
-        return v_loss, pg_loss, entropy_loss, approx_kl, old_approx_kl, clipfracs
+        for player, result in results.items():
+            stats[player].append(torch.stack([x.detach() for x in result[1:]]))
+
+    return {player: (*torch.stack(stats[player]).mean(0), clipfracs[player]) for player in players}
 
 
 def write(writer, prefix, results, step):
@@ -621,16 +726,28 @@ def eval2(agent: torch.nn.Module, envs: LuxSyncVectorEnv, writer, seed: int = 0,
 
 
 def main(args, model_device, store_device):
+    # data parallel rank, rank 0 logs, evaluates and saves the model
+    rank = dist.get_rank() if dist.is_initialized() else 0
+    world_size = dist.get_world_size() if dist.is_initialized() else 1
+    log = LOG and rank == 0
+
     player_id = 0
     enemy_id = 1 - player_id
     player = f'player_{player_id}'
-    run_name = f'PUT_RUN_NAME_HERE_seed{args.seed}_{args.eval_seed}'
+    run_name = f'{args.exp_name}_seed{args.seed}_{args.eval_seed}'
     print(run_name)
-    save_path = f'/content/drive/MyDrive/Lux/MA/results/{run_name}/'
-    if not os.path.exists(save_path):
+    save_path = os.path.join(args.save_dir or os.path.join('runs', run_name), '')
+    if rank == 0 and not os.path.exists(save_path):
         os.makedirs(save_path)
-    if LOG:
-        writer = SummaryWriter(f"/content/drive/MyDrive/Lux/MA/results/{run_name}")
+
+    # every rank loads the checkpoint, it has to be on a file system they share
+    resume = load_checkpoint(args.resume) if args.resume else None
+    if resume is not None:
+        logger.info(f"Resuming from global step {resume['global_step']}, update {resume['update']}")
+
+    if log:
+        # events the interrupted run logged after its checkpoint are dropped, the checkpoint's update logged at its step
+        writer = SummaryWriter(save_path, purge_step=resume["global_step"] + 1 if resume is not None else None)
         writer.add_text(
             "hyperparameters",
             "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in vars(args).items()])),
@@ -638,62 +755,109 @@ def main(args, model_device, store_device):
     else:
         writer = None
 
-    save_args(args, save_path+'args.json')
+    if rank == 0:
+        save_args(args, save_path+'args.json')
 
     # TRY NOT TO MODIFY: seeding
-    seeding.set_seed(args.seed)
+    seeding.set_seed(args.seed, rank)
 
     # Create model
-    agent, optimizer = create_model(model_device, args.load_model_path, args.learning_rate, args.max_entity_number, args.seed)
+    agent, optimizer = create_model(model_device, args.load_model_path, args.learning_rate, args.max_entity_number, args.seed, args.bf16, args.compile)
+    if resume is not None:
+        agent.load_state_dict(resume["model"])
+        optimizer.load_state_dict(resume["optimizer"])
+
+    # the learner all-reduces the gradients of the ranks, rollouts and evaluation use the model of the rank. Heads
+    # without entities in a minibatch get no gradient
+    learner = DistributedDataParallel(agent, find_unused_parameters=True) if world_size > 1 else agent
 
     # reset seed after model creation
-    seeding.set_seed(args.seed)
+    seeding.set_seed(args.seed, rank)
+    env_seed = seeding.rank_seed(args.seed, rank)
 
     # env setup
-    envs = LuxSyncVectorEnv(
-        [make_env(i, args.seed + i, args.replay_dir, device=model_device, max_entity_number=args.max_entity_number) for i in range(args.num_envs)],
-        device=model_device
-    )
+    env_fns = [make_env(i, env_seed + i, args.replay_dir, device=model_device, max_entity_number=args.max_entity_number, sparse_valid_actions=args.sparse_valid_actions) for i in range(args.num_envs)]
+    if args.inference_server:
+        logger.warning("--inference-server is experimental, it has not been shown to be faster than lockstep rollouts yet")
+        envs = None
+        server = InferenceServer(env_fns, agent, args.num_steps, args.async_envs or args.num_envs, args.inference_max_wait,
+                                 args.max_entity_number, log_from_global_info, args.envs_per_worker, model_device,
+                                 args.shared_memory)
+    else:
+        envs = LuxSyncVectorEnv(env_fns, device=model_device, envs_per_worker=args.envs_per_worker, shared_memory=args.shared_memory)
     eval_envs = LuxSyncVectorEnv(
-        [make_env(i, args.seed + i, args.replay_dir, device=model_device, max_entity_number=args.max_entity_number) for i in range(args.evaluate_num)],
-        device=model_device
-    )
+        [make_env(i, args.seed + i, args.replay_dir, device=model_device, max_entity_number=args.max_entity_number, sparse_valid_actions=args.sparse_valid_actions) for i in range(args.evaluate_num)],
+        device=model_device,
+        envs_per_worker=args.envs_per_worker,
+        shared_memory=args.shared_memory,
+    ) if rank == 0 and args.evaluate_interval else None
 
     # Start the game
     global_step = 0
     last_eval_step = 0
     last_save_model_step = 0
+    start_update = 1
+    if resume is not None:
+        global_step = resume["global_step"]
+        last_eval_step = resume["last_eval_step"]
+        last_save_model_step = resume["last_save_model_step"]
+        start_update = resume["update"] + 1
+        if rank == 0:
+            # the generators continue where the checkpointed update left them, the checkpoint has rank 0's
+            seeding.set_rng_state(resume["rng"])
+    start_step = global_step
     start_time = time.time()
     num_updates = args.total_timesteps // args.batch_size
+    checkpoints = CheckpointWriter(save_path, args.keep_checkpoints) if rank == 0 else None
 
     # Evaluate at the beggining
-    eval2(agent, eval_envs, writer, seed=args.eval_seed, num_envs=args.evaluate_num, device=model_device, global_step=global_step)
+    if eval_envs is not None and resume is None:
+        eval2(agent, eval_envs, writer, seed=args.eval_seed, num_envs=args.evaluate_num, device=model_device, global_step=global_step)
+
+    # the env seeds of the updates, the inference server resets the envs of an update before the learner gets to it
+    update_seeds = []
+    last_seed = env_seed
+    for _ in range(num_updates):
+        new_seed = np.random.SeedSequence(last_seed).generate_state(2)
+        last_seed = new_seed[0].item()
+        update_seeds.append(new_seed[1].item())
+    if args.inference_server:
+        # the server runs at most one rollout ahead of the learner
+        for seed in update_seeds[start_update - 1:start_update + 1]:
+            server.request(seed)
 
     # Init value stores for PPO
     # Store the value on 'store_device' (cpu)
-    obs = {}
-    actions = {}
-    valid_actions = {}
-    logprobs = dict(player_0=torch.zeros((args.max_train_step, args.num_envs, args.max_entity_number), device=store_device), player_1=torch.zeros((args.max_train_step, args.num_envs, args.max_entity_number), device=store_device))
-    rewards = dict(player_0=torch.zeros((args.max_train_step, args.num_envs, args.max_entity_number), device=store_device), player_1=torch.zeros((args.max_train_step, args.num_envs, args.max_entity_number), device=store_device))
-    dones = dict(player_0=torch.zeros((args.max_train_step, args.num_envs, args.max_entity_number), device=store_device), player_1=torch.zeros((args.max_train_step, args.num_envs, args.max_entity_number), device=store_device))
-    values = dict(player_0=torch.zeros((args.max_train_step, args.num_envs, args.max_entity_number), device=store_device), player_1=torch.zeros((args.max_train_step, args.num_envs, args.max_entity_number), device=store_device))
+    if args.inference_server:
+        # the server collects whole rollouts, see InferenceServer.collect
+        rollout, buffer = None, None
+    elif args.async_envs:
+        # the steps are collected per env and copied to [step, env] once the rollout is done
+        rollout = PerEnvRollout(args.num_envs, args.max_train_step, device=store_device)
+    else:
+        buffer = RolloutBuffer(args.max_train_step, args.num_envs, device=store_device,
+                               pin_memory=args.pin_memory and torch.device(model_device).type == "cuda")
 
     logger.info("Starting train")
-    last_seed = args.seed
-    for update in range(1, num_updates + 1):
+    for update in range(start_update, num_updates + 1):
 
         logger.info(f"Update {update} / {num_updates}")
 
-        new_seed = np.random.SeedSequence(last_seed).generate_state(2)
-        last_seed = new_seed[0].item()
-        new_seed = new_seed[1].item()
+        new_seed = update_seeds[update - 1]
         seeding.set_seed(new_seed)
 
-        # Reset envs, get obs
-        next_obs, _ = envs.reset(seed=new_seed)
-        next_obs = tree.map_structure(lambda x: np2torch(x, torch.float32), next_obs)
-        next_done = torch.zeros((args.num_envs, 2, args.max_entity_number), device=store_device, dtype=torch.bool)
+        # Reset envs, get obs. The inference server resets its envs itself
+        if args.inference_server:
+            next_obs, next_done = None, None
+        else:
+            next_obs, _ = envs.reset(seed=new_seed)
+            next_done = torch.zeros((args.num_envs, 2, args.max_entity_number), device=store_device, dtype=torch.bool)
+            if args.async_envs:
+                next_obs = tree.map_structure(lambda x: np2torch(x, torch.float32), next_obs)
+            else:
+                # the observations and dones of a step are written by the step before it, the first ones here
+                buffer.insert(0, {"obs": next_obs, "dones": per_player(next_done)}, dtype=torch.float32)
+                next_obs = buffer.row(0, "obs")
 
         # Annealing the rate if instructed to do so.
         if args.anneal_lr:
@@ -713,91 +877,99 @@ def main(args, model_device, store_device):
         global_info_save = {}
         first_episode = np.ones(args.num_envs, dtype=bool)
 
-        for step in range(0, args.num_steps):
-
-            if (step+1) % (args.num_steps / 8) == 0:
-                logger.info(f"Step {step + 1} / {args.num_steps}")
-
-            train_step += 1
-            global_step += 1 * args.num_envs
-
-            # Save obervations for PPO
-            for player_id, player in enumerate(['player_0', 'player_1']):
-                for env_id in range(0, args.num_envs):
-                    # insert tensor [env, player, entity] into [player, step, env, entity]
-                    dones[player][train_step, env_id] = next_done[env_id, player_id]
-            put_into_store(next_obs, train_step, obs, args.max_train_step, args.num_envs, store_device)
-
-            # Sample actions
-            action, valid_action, logprob, value = sample_actions_for_players(envs, agent, next_obs, model_device, store_device)
-
-            # Save actions for PPO
-            put_into_store(action, train_step, actions, args.max_train_step, args.num_envs, store_device)
-            put_into_store(valid_action, train_step, valid_actions, args.max_train_step, args.num_envs, store_device)
-            for player in ['player_0', 'player_1']:
-                logprobs[player][train_step] = logprob[player]
-                values[player][train_step] = value[player]
-
-            # Step environment
-            _action = {}
-            for player_id, player in enumerate(['player_0', 'player_1']):
-                _action[player_id] = action[player]
-            action = tree.map_structure(lambda x: torch2np(x, np.int32), _action)
-            del _action
-            next_obs, reward, terminated, truncation, info = envs.step(action)
-            next_obs = tree.map_structure(lambda x: np2torch(x, torch.float32), next_obs)
-
-            # reward is shape (env, player, group)
-            episode_return += np.mean(np.sum(reward, axis=-1), axis=-1)
-
-            step_counts += 1
-
-            reward = np2torch(reward, torch.float32)
-
-            done = terminated | truncation
-            # all entities done for a player, at least one player is done
-            _done = done.all(axis=-1).any(-1)
-            if step == args.num_steps-1:
-                _done[:] = 1
-            next_done = np2torch(done, torch.bool)
+        for step in range(0, 1 if args.async_envs or args.inference_server else args.num_steps):
+            if args.inference_server:
+                # the rollout the server collected for this update, with the policy of the last update or the one before
+                collected = server.collect()
+                episode_return_list, episode_lengths = collected["episode_returns"], collected["episode_lengths"]
+                global_info_save = collected["global_info"]
+                policy_lag = server.policy_lag(collected["data"].pop("policy_versions")).float()
+                logger.info(f"policy lag {policy_lag.mean().item():.2f} (max {policy_lag.max().item():.0f}) updates, mean inference batch {collected['mean_batch_size']:.1f} envs")
+                if log:
+                    writer.add_scalar("charts/policy_lag", policy_lag.mean().item(), global_step)
+                    writer.add_scalar("charts/policy_lag_max", policy_lag.max().item(), global_step)
+                    writer.add_scalar("charts/inference_batch_size", collected["mean_batch_size"], global_step)
+                global_step += args.num_envs * args.num_steps
+                step = args.num_steps - 1
+                train_step = args.max_train_step - 1
+            elif args.async_envs:
+                # the whole rollout at once, sampling actions for whichever envs are done stepping first
+                rollout.reset()
+                next_obs, next_done, episode_return_list, episode_lengths, global_info_save = collect_rollout_async(envs, agent, rollout, next_obs, args.async_envs, args.max_entity_number, model_device, store_device)
+                global_step += args.num_envs * args.num_steps
+                step = args.num_steps - 1
+                train_step = args.max_train_step - 1
+            else:
+                if (step+1) % (args.num_steps / 8) == 0:
+                    logger.info(f"Step {step + 1} / {args.num_steps}")
 
-            # Save rewards for PPO
-            for player_id, player in enumerate(['player_0', 'player_1']):
-                rewards[player][train_step] = reward[:, player_id]
+                train_step += 1
+                global_step += 1 * args.num_envs
 
-            # Save global info
-            for key in log_from_global_info:
-                for env_id in range(args.num_envs):
+                # Sample actions
+                action, valid_action, logprob, value = sample_actions_for_players(envs, agent, next_obs, model_device, store_device)
 
-                    if not first_episode[env_id]:
-                        continue
+                # Save actions for PPO
+                buffer.insert(train_step, {"actions": action, "valid_actions": valid_action, "logprobs": logprob, "values": value})
 
-                    for player in ["player_0", "player_1"]:
-                        if player not in global_info_save:
-                            global_info_save[player] = {}
-                        if "total" not in global_info_save:
-                            global_info_save["total"] = {}
-                        if key not in global_info_save[player]:
-                            global_info_save[player][key] = 0
-                        if key not in global_info_save["total"]:
-                            global_info_save["total"][key] = 0
-
-                        global_info_save[player][key] += info[player][env_id][key]
-                        global_info_save["total"][key] += info[player][env_id][key]
-
-            # Save stats
-            if _done.any():
-                done_envs_all = [d.item() for d in np.where(_done==True)[0]]
-                done_envs = [d.item() for d in np.where((_done==True) & (first_episode==True))[0]]
-                for env_ind in done_envs:
-                    episode_return_list.append(episode_return[env_ind])
-                    episode_lengths.append(step_counts[env_ind])
-                episode_return[done_envs_all] = 0
-                step_counts[done_envs_all] = 0
-                first_episode[done_envs_all] = False
-
-            total_return += cal_mean_return(info['agents'], player_id=0)
-            total_return += cal_mean_return(info['agents'], player_id=1)
+                # Step environment
+                _action = {}
+                for player_id, player in enumerate(['player_0', 'player_1']):
+                    _action[player_id] = action[player]
+                action = tree.map_structure(lambda x: torch2np(x, np.int32), _action)
+                del _action
+                next_obs, reward, terminated, truncation, info = envs.step(action)
+
+                # reward is shape (env, player, group)
+                episode_return += np.mean(np.sum(reward, axis=-1), axis=-1)
+
+                step_counts += 1
+
+                done = terminated | truncation
+                # all entities done for a player, at least one player is done
+                _done = done.all(axis=-1).any(-1)
+                if step == args.num_steps-1:
+                    _done[:] = 1
+                next_done = torch.from_numpy(done)
+
+                # Save rewards, and the observations and dones of the next step for PPO
+                buffer.insert(train_step, {"rewards": per_player(reward)}, dtype=torch.float32)
+                buffer.insert(train_step + 1, {"obs": next_obs, "dones": per_player(done)}, dtype=torch.float32)
+                next_obs = buffer.row(train_step + 1, "obs")
+
+                # Save global info
+                for key in log_from_global_info:
+                    for env_id in range(args.num_envs):
+
+                        if not first_episode[env_id]:
+                            continue
+
+                        for player in ["player_0", "player_1"]:
+                            if player not in global_info_save:
+                                global_info_save[player] = {}
+                            if "total" not in global_info_save:
+                                global_info_save["total"] = {}
+                            if key not in global_info_save[player]:
+                                global_info_save[player][key] = 0
+                            if key not in global_info_save["total"]:
+                                global_info_save["total"][key] = 0
+
+                            global_info_save[player][key] += info[player][env_id][key]
+                            global_info_save["total"][key] += info[player][env_id][key]
+
+                # Save stats
+                if _done.any():
+                    done_envs_all = [d.item() for d in np.where(_done==True)[0]]
+                    done_envs = [d.item() for d in np.where((_done==True) & (first_episode==True))[0]]
+                    for env_ind in done_envs:
+                        episode_return_list.append(episode_return[env_ind])
+                        episode_lengths.append(step_counts[env_ind])
+                    episode_return[done_envs_all] = 0
+                    step_counts[done_envs_all] = 0
+                    first_episode[done_envs_all] = False
+
+                total_return += cal_mean_return(info['agents'], player_id=0)
+                total_return += cal_mean_return(info['agents'], player_id=1)
 
             if (step == args.num_steps-1):
                 return_mean = np.mean(episode_return_list)
@@ -805,7 +977,7 @@ def main(args, model_device, store_device):
                 length_mean = np.mean(episode_lengths)
                 length_median = np.median(episode_lengths)
                 logger.info(f"global_step={global_step}, total_return={return_mean.round(8)} ({return_median.round(8)}), episode_length={length_mean.round(2)} ({length_median.round(2)})")
-                if LOG:
+                if log:
                     writer.add_scalar("charts/episodic_total_return", return_mean, global_step)
                     writer.add_scalar("charts/episodic_length", length_mean, global_step)
                     mean_episode_sub_return = {}
@@ -824,7 +996,14 @@ def main(args, model_device, store_device):
             # Train with PPO
             if train_step >= args.max_train_step-1 or step == args.num_steps-1:
                 logger.info("Training with PPO")
-                returns, advantages = calculate_returns(envs, agent, next_obs, next_done, dones, rewards, values, args.max_train_step, args.num_envs, args.max_entity_number, args.gamma, args.gae_lambda, model_device, store_device)
+                if args.inference_server:
+                    data = collected.pop("data")
+                else:
+                    data = rollout.step_major() if args.async_envs else buffer.data
+                obs, actions, valid_actions = data["obs"], data["actions"], data["valid_actions"]
+                logprobs, values, rewards, dones = data["logprobs"], data["values"], data["rewards"], data["dones"]
+                del data
+                returns, advantages = calculate_returns(dones, rewards, values, args.max_train_step, args.num_envs, args.max_entity_number, args.gamma, args.gae_lambda, model_device, args.gae_impl)
 
                 # flatten the batch
                 b_obs = obs
@@ -856,8 +1035,12 @@ def main(args, model_device, store_device):
                     total_weight_norm_total = 0
                     total_bias_norm_total = 0
 
+                    if args.joint_players:
+                        results = optimize_for_players(['player_0', 'player_1'], learner, optimizer, _b_inds, b_obs, b_va, b_actions, b_logprobs, b_advantages, b_returns, b_values, args.max_entity_number, args.train_num_collect, args.minibatch_size, args.clip_vloss, args.clip_coef, args.norm_adv, args.ent_coef, args.vf_coef, args.max_grad_norm, model_device)
                     for player_id, player in enumerate(['player_0', 'player_1']):
-                        v_loss, pg_loss, entropy_loss, approx_kl, old_approx_kl, clipfracs = optimize_for_player(player, agent, optimizer, _b_inds, b_obs, b_va, b_actions, b_logprobs, b_advantages, b_returns, b_values, args.max_entity_number, args.train_num_collect, args.minibatch_size, args.clip_vloss, args.clip_coef, args.norm_adv, args.ent_coef, args.vf_coef, args.max_grad_norm, model_device)
+                        if not args.joint_players:
+                            results = optimize_for_players([player], learner, optimizer, _b_inds, b_obs, b_va, b_actions, b_logprobs, b_advantages, b_returns, b_values, args.max_entity_number, args.train_num_collect, args.minibatch_size, args.clip_vloss, args.clip_coef, args.norm_adv, args.ent_coef, args.vf_coef, args.max_grad_norm, model_device)
+                        v_loss, pg_loss, entropy_loss, approx_kl, old_approx_kl, clipfracs = results[player]
                         clipfracs += clipfracs
                         clipfracs_total += clipfracs
 
@@ -868,9 +1051,16 @@ def main(args, model_device, store_device):
                         old_approx_kl_total += old_approx_kl
 
                         if args.target_kl is not None:
+                            if world_size > 1:
+                                # every rank stops after the same player
+                                approx_kl = approx_kl.clone()
+                                dist.all_reduce(approx_kl)
+                                approx_kl /= world_size
                             if approx_kl > args.target_kl:
                                 print(f"Approx KL {approx_kl} > Target KL {args.target_kl}")
-                                break
+                                # a joint pass already trained the other player too, its stats are still logged
+                                if not args.joint_players:
+                                    break
 
                         y_pred, y_true = b_values[player].cpu().numpy(), b_returns[player].cpu().numpy()
                         var_y = np.var(y_true)
@@ -890,7 +1080,7 @@ def main(args, model_device, store_device):
                         valid_sample_count_total += valid_sample_count
 
                         # TRY NOT TO MODIFY: record rewards for plotting purposes
-                        if LOG:
+                        if log:
                             writer.add_scalar(f"losses/value_loss_{player_id}", v_loss.item(), global_step)
                             writer.add_scalar(f"losses/policy_loss_{player_id}", pg_loss.item(), global_step)
                             writer.add_scalar(f"losses/entropy_{player_id}", entropy_loss.item(), global_step)
@@ -916,7 +1106,7 @@ def main(args, model_device, store_device):
                             total_weight_norm_total += total_weight_norm
                             total_bias_norm_total += total_bias_norm
 
-                    if LOG:
+                    if log:
                         v_loss_total /= 2
                         pg_loss_total /= 2
                         entropy_loss_total /= 2
@@ -954,42 +1144,108 @@ def main(args, model_device, store_device):
                 gc.collect()
                 torch.cuda.empty_cache()
 
-                if LOG:
+                if log:
                     writer.add_scalar("charts/learning_rate", optimizer.param_groups[0]["lr"], global_step)
-                    writer.add_scalar("charts/SPS", round(global_step / (time.time() - start_time), 2), global_step)
-                    writer.add_scalar("charts/SPR", round((time.time() - start_time) / update, 2), global_step)
+                    writer.add_scalar("charts/SPS", round((global_step - start_step) * world_size / (time.time() - start_time), 2), global_step)
+                    writer.add_scalar("charts/SPR", round((time.time() - start_time) / (update - start_update + 1), 2), global_step)
 
-                logger.info(f"SPS: {round(global_step / (time.time() - start_time), 2)}")
-                logger.info(f"SPR: {round((time.time() - start_time) / update, 2)}")
+                logger.info(f"SPS: {round((global_step - start_step) * world_size / (time.time() - start_time), 2)}")
+                logger.info(f"SPR: {round((time.time() - start_time) / (update - start_update + 1), 2)}")
                 logger.info(f"global step: {global_step}")
 
-                reset_store(obs)
-                reset_store(actions)
-                reset_store(valid_actions)
-
-                for player_id, player in enumerate(['player_0', 'player_1']):
-                    logprobs[player][:] = 0
-                    rewards[player][:] = 0
-                    dones[player][:] = 0
-                    values[player][:] = 0
+                if args.inference_server:
+                    server.publish(agent)
+                    # the rollout after the next one starts with the weights of this update
+                    if update + 1 < num_updates:
+                        server.request(update_seeds[update + 1])
+                elif not args.async_envs:
+                    # the next rollout continues from the last observations
+                    buffer.reset()
+                    next_obs = buffer.row(0, "obs")
 
                 train_step = -1
 
             # Evaluate initially
-            if args.evaluate_interval and (global_step - last_eval_step) >= args.evaluate_interval:
+            if eval_envs is not None and (global_step - last_eval_step) >= args.evaluate_interval:
                 eval2(agent, eval_envs, writer, seed=args.eval_seed, num_envs=args.evaluate_num, device=model_device, global_step=global_step)
                 last_eval_step = global_step
 
-            # Save model
-            if args.save_interval and (global_step - last_save_model_step) >= args.save_interval:
-                save_model(agent, save_path+f'model_{global_step}.pth')
-                last_save_model_step = global_step
-
-    envs.close()
-    if LOG:
+        # Save model after the update, the checkpoint has everything --resume needs to continue with the next one
+        if rank == 0 and args.save_interval and (global_step - last_save_model_step) >= args.save_interval:
+            last_save_model_step = global_step
+            checkpoints.save(global_step, {
+                "model": agent.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "global_step": global_step,
+                "update": update,
+                "last_eval_step": last_eval_step,
+                "last_save_model_step": last_save_model_step,
+                "rng": seeding.get_rng_state(),
+            }, model_path=save_path+f'model_{global_step}.pth')
+
+    if checkpoints is not None:
+        checkpoints.close()
+    if args.inference_server:
+        server.close()
+    else:
+        envs.close()
+    if eval_envs is not None:
+        eval_envs.close()
+    if log:
         writer.close()
 
 
+def init_converters(device1: torch.device, device2: torch.device):
+    """
+    the conversions between arrays and tensors of the module, for every process that runs main
+    """
+    global np2torch, cpu2device, device2cpu, torch2np
+    np2torch = lambda x, dtype: torch.tensor(x, device=device2, dtype=dtype)
+    cpu2device = lambda x: x.to(device1)
+    device2cpu = lambda x: x.detach().to(device2)
+    torch2np = lambda x, dtype: x.detach().cpu().numpy().astype(dtype)
+
+
+def run_rank(rank: int, world_size: int, init_method: str, args, model_device: torch.device, store_device: torch.device):
+    """
+    one data parallel learner: joins the gloo process group and runs main. The ranks on a machine share its cores
+    """
+    local_rank = int(os.environ.get("LOCAL_RANK", rank))
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    if model_device.type == "cuda":
+        model_device = torch.device("cuda", local_rank % torch.cuda.device_count())
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    if rank > 0:
+        logger.setLevel(logging.WARNING)
+    init_converters(model_device, store_device)
+
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        main(args, model_device, store_device)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(args, model_device: torch.device, store_device: torch.device):
+    """
+    runs main in this process, or as a rank of a data parallel run: one of args.num_ranks processes started here, or
+    one of torchrun's (WORLD_SIZE is set) for runs over several machines
+    """
+    if "WORLD_SIZE" in os.environ:
+        run_rank(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]), "env://", args, model_device, store_device)
+    elif args.num_ranks > 1:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        torch.multiprocessing.spawn(
+            run_rank,
+            args=(args.num_ranks, f"tcp://127.0.0.1:{port}", args, model_device, store_device),
+            nprocs=args.num_ranks,
+        )
+    else:
+        main(args, model_device, store_device)
+
+
 if __name__ == "__main__":
     torch.multiprocessing.set_start_method('spawn')
 
@@ -1001,9 +1257,6 @@ if __name__ == "__main__":
 
     logger.info(f"Device: {device1}")
 
-    np2torch = lambda x, dtype: torch.tensor(x, device=device2, dtype=dtype)
-    cpu2device = lambda x: x.to(device1)
-    device2cpu = lambda x: x.detach().to(device2)
-    torch2np = lambda x, dtype: x.detach().cpu().numpy().astype(dtype)
+    init_converters(device1, device2)
 
-    main(args, device1, device2)
+    launch(args, device1, device2)
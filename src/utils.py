@@ -12,9 +12,10 @@ import logging
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s %(module)s %(funcName)s %(message)s',
                     handlers=[logging.StreamHandler()])
-stream_handler = [h for h in logging.root.handlers if isinstance(h , logging.StreamHandler)][0]
-stream_handler.setLevel(logging.INFO)
-stream_handler.setStream(sys.stderr)
+# the handler basicConfig added, not the subclasses others (pytest) attach to the root logger
+for stream_handler in [h for h in logging.root.handlers if type(h) is logging.StreamHandler]:
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setStream(sys.stderr)
 logger = logging.getLogger("utils")
 
 
@@ -123,10 +124,10 @@ class LuxRecordEpisodeStatistics(gym.Wrapper):
             infos
         )
 
-def make_env(env_id, seed, replay_dir, device="cpu", max_entity_number: int = 1000):
+def make_env(env_id, seed, replay_dir, device="cpu", max_entity_number: int = 1000, sparse_valid_actions: bool = False):
     def thunk():
         logger.info(f"Creating environment {env_id} with seed {seed}")
-        env = LuxEnv(replay_dir, device, max_entity_number)
+        env = LuxEnv(replay_dir, device, max_entity_number, sparse_valid_actions)
         env = LuxRecordEpisodeStatistics(env)
         env.seed(seed)
         return env